@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from app.core.config import SHOPIFY_BULK_THRESHOLD
+from app.database import SessionLocal
+
+
+def cmd_import_products(args: argparse.Namespace) -> int:
+    from app.services.product_import import import_products
+
+    path = Path(args.file)
+    fmt = (args.format or path.suffix.lstrip(".")).lower()
+    db = SessionLocal()
+    try:
+        with path.open("rb") as fh:
+            report = import_products(db, fh, fmt=fmt, chunk_size=args.chunk_size)
+    finally:
+        db.close()
+    print(json.dumps(report.model_dump(), indent=2, ensure_ascii=False))
+    return 1 if report.failed else 0
+
+
+def cmd_rebuild_sales_rollups(args: argparse.Namespace) -> int:
+    from app.services import sales_rollup
+
+    db = SessionLocal()
+    try:
+        rows = sales_rollup.rebuild(db)
+    finally:
+        db.close()
+    print(f"sales_daily ricostruita: {rows} righe")
+    return 0
+
+
+def cmd_create_stock_checkpoint(args: argparse.Namespace) -> int:
+    from app.services import stock_history
+
+    db = SessionLocal()
+    try:
+        cp = stock_history.create_checkpoint(db, note=args.note)
+        print(f"checkpoint {cp.id} salvato alle {cp.taken_at.isoformat()}")
+    finally:
+        db.close()
+    return 0
+
+
+def cmd_generate_image_derivatives(args: argparse.Namespace) -> int:
+    from app.services import images
+
+    if not images.available():
+        print("Pillow non installato: impossibile generare i derivati", file=sys.stderr)
+        return 1
+    db = SessionLocal()
+    try:
+        stats = images.backfill(db, args.files or images.upload_sources(), force=args.force)
+    finally:
+        db.close()
+        images.shutdown()
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["failed"] else 0
+
+
+def cmd_gc_uploads(args: argparse.Namespace) -> int:
+    from app.services.uploads import collect_garbage
+
+    db = SessionLocal()
+    try:
+        stats = collect_garbage(db, grace_hours=args.grace_hours, dry_run=args.dry_run)
+    finally:
+        db.close()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+def cmd_mirror_remote_images(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app.services import image_mirror, images
+
+    async def run() -> dict:
+        totals = {"mirrored": 0, "failed": 0, "skipped": 0, "products": 0}
+        try:
+            while True:
+                stats = await image_mirror.run_once(limit=args.batch_size)
+                for key in totals:
+                    totals[key] += stats[key]
+                # niente più da fare, oppure solo URL presi in carico da un altro processo
+                if stats["pending"] == stats["skipped"]:
+                    return totals
+        finally:
+            await image_mirror.stop()
+            images.shutdown()
+
+    totals = asyncio.run(run())
+    print(json.dumps(totals, indent=2))
+    return 1 if totals["failed"] else 0
+
+
+def cmd_shopify_sync(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app.services import shopify_sync
+    from app.shopify import ShopifyError
+
+    async def run() -> dict:
+        db = SessionLocal()
+        try:
+            async with shopify_sync.client_from_env() as client:
+                return await shopify_sync.sync_catalogue(db, client, bulk_threshold=args.bulk_threshold)
+        finally:
+            db.close()
+
+    try:
+        result = asyncio.run(run())
+    except ShopifyError as exc:
+        print(f"Sincronizzazione Shopify fallita: {exc}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 1 if result["failed"] else 0
+
+
+def cmd_shopify_queue(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app.services import shopify_queue, shopify_sync
+
+    db = SessionLocal()
+    try:
+        if args.retry_dead:
+            print(f"rimesse in coda: {shopify_queue.retry_dead(db)}")
+        if args.drain:
+            async def drain() -> dict:
+                totals = {"synced": 0, "failed": 0}
+                async with shopify_sync.client_from_env() as client:
+                    while (stats := await shopify_queue.run_once(client))["claimed"]:
+                        totals["synced"] += stats["synced"]
+                        totals["failed"] += stats["failed"]
+                return totals
+
+            print(json.dumps(asyncio.run(drain()), indent=2))
+        stats = shopify_queue.status(db)
+    finally:
+        db.close()
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["dead"] else 0
+
+
+def cmd_shopify_orders(args: argparse.Namespace) -> int:
+    from app.services import shopify_orders
+
+    db = SessionLocal()
+    try:
+        if args.retry_dead:
+            print(f"rimessi in coda: {shopify_orders.retry_dead(db)}")
+        if args.drain:
+            totals = {"events": 0, "movements": 0, "skipped": 0}
+            while (stats := shopify_orders.process_batch())["events"]:
+                for key in totals:
+                    totals[key] += stats[key]
+            print(json.dumps(totals, indent=2))
+        stats = shopify_orders.status(db)
+    finally:
+        db.close()
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["dead"] else 0
+
+
+def cmd_shopify_reconcile(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app.services import shopify_reconcile, shopify_sync
+    from app.shopify import ShopifyError
+
+    async def run():
+        async with shopify_sync.client_from_env() as client:
+            return await shopify_reconcile.reconcile(db, client, dry_run=args.dry_run)
+
+    db = SessionLocal()
+    try:
+        report = asyncio.run(run())
+        print(
+            f"riconciliazione {report.id}: {report.checked} controllati, {report.differences} differenze, "
+            f"{report.pushed} corretti, {report.missing_remote} non attivi sulla location Shopify, "
+            f"{report.not_linked} non collegati, {report.unknown_remote} solo su Shopify"
+        )
+    except ShopifyError as exc:
+        print(f"Riconciliazione Shopify fallita: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+def cmd_migrate(args: argparse.Namespace) -> int:
+    from app import migrations
+    from app.database import engine
+
+    if args.status:
+        with engine.connect() as conn:
+            version = migrations.current_version(conn)
+        print(f"schema alla versione {version} (ultima disponibile: {migrations.LATEST})")
+        return 0 if version >= migrations.LATEST else 1
+    applied = migrations.migrate(engine)
+    for migration in applied:
+        print(f"applicata {migration.version:03d} {migration.name}")
+    if not applied:
+        print(f"schema già aggiornato (versione {migrations.LATEST})")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Comandi di manutenzione Nucizzz IMS")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="Applica le migrazioni di schema mancanti (prima di avviare i worker)")
+    p.add_argument("--status", action="store_true", help="Mostra solo la versione corrente")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("import-products", help="Importa prodotti e stock da CSV/JSONL")
+    p.add_argument("file", help="Percorso del file .csv o .jsonl")
+    p.add_argument("--format", choices=["csv", "jsonl", "ndjson"], help="Default: dedotto dall'estensione")
+    p.add_argument("--chunk-size", type=int, default=1000)
+    p.set_defaults(func=cmd_import_products)
+
+    p = sub.add_parser("rebuild-sales-rollups", help="Ricostruisce sales_daily dallo storico movimenti")
+    p.set_defaults(func=cmd_rebuild_sales_rollups)
+
+    p = sub.add_parser("create-stock-checkpoint", help="Salva una fotografia dello stock attuale (da cron)")
+    p.add_argument("--note")
+    p.set_defaults(func=cmd_create_stock_checkpoint)
+
+    p = sub.add_parser("generate-image-derivatives", help="Genera miniature WebP/AVIF per le immagini in uploads/")
+    p.add_argument("files", nargs="*", help="Nomi file in uploads/ (default: tutti)")
+    p.add_argument("--force", action="store_true", help="Rigenera anche i derivati esistenti")
+    p.set_defaults(func=cmd_generate_image_derivatives)
+
+    p = sub.add_parser("gc-uploads", help="Elimina le immagini caricate non più usate da nessun prodotto")
+    p.add_argument("--grace-hours", type=float, default=24, help="Non toccare file più recenti di così (default 24)")
+    p.add_argument("--dry-run", action="store_true", help="Mostra solo cosa verrebbe eliminato")
+    p.set_defaults(func=cmd_gc_uploads)
+
+    p = sub.add_parser("mirror-remote-images", help="Copia in locale le immagini remote dei prodotti (lookup barcode)")
+    p.add_argument("--batch-size", type=int, default=50)
+    p.set_defaults(func=cmd_mirror_remote_images)
+
+    p = sub.add_parser("shopify-sync", help="Pubblica catalogo e giacenze su Shopify")
+    p.add_argument("--bulk-threshold", type=int, default=SHOPIFY_BULK_THRESHOLD,
+                   help="Oltre questo numero di prodotti usa una bulk operation (0 = sempre)")
+    p.set_defaults(func=cmd_shopify_sync)
+
+    p = sub.add_parser("shopify-queue", help="Stato della coda giacenze verso Shopify")
+    p.add_argument("--retry-dead", action="store_true", help="Rimette in coda le righe in dead letter")
+    p.add_argument("--drain", action="store_true", help="Invia subito tutto ciò che è dovuto (senza aspettare il worker)")
+    p.set_defaults(func=cmd_shopify_queue)
+
+    p = sub.add_parser("shopify-orders", help="Stato della coda ordini/resi ricevuti dai webhook Shopify")
+    p.add_argument("--retry-dead", action="store_true", help="Rimette in coda gli eventi in dead letter")
+    p.add_argument("--drain", action="store_true", help="Applica subito gli eventi in coda (senza aspettare il worker)")
+    p.set_defaults(func=cmd_shopify_orders)
+
+    p = sub.add_parser("shopify-reconcile", help="Confronta le giacenze con Shopify e corregge solo le differenze (da cron)")
+    p.add_argument("--dry-run", action="store_true", help="Registra il report senza correggere")
+    p.set_defaults(func=cmd_shopify_reconcile)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
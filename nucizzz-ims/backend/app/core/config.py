@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from pathlib import Path
 
 # RapidAPI credentials (never expose in frontend)
 RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY", "")
@@ -12,3 +13,62 @@ RAPIDAPI_QUERY_PARAM = os.getenv("RAPIDAPI_QUERY_PARAM", "barcode")
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "6.0"))
 OPEN_TIMEOUT = float(os.getenv("OPEN_TIMEOUT", "2.5"))
 CACHE_TTL = int(os.getenv("CACHE_TTL", "900"))  # 15 minuti di default
+
+# Scorte minime
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "5"))
+LOW_STOCK_CACHE_TTL = float(os.getenv("LOW_STOCK_CACHE_TTL", "30"))
+
+# Cache HTTP per le letture di catalogo (0 = il browser rivalida sempre con If-None-Match)
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "0"))
+
+# Registro in memoria delle location: ogni quanti secondi verificare modifiche da altri worker
+LOCATION_REGISTRY_REFRESH = float(os.getenv("LOCATION_REGISTRY_REFRESH", "10"))
+
+# Indice barcode -> prodotto in memoria: ogni quanti secondi verificare modifiche da altri worker
+BARCODE_INDEX_REFRESH = float(os.getenv("BARCODE_INDEX_REFRESH", "5"))
+
+# Idempotency-Key sulle scritture di movimenti/ricezioni: per quante ore si conserva la risposta
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# oltre questo tempo una chiave prenotata senza risposta è considerata abbandonata (nessuna scrittura salvata)
+IDEMPOTENCY_PENDING_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "300"))
+
+# Upload immagini
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", str(Path(__file__).resolve().parent.parent / "uploads")))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "15")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_KB", "256")) * 1024
+
+# Derivati immagini (miniatura/media WebP, AVIF se supportato da Pillow)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_THUMB_PX = int(os.getenv("IMAGE_THUMB_PX", "320"))
+IMAGE_MEDIUM_PX = int(os.getenv("IMAGE_MEDIUM_PX", "1024"))
+IMAGE_AVIF = os.getenv("IMAGE_AVIF", "true").lower() in ("1", "true", "yes")
+
+# Copia locale delle immagini remote (lookup barcode): download concorrenti, intervallo del worker, tentativi
+IMAGE_MIRROR_ENABLED = os.getenv("IMAGE_MIRROR_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_MIRROR_CONCURRENCY = int(os.getenv("IMAGE_MIRROR_CONCURRENCY", "4"))
+IMAGE_MIRROR_INTERVAL = float(os.getenv("IMAGE_MIRROR_INTERVAL", "60"))
+IMAGE_MIRROR_MAX_ATTEMPTS = int(os.getenv("IMAGE_MIRROR_MAX_ATTEMPTS", "5"))
+# host (e sottodomini) da cui copiare le immagini, separati da virgola; vuoto = qualsiasi host pubblico
+IMAGE_MIRROR_ALLOWED_HOSTS = tuple(h.strip().lower() for h in os.getenv("IMAGE_MIRROR_ALLOWED_HOSTS", "").split(",") if h.strip())
+
+# Shopify Admin API (GraphQL)
+SHOPIFY_SHOP = os.getenv("SHOPIFY_SHOP", "")
+SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
+SHOPIFY_LOCATION_ID = os.getenv("SHOPIFY_LOCATION_ID", "")
+SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-10")
+DISABLE_SHOPIFY = os.getenv("DISABLE_SHOPIFY", "").lower() in ("1", "true", "yes")
+# oltre questo numero di prodotti la sincronizzazione usa una bulk operation invece delle mutation a blocchi
+SHOPIFY_BULK_THRESHOLD = int(os.getenv("SHOPIFY_BULK_THRESHOLD", "250"))
+# attesa massima (secondi) di una bulk operation ferma in CREATED/RUNNING prima di dare errore
+SHOPIFY_BULK_TIMEOUT = float(os.getenv("SHOPIFY_BULK_TIMEOUT", "3600"))
+# location locale il cui stock viene pubblicato su Shopify (vuoto = totale di tutte le location)
+SHOPIFY_STOCK_LOCATION = os.getenv("SHOPIFY_STOCK_LOCATION", "")
+# coda di sincronizzazione giacenze: righe per giro, attesa per accorpare le modifiche, polling, tentativi
+SHOPIFY_SYNC_BATCH = int(os.getenv("SHOPIFY_SYNC_BATCH", "100"))
+SHOPIFY_SYNC_DEBOUNCE = float(os.getenv("SHOPIFY_SYNC_DEBOUNCE", "1.0"))
+SHOPIFY_SYNC_INTERVAL = float(os.getenv("SHOPIFY_SYNC_INTERVAL", "30"))
+SHOPIFY_SYNC_MAX_ATTEMPTS = int(os.getenv("SHOPIFY_SYNC_MAX_ATTEMPTS", "8"))
+# webhook ordini/rimborsi: secret dell'app per la firma HMAC, location da cui scaricare le vendite online
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET", "")
+SHOPIFY_ORDERS_LOCATION = os.getenv("SHOPIFY_ORDERS_LOCATION", "") or SHOPIFY_STOCK_LOCATION or "warehouse"
+SHOPIFY_ORDERS_BATCH = int(os.getenv("SHOPIFY_ORDERS_BATCH", "50"))
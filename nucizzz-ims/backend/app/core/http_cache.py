@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from app.core.config import CATALOG_MAX_AGE
+from app.core.table_versions import get_versions
+
+
+def cache_control() -> str:
+    if CATALOG_MAX_AGE > 0:
+        return f"private, max-age={CATALOG_MAX_AGE}, must-revalidate"
+    return "private, no-cache"
+
+
+def catalog_etag(db: Session, request: Request, tables: Iterable[str]) -> str:
+    """ETag debole da contatori di modifica delle tabelle + URL: costa una sola query sulla PK."""
+    versions = get_versions(db, tables)
+    raw = "|".join(f"{name}:{version}" for name, version in sorted(versions.items()))
+    digest = hashlib.blake2b(f"{raw}|{request.url.path}?{request.url.query}".encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def not_modified(db: Session, request: Request, tables: Iterable[str]) -> tuple[str, Optional[Response]]:
+    """
+    Calcola l'ETag e, se il client ha già questa versione (If-None-Match), restituisce subito il 304
+    senza eseguire la query principale.
+    """
+    etag = catalog_etag(db, request, tables)
+    if _matches(request.headers.get("if-none-match"), etag):
+        return etag, Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control()})
+    return etag, None
+
+
+def with_cache_headers(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control()
+    return response
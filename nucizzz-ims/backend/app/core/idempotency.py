@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import IDEMPOTENCY_PENDING_SECONDS, IDEMPOTENCY_TTL_HOURS
+from app.core.responses import FastJSONResponse, dumps
+
+MAX_KEY_LENGTH = 128
+CLEANUP_INTERVAL = 600.0
+REPLAY_HEADER = "Idempotent-Replayed"
+# session.info: dentro IdempotentRequest il commit della scrittura lo fa done(), insieme alla risposta
+_DEFER_KEY = "idempotency_defer_commit"
+_AFTER_KEY = "idempotency_after_commit"
+
+_last_cleanup = 0.0
+
+
+def _expiry() -> datetime:
+    return datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+
+def purge_expired(db: Session) -> int:
+    res = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < _expiry()))
+    db.commit()
+    return res.rowcount or 0
+
+
+def _maybe_cleanup(db: Session) -> None:
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup >= CLEANUP_INTERVAL:
+        _last_cleanup = now
+        purge_expired(db)
+
+
+def commit_or_defer(db: Session, *after: Callable[[], Any]) -> bool:
+    """
+    Commit di una scrittura seguito dalle azioni post-commit (cache, notifiche). Dentro un IdempotentRequest
+    con chiave si fa solo il flush: il commit avviene in done(), nella stessa transazione della risposta
+    salvata, e le azioni vengono eseguite dopo. Restituisce True se ha fatto il commit.
+    """
+    if db.info.get(_DEFER_KEY):
+        db.flush()
+        db.info.setdefault(_AFTER_KEY, []).extend(after)
+        return False
+    db.commit()
+    for fn in after:
+        fn()
+    return True
+
+
+class IdempotentRequest:
+    """
+    Guardia per una scrittura con header Idempotency-Key (facoltativo).
+
+        with IdempotentRequest(db, key, "stock.movement", payload) as idem:
+            if idem.replay is not None:
+                return idem.replay
+            return idem.done(schemas.MovementOut, crud.upsert_stock(...))
+
+    La chiave viene prenotata (commit) prima della scrittura: un retry concorrente riceve 409,
+    uno successivo la risposta originale. La scrittura (crud con commit_or_defer) e la risposta vengono
+    salvate con un solo commit in done(): o entrambe o nessuna. Se la transazione viene annullata la
+    prenotazione viene tolta; una prenotazione rimasta senza risposta oltre IDEMPOTENCY_PENDING_SECONDS
+    (processo terminato prima del commit, quindi nessuna scrittura) può essere ripresa da un retry.
+    """
+
+    def __init__(self, db: Session, key: Optional[str], scope: str, payload: BaseModel) -> None:
+        self.db = db
+        self.key = key.strip() if key else None
+        self.scope = scope
+        self.request_hash = hashlib.sha256(f"{scope}:{payload.model_dump_json()}".encode()).hexdigest()
+        self.replay: Optional[FastJSONResponse] = None
+        self._finished = False
+        self._reserved_at: Optional[datetime] = None
+
+    def __enter__(self) -> "IdempotentRequest":
+        if not self.key:
+            return self
+        if len(self.key) > MAX_KEY_LENGTH:
+            raise HTTPException(400, f"Idempotency-Key troppo lunga (max {MAX_KEY_LENGTH} caratteri)")
+        db = self.db
+        _maybe_cleanup(db)
+        row = db.get(models.IdempotencyKey, self.key)
+        if row is not None and row.created_at < _expiry():
+            db.delete(row)
+            db.commit()
+            row = None
+        if row is not None:
+            if row.scope != self.scope or row.request_hash != self.request_hash:
+                raise HTTPException(422, "Idempotency-Key già usata per una richiesta diversa")
+            if row.status_code is None:
+                self._take_over(row)
+                return self
+            self.replay = FastJSONResponse(
+                json.loads(row.response), status_code=row.status_code, headers={REPLAY_HEADER: "true"}
+            )
+            return self
+        self._reserved_at = datetime.utcnow()
+        db.add(models.IdempotencyKey(
+            key=self.key, scope=self.scope, request_hash=self.request_hash, created_at=self._reserved_at
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(409, "Richiesta con questa Idempotency-Key ancora in elaborazione")
+        db.info[_DEFER_KEY] = True
+        return self
+
+    def _take_over(self, row: models.IdempotencyKey) -> None:
+        """Riprende una prenotazione abbandonata; 409 se la richiesta originale può essere ancora in corso."""
+        if row.created_at > datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS):
+            raise HTTPException(409, "Richiesta con questa Idempotency-Key ancora in elaborazione")
+        key = models.IdempotencyKey
+        self._reserved_at = datetime.utcnow()
+        res = self.db.execute(
+            update(key)
+            .where(key.key == self.key, key.status_code.is_(None), key.created_at == row.created_at)
+            .values(created_at=self._reserved_at)
+        )
+        self.db.commit()
+        if not res.rowcount:
+            raise HTTPException(409, "Richiesta con questa Idempotency-Key ancora in elaborazione")
+        self.db.info[_DEFER_KEY] = True
+
+    def done(self, model: Type[BaseModel], result: Any, status_code: int = 200) -> Any:
+        """Salva la risposta serializzata come la restituirebbe FastAPI e fa il commit insieme alla scrittura."""
+        if not self.key:
+            return result
+        db = self.db
+        body = model.model_validate(result, from_attributes=True).model_dump(mode="json")
+        key = models.IdempotencyKey
+        # condizionato alla propria prenotazione: se un retry l'ha ripresa, questa scrittura non va salvata
+        res = db.execute(
+            update(key)
+            .where(key.key == self.key, key.status_code.is_(None), key.created_at == self._reserved_at)
+            .values(status_code=status_code, response=dumps(body).decode())
+        )
+        if not res.rowcount:
+            raise HTTPException(409, "Richiesta con questa Idempotency-Key ripresa da un altro tentativo")
+        db.info.pop(_DEFER_KEY, None)
+        db.commit()
+        self._finished = True
+        for fn in db.info.pop(_AFTER_KEY, []):
+            fn()
+        return FastJSONResponse(body, status_code=status_code)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not self.key or self.replay is not None:
+            return
+        self.db.info.pop(_DEFER_KEY, None)
+        self.db.info.pop(_AFTER_KEY, None)
+        if self._finished or self._reserved_at is None:
+            return
+        # transazione annullata: la scrittura non c'è, la chiave torna libera per un nuovo tentativo
+        self.db.rollback()
+        key = models.IdempotencyKey
+        self.db.execute(delete(key).where(
+            key.key == self.key, key.status_code.is_(None), key.created_at == self._reserved_at
+        ))
+        self.db.commit()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import json
+from datetime import date, datetime
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi.responses import JSONResponse
+
+from app import schemas
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Risposta JSON serializzata con orjson (fallback su json stdlib).
+    Restituita direttamente da un endpoint, FastAPI non rivalida il contenuto contro response_model:
+    va usata solo con dati già nel formato dello schema (vedi i serializer qui sotto).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _serializer(model: type, exclude: Iterable[str] = ()) -> Callable[[Any], Dict[str, Any]]:
+    fields = tuple(name for name in model.model_fields if name not in set(exclude))
+    getter = attrgetter(*fields)
+
+    def serialize(obj: Any) -> Dict[str, Any]:
+        return dict(zip(fields, getter(obj)))
+
+    return serialize
+
+
+serialize_product = _serializer(schemas.ProductOut)
+serialize_location = _serializer(schemas.LocationOut)
+_movement_base = _serializer(schemas.MovementOut, exclude=("product",))
+
+
+def serialize_movement(mv: Any, with_product: bool = True) -> Dict[str, Any]:
+    data = _movement_base(mv)
+    product: Optional[Any] = mv.product if with_product else None
+    data["product"] = serialize_product(product) if product is not None else None
+    return data
+
+
+def serialize_products(items: Iterable[Any]) -> List[Dict[str, Any]]:
+    return [serialize_product(p) for p in items]
+
+
+def serialize_movements(items: Iterable[Any]) -> List[Dict[str, Any]]:
+    return [serialize_movement(mv) for mv in items]
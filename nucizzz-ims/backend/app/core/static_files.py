@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=86400"
+# nomi content-addressed (SHA-256, vedi services/uploads.py), originali e derivati
+_HASHED = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Un solo intervallo `bytes=a-b`; None se assente o multiplo (si serve il file intero)."""
+    match = _RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class RangeFileResponse(FileResponse):
+    """FileResponse 206 per un intervallo di byte (la FileResponse di Starlette serve solo il file intero)."""
+
+    def __init__(self, path: str, start: int, end: int, size: int, **kwargs) -> None:
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update({"content-length": str(end - start + 1), "content-range": f"bytes {start}-{end}/{size}"})
+        super().__init__(path, status_code=206, headers=headers, **kwargs)
+        self.start, self.end = start, end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class UploadStaticFiles(StaticFiles):
+    """
+    File caricati (/api/files): cache immutabile per i nomi content-addressed, ETag forti, richieste Range,
+    AVIF al posto del WebP derivato se il browser lo accetta e varianti .br/.gz precompresse se presenti.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        path = Path(full_path)
+        if any(part.startswith(".") for part in path.relative_to(Path(self.directory).resolve()).parts):
+            raise HTTPException(404)  # upload in corso (.incoming) e file temporanei
+        request_headers = Headers(scope=scope)
+        served, stat_served = path, stat_result
+        vary = []
+        headers = {"accept-ranges": "bytes"}
+
+        if path.parent.name == "derived" and path.suffix == ".webp":
+            vary.append("Accept")
+            avif = path.with_suffix(".avif")
+            if "image/avif" in request_headers.get("accept", "") and avif.is_file():
+                served = avif
+        elif path.suffix not in (".br", ".gz"):
+            vary.append("Accept-Encoding")
+            accepted = request_headers.get("accept-encoding", "")
+            for encoding, suffix in _ENCODINGS:
+                candidate = path.with_name(path.name + suffix)
+                if encoding in accepted and candidate.is_file():
+                    served = candidate
+                    headers["content-encoding"] = encoding
+                    break
+        if served != path:
+            stat_served = served.stat()
+        if vary:
+            headers["vary"] = ", ".join(vary)
+
+        stem = path.name.split(".", 1)[0]
+        if _HASHED.match(stem):
+            headers["cache-control"] = IMMUTABLE
+            headers["etag"] = f'"{served.name}"'
+        else:
+            headers["cache-control"] = REVALIDATE
+            tag = f"{served.name}-{stat_served.st_size}-{stat_served.st_mtime_ns}"
+            headers["etag"] = f'"{hashlib.md5(tag.encode(), usedforsecurity=False).hexdigest()}"'
+
+        # variante precompressa: il tipo è quello dell'originale, non di .br/.gz
+        media_type = (mimetypes.guess_type(path.name)[0] or "application/octet-stream") if "content-encoding" in headers else None
+        response = FileResponse(served, status_code=status_code, stat_result=stat_served, headers=headers, media_type=media_type)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if range_header and "content-encoding" not in headers:
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range == headers["etag"]:
+                byte_range = _parse_range(range_header, stat_served.st_size)
+                if byte_range:
+                    return RangeFileResponse(
+                        str(served), *byte_range, stat_served.st_size,
+                        stat_result=stat_served, headers=headers, media_type=media_type,
+                    )
+        return response
+
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, Set
+
+from sqlalchemy import column, event, insert, select, table, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, sessionmaker
+
+# stessa tabella di models.TableVersion, dichiarata qui per non importare i modelli da database.py
+TABLE = table("table_versions", column("name"), column("version"))
+_PENDING_KEY = "changed_tables"
+
+
+def _mark(session: Session, tables: Set[str]) -> None:
+    session.info.setdefault(_PENDING_KEY, set()).update(tables - {TABLE.name})
+
+
+def _before_commit(session: Session) -> None:
+    """
+    Incrementa in un colpo solo, a fine transazione, i contatori delle tabelle modificate. Le righe di
+    table_versions vengono bloccate sempre in ordine alfabetico e solo per la durata del commit: due
+    transazioni che scrivono le stesse tabelle per strade diverse non si incrociano (deadlock) e non
+    restano in coda sulla riga calda per tutta la loro durata.
+    """
+    session.flush()  # before_commit precede l'ultimo flush: le sue tabelle vanno raccolte prima
+    todo = sorted(session.info.pop(_PENDING_KEY, ()))
+    if not todo:
+        return
+    conn = session.connection()
+    for name in todo:
+        res = conn.execute(update(TABLE).where(TABLE.c.name == name).values(version=TABLE.c.version + 1))
+        if not res.rowcount:
+            conn.execute(insert(TABLE).values(name=name, version=1))
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    tables = {
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, "__table__") and (obj in session.new or obj in session.deleted or session.is_modified(obj))
+    }
+    if tables:
+        _mark(session, tables)
+
+
+def _do_orm_execute(state) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        name = getattr(table, "name", None)
+        if name:
+            _mark(state.session, {name})
+
+
+def _after_transaction_end(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def bump(session: Session, *names: str) -> None:
+    """Incremento esplicito per contatori logici, non legati a una singola tabella (applicato al commit)."""
+    _mark(session, set(names))
+
+
+def seed(conn: Connection, names: Iterable[str]) -> None:
+    """Crea le righe mancanti all'avvio, così i bump concorrenti non competono sull'INSERT."""
+    present = set(conn.scalars(select(TABLE.c.name)))
+    missing = [{"name": name, "version": 0} for name in names if name not in present and name != TABLE.name]
+    if missing:
+        conn.execute(insert(TABLE), missing)
+
+
+def install(factory: sessionmaker) -> None:
+    """Registra gli hook: ogni transazione che scrive su una tabella ne incrementa la versione al commit."""
+    event.listen(factory, "after_flush", _after_flush)
+    event.listen(factory, "before_commit", _before_commit)
+    event.listen(factory, "do_orm_execute", _do_orm_execute)
+    event.listen(factory, "after_transaction_end", _after_transaction_end)
+
+
+def get_versions(db: Session, tables: Iterable[str]) -> Dict[str, int]:
+    names = list(tables)
+    rows = dict(db.execute(select(TABLE.c.name, TABLE.c.version).where(TABLE.c.name.in_(names))).all())
+    return {name: int(rows.get(name, 0)) for name in names}
@@ -1,26 +1,60 @@
 from collections import defaultdict
 from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import select, update
+from sqlalchemy import select, update, insert, bindparam, func, text, type_coerce, JSON
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from datetime import datetime
 from . import models, schemas
+from .core.idempotency import commit_or_defer
+from .database import dialect_insert
+from .services import sales_rollup, low_stock, location_registry, barcode_index, image_mirror, images, shopify_queue
+
+def adjust_total_qty(db: Session, deltas: dict[int, int]) -> None:
+    """Aggiorna Product.total_qty con le variazioni nette per prodotto (senza commit)"""
+    params = [{"pid": pid, "delta": delta} for pid, delta in deltas.items() if delta]
+    if params:
+        products = models.Product.__table__
+        db.execute(
+            update(products)
+            .where(products.c.id == bindparam("pid"))
+            .values(total_qty=products.c.total_qty + bindparam("delta")),
+            params,
+        )
 
 def get_or_create_location(db: Session, name: str) -> models.Location:
-    loc = db.scalar(select(models.Location).where(models.Location.name == name))
+    lid = location_registry.get_id(db, name)
+    loc = db.get(models.Location, lid) if lid is not None else None
     if loc:
         return loc
     loc = models.Location(name=name)
     db.add(loc)
     db.commit()
     db.refresh(loc)
+    location_registry.remember(loc.id, loc.name)
     return loc
 
+def resolve_location_id(db: Session, name: str) -> int:
+    """Id della location per nome dal registro in memoria; la crea solo se non esiste"""
+    lid = location_registry.get_id(db, name)
+    if lid is not None:
+        return lid
+    return get_or_create_location(db, name).id
+
+def _set_image_derivatives(p: models.Product) -> None:
+    """Collega miniatura/media se l'immagine è un upload con derivati già generati"""
+    for key, url in images.derivative_urls(p.image_url).items():
+        setattr(p, key, url)
+
 def create_product(db: Session, data: schemas.ProductCreate) -> models.Product:
     # SKU deve essere unico, ma il barcode può essere duplicato (stesso prodotto in location diverse)
     exists_sku = db.scalar(select(models.Product).where(models.Product.sku == data.sku))
     if exists_sku:
         raise ValueError("SKU già presente")
 
+    extra = {}
+    if data.reorder_threshold is not None:
+        extra["reorder_threshold"] = data.reorder_threshold
     p = models.Product(
+        **extra,
         sku=data.sku,
         barcode=data.barcode,
         title=data.title,
@@ -35,11 +69,11 @@ def create_product(db: Session, data: schemas.ProductCreate) -> models.Product:
         image_url=data.image_url,
         is_active=data.is_active if data.is_active is not None else True,
     )
+    _set_image_derivatives(p)
     db.add(p)
-    db.commit()
-    db.refresh(p)
+    db.flush()
 
-    # stock iniziale
+    # stock iniziale, nella stessa transazione del prodotto
     if data.initial_qty and data.initial_qty > 0 and data.location_id:
         s = models.Stock(product_id=p.id, location_id=data.location_id, qty=data.initial_qty)
         db.add(s)
@@ -48,23 +82,191 @@ def create_product(db: Session, data: schemas.ProductCreate) -> models.Product:
             from_location_id=None, to_location_id=data.location_id, note="Initial stock"
         )
         db.add(mv)
-        db.commit()
-
+        adjust_total_qty(db, {p.id: data.initial_qty})
+        shopify_queue.enqueue(db, [(p.id, data.location_id)])
+    barcode_index.mark_changed(db)
+    db.commit()
+    low_stock.invalidate()
+    db.refresh(p)
+    barcode_index.remember(p)
+    image_mirror.notify(p.image_url)
     return p
 
+def next_sku_number(db: Session) -> int:
+    """Numero univoco per gli SKU generati: sequence su Postgres, contatore con upsert RETURNING altrove"""
+    if db.get_bind().dialect.name == "postgresql":
+        return db.scalar(models.sku_sequence.next_value())
+    counters = models.Counter.__table__
+    stmt = dialect_insert(db)(counters).values(name="sku", value=models.SKU_START)
+    stmt = stmt.on_conflict_do_update(index_elements=[counters.c.name], set_={"value": counters.c.value + 1})
+    return db.scalar(stmt.returning(counters.c.value))
+
+def increment_stock(db: Session, increments: dict[tuple[int, int], int]) -> None:
+    """Aggiunge le quantità {(product_id, location_id): qty} allo stock con un upsert (senza commit)"""
+    stock = models.Stock.__table__
+    stmt = dialect_insert(db)(stock)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[stock.c.product_id, stock.c.location_id],
+            set_={"qty": stock.c.qty + stmt.excluded.qty},
+        ),
+        [{"product_id": pid, "location_id": lid, "qty": qty} for (pid, lid), qty in increments.items()],
+    )
+
+def receive_product(db: Session, data: schemas.ReceiveCreate, location_id: int | None) -> models.Product:
+    """
+    Ricezione da scanner in un'unica transazione: se il barcode esiste aggiunge un pezzo alla location,
+    altrimenti crea il prodotto con SKU <barcode>_<numero> preso dalla sequence (nessun ciclo di verifica).
+    """
+    pid = barcode_index.first_id(db, data.barcode) if data.barcode else None
+    product = None
+    if pid is not None:
+        if not location_id:
+            return db.get(models.Product, pid)
+        adjust_total_qty(db, {pid: 1})
+    else:
+        product = models.Product(
+            sku=f"{data.barcode or 'PROD'}_{next_sku_number(db)}",
+            barcode=data.barcode,
+            title=data.title,
+            brand=data.brand,
+            description=data.description,
+            size=data.size,
+            weight_grams=data.weight_g,
+            package_required=data.package_required,
+            cost=data.cost_eur,
+            price=data.price_eur,
+            image_url=data.image_url,
+            is_active=True,
+            total_qty=1 if location_id else 0,
+        )
+        _set_image_derivatives(product)
+        db.add(product)
+        db.flush()
+        pid = product.id
+        barcode_index.mark_changed(db)
+
+    if location_id:
+        increment_stock(db, {(pid, location_id): 1})
+        db.execute(insert(models.StockMovement.__table__).values(
+            product_id=pid, type="in", qty_change=1,
+            from_location_id=None, to_location_id=location_id, note="Ricezione merce",
+        ))
+        shopify_queue.enqueue(db, [(pid, location_id)])
+    if product is None:
+        commit_or_defer(db, low_stock.invalidate)
+        return db.get(models.Product, pid)
+    image_url = product.image_url
+    commit_or_defer(db, low_stock.invalidate, lambda: barcode_index.remember(product), lambda: image_mirror.notify(image_url))
+    return product
+
+RECEIVE_FIELDS = ("title", "brand", "description", "size", "price_eur", "cost_eur", "weight_g", "package_required", "image_url")
+
+def receive_batch(db: Session, lines: list[schemas.ReceiveBatchLine], location_ids: list[int | None]) -> list[dict]:
+    """
+    Applica una sessione di scansione in un'unica transazione. Le righe con stesso barcode e location
+    vengono sommate: un movimento "in" per coppia prodotto/location invece di uno per pezzo.
+    I barcode sconosciuti creano un prodotto (metadati dalla prima riga che li specifica).
+    """
+    qty: dict[tuple[str, int | None], int] = defaultdict(int)
+    meta: dict[str, dict] = {}
+    for line, loc_id in zip(lines, location_ids):
+        qty[(line.barcode, loc_id)] += line.qty
+        known = meta.setdefault(line.barcode, {})
+        for field in RECEIVE_FIELDS:
+            value = getattr(line, field)
+            if value is not None and field not in known:
+                known[field] = value
+
+    product_ids: dict[str, int] = {}
+    missing = []
+    for barcode in meta:
+        pid = barcode_index.first_id(db, barcode)
+        if pid is None:
+            missing.append(barcode)
+        else:
+            product_ids[barcode] = pid
+    without_title = [barcode for barcode in missing if not meta[barcode].get("title")]
+    if without_title:
+        raise ValueError(f"title obbligatorio per i nuovi barcode: {', '.join(without_title)}")
+
+    created = []
+    for barcode in missing:
+        m = meta[barcode]
+        created.append(models.Product(
+            sku=f"{barcode}_{next_sku_number(db)}",
+            barcode=barcode,
+            title=m["title"],
+            brand=m.get("brand"),
+            description=m.get("description"),
+            size=m.get("size"),
+            weight_grams=m.get("weight_g"),
+            package_required=m.get("package_required"),
+            cost=m.get("cost_eur"),
+            price=m.get("price_eur"),
+            image_url=m.get("image_url"),
+            is_active=True,
+            total_qty=0,
+        ))
+    for p in created:
+        _set_image_derivatives(p)
+    if created:
+        db.add_all(created)
+        db.flush()
+        product_ids.update({p.barcode: p.id for p in created})
+        barcode_index.mark_changed(db)
+
+    increments = {(product_ids[barcode], lid): n for (barcode, lid), n in qty.items() if lid is not None}
+    if increments:
+        increment_stock(db, increments)
+        db.execute(insert(models.StockMovement.__table__), [
+            {"product_id": pid, "type": "in", "qty_change": n, "from_location_id": None,
+             "to_location_id": lid, "note": "Ricezione merce", "sale_price": None}
+            for (pid, lid), n in increments.items()
+        ])
+        totals: dict[int, int] = defaultdict(int)
+        for (pid, _), n in increments.items():
+            totals[pid] += n
+        adjust_total_qty(db, totals)
+        shopify_queue.enqueue(db, increments)
+    image_urls = [p.image_url for p in created]
+    commit_or_defer(
+        db, low_stock.invalidate,
+        lambda: [barcode_index.remember(p) for p in created], lambda: image_mirror.notify(*image_urls),
+    )
+
+    new_ids = {p.id for p in created}
+    return [
+        {"barcode": barcode, "location_id": lid, "product_id": product_ids[barcode],
+         "qty": n, "created": product_ids[barcode] in new_ids}
+        for (barcode, lid), n in qty.items()
+    ]
+
 def update_product(db: Session, product_id: int, data: dict) -> models.Product:
     p = db.get(models.Product, product_id)
     if not p:
         raise ValueError("Prodotto non trovato")
     for k, v in data.items():
+        if k in ("id", "total_qty", "image_thumb_url", "image_medium_url"):
+            continue
         if hasattr(p, k) and v is not None:
             setattr(p, k, v)
+    if data.get("image_url") is not None:
+        _set_image_derivatives(p)
+    barcode_index.mark_changed(db)
     db.commit()
+    low_stock.invalidate()
     db.refresh(p)
+    barcode_index.remember(p)
+    image_mirror.notify(p.image_url)
     return p
 
 def list_products(db: Session, q: str | None = None, location_id: int | None = None, limit: int = 50, offset: int = 0):
-    stmt = select(models.Product).order_by(models.Product.created_at.desc())
+    stmt = _product_search(select(models.Product).order_by(models.Product.created_at.desc()), q)
+    res = db.scalars(stmt.offset(offset).limit(limit)).all()
+    return res
+
+def _product_search(stmt, q: str | None):
     if q:
         like = f"%{q.lower()}%"
         stmt = stmt.where(
@@ -73,42 +275,43 @@ def list_products(db: Session, q: str | None = None, location_id: int | None = N
             (models.Product.barcode.ilike(like)) |
             (models.Product.brand.ilike(like))
         )
-    res = db.scalars(stmt.offset(offset).limit(limit)).all()
-    return res
+    return stmt
+
+def _stock_json(db: Session):
+    """Sottoquery correlata che aggrega lo stock del prodotto in un array JSON"""
+    s = models.Stock.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        item = func.json_build_object("location_id", s.c.location_id, "qty", s.c.qty)
+        agg = func.coalesce(func.json_agg(aggregate_order_by(item, s.c.location_id)), text("'[]'::json"))
+    else:
+        agg = func.json_group_array(func.json_object("location_id", s.c.location_id, "qty", s.c.qty))
+    return (
+        select(type_coerce(agg, JSON))
+        .where(s.c.product_id == models.Product.id)
+        .correlate(models.Product)
+        .scalar_subquery()
+    )
 
-def list_products_with_stock(db: Session, q: str | None = None, limit: int = 50, offset: int = 0):
-    products = list_products(db, q=q, location_id=None, limit=limit, offset=offset)
-    if not products:
-        return []
+PRODUCT_OUT_COLUMNS = tuple(schemas.ProductOut.model_fields)
 
-    ids = [p.id for p in products]
-    stocks = db.scalars(select(models.Stock).where(models.Stock.product_id.in_(ids))).all()
-    stock_map: dict[int, list[models.Stock]] = defaultdict(list)
-    for stock in stocks:
-        stock_map[stock.product_id].append(stock)
+def list_products_with_stock(db: Session, q: str | None = None, limit: int = 50, offset: int = 0) -> list[dict]:
+    """
+    Prodotti con stock per location in una sola query (JSON aggregato lato database).
+    Restituisce dict già pronti per la serializzazione, senza passare dai modelli Pydantic.
+    """
+    cols = [getattr(models.Product, name) for name in PRODUCT_OUT_COLUMNS]
+    stmt = select(*cols, _stock_json(db).label("stock")).order_by(models.Product.created_at.desc())
+    stmt = _product_search(stmt, q).offset(offset).limit(limit)
 
     results = []
-    for product in products:
-        base = schemas.ProductOut.model_validate(product, from_attributes=True).model_dump()
-        product_stock = [
-            {"location_id": s.location_id, "qty": s.qty}
-            for s in stock_map.get(product.id, [])
-        ]
-        results.append({
-            **base,
-            "stock": product_stock,
-            "total_qty": sum(item["qty"] for item in product_stock),
-        })
+    for row in db.execute(stmt).mappings():
+        item = dict(row)
+        stock = sorted(item["stock"] or [], key=lambda s: s["location_id"])
+        item["stock"] = stock
+        item["total_qty"] = sum(s["qty"] for s in stock)
+        results.append(item)
     return results
 
-def get_product_by_barcode(db: Session, barcode: str) -> models.Product | None:
-    """Restituisce il primo prodotto trovato con questo barcode"""
-    return db.scalar(select(models.Product).where(models.Product.barcode == barcode))
-
-def get_products_by_barcode(db: Session, barcode: str) -> list[models.Product]:
-    """Restituisce tutti i prodotti con questo barcode"""
-    return list(db.scalars(select(models.Product).where(models.Product.barcode == barcode)).all())
-
 def get_product(db: Session, pid: int) -> models.Product | None:
     return db.get(models.Product, pid)
 
@@ -138,14 +341,23 @@ def upsert_stock(
 
     mv = models.StockMovement(
         product_id=product_id, type=movement_type, qty_change=delta,
-        from_location_id=None if delta > 0 else location_id if movement_type == "out" else None,
+        from_location_id=location_id if delta < 0 else None,
         to_location_id=location_id if delta > 0 else None,
         note=note,
         sale_price=sale_price if movement_type == "sell" else None,
+        unit_cost=db.scalar(select(models.Product.cost).where(models.Product.id == product_id)) if movement_type == "sell" else None,
+        created_at=datetime.utcnow(),
     )
     db.add(mv)
-    db.commit()
-    db.refresh(mv)
+    adjust_total_qty(db, {product_id: delta})
+    shopify_queue.enqueue(db, [(product_id, location_id)])
+    if movement_type == "sell":
+        sales_rollup.record_sales(db, [{
+            "created_at": mv.created_at, "product_id": product_id, "from_location_id": location_id,
+            "qty_change": delta, "sale_price": mv.sale_price, "unit_cost": mv.unit_cost,
+        }])
+    if commit_or_defer(db, low_stock.invalidate):
+        db.refresh(mv)
     return mv
 
 def list_movements(db: Session, type: str | None = None, limit: int = 100, offset: int = 0, from_dt: datetime | None = None, to_dt: datetime | None = None):
@@ -185,6 +397,179 @@ def transfer_stock(db: Session, product_id: int, from_loc: int, to_loc: int, qty
         from_location_id=from_loc, to_location_id=to_loc, note="Transfer"
     )
     db.add(mv)
-    db.commit()
-    db.refresh(mv)
+    shopify_queue.enqueue(db, [(product_id, from_loc), (product_id, to_loc)])
+    if commit_or_defer(db, low_stock.invalidate):
+        db.refresh(mv)
     return mv
+
+def movement_effects(m: schemas.MovementCreate) -> list[tuple[int, int]]:
+    """Valida un movimento e restituisce le variazioni di stock come (location_id, delta)"""
+    if m.qty_change <= 0:
+        raise ValueError("qty_change deve essere positivo")
+    qty = m.qty_change
+    if m.type == "transfer":
+        if not (m.from_location_id and m.to_location_id):
+            raise ValueError("Transfer non valido")
+        if m.from_location_id == m.to_location_id:
+            raise ValueError("Transfer non valido")
+        return [(m.from_location_id, -qty), (m.to_location_id, qty)]
+    if m.type == "in":
+        if not m.to_location_id:
+            raise ValueError("Location mancante")
+        return [(m.to_location_id, qty)]
+    if m.type == "sell":
+        if not m.from_location_id:
+            raise ValueError("Location mancante")
+        if m.sale_price is None or m.sale_price < 0:
+            raise ValueError("Prezzo di vendita mancante")
+        return [(m.from_location_id, -qty)]
+    if m.type == "out":
+        if not m.from_location_id:
+            raise ValueError("from_location_id richiesto")
+        return [(m.from_location_id, -qty)]
+    raise ValueError("Tipo non supportato")
+
+def _movement_row(m: schemas.MovementCreate) -> dict:
+    qty = m.qty_change
+    row = {
+        "product_id": m.product_id,
+        "type": m.type,
+        "note": m.note,
+        "sale_price": None,
+        "from_location_id": None,
+        "to_location_id": None,
+    }
+    if m.type == "transfer":
+        row.update(qty_change=qty, from_location_id=m.from_location_id, to_location_id=m.to_location_id,
+                   note=m.note or "Transfer")
+    elif m.type == "in":
+        row.update(qty_change=qty, to_location_id=m.to_location_id)
+    else:
+        row.update(qty_change=-qty, from_location_id=m.from_location_id)
+        if m.type == "sell":
+            row["sale_price"] = m.sale_price
+    return row
+
+def apply_movements_batch(db: Session, lines: list[schemas.MovementCreate], atomic: bool = True, commit: bool = True) -> list[dict]:
+    """
+    Applica più movimenti in una sola transazione.
+    Tutte le righe vengono validate contro lo stock corrente (letto con una sola query),
+    poi gli incrementi vengono scritti con UPDATE/INSERT set-based e un unico commit.
+    Con atomic=True basta un errore per annullare tutto (ValueError con l'elenco errori),
+    altrimenti le righe non valide vengono saltate e riportate nei risultati.
+    Con commit=False il commit (e low_stock.invalidate) resta al chiamante, che può così registrare
+    nella stessa transazione ciò che ha generato i movimenti.
+    """
+    results: list[dict] = [{"index": i, "ok": False, "movement": None, "error": None} for i in range(len(lines))]
+    effects: dict[int, list[tuple[int, int]]] = {}
+    for i, m in enumerate(lines):
+        try:
+            effects[i] = movement_effects(m)
+        except ValueError as exc:
+            results[i]["error"] = str(exc)
+
+    product_ids = {lines[i].product_id for i in effects}
+    location_ids = {loc for eff in effects.values() for loc, _ in eff}
+    # costo corrente dei prodotti: fotografato sulle vendite per margini stabili nel tempo
+    costs = dict(db.execute(
+        select(models.Product.id, models.Product.cost).where(models.Product.id.in_(product_ids))
+    ).all()) if product_ids else {}
+    known_products = set(costs)
+    known_locations = {lid for lid in location_ids if location_registry.exists(db, lid)}
+
+    stock_rows = {}
+    if product_ids and location_ids:
+        stmt = select(models.Stock.id, models.Stock.product_id, models.Stock.location_id, models.Stock.qty).where(
+            models.Stock.product_id.in_(product_ids) & models.Stock.location_id.in_(location_ids)
+        ).with_for_update()
+        for sid, pid, lid, qty in db.execute(stmt):
+            stock_rows[(pid, lid)] = (sid, qty)
+
+    # simulazione in memoria: le righe vengono applicate in ordine sullo stock corrente
+    current = {key: qty for key, (_, qty) in stock_rows.items()}
+    accepted: list[int] = []
+    for i, eff in effects.items():
+        m = lines[i]
+        if m.product_id not in known_products:
+            results[i]["error"] = "Prodotto non trovato"
+            continue
+        if any(loc not in known_locations for loc, _ in eff):
+            results[i]["error"] = "Location inesistente"
+            continue
+        if any(current.get((m.product_id, loc), 0) + delta < 0 for loc, delta in eff):
+            results[i]["error"] = "Stock insufficiente"
+            continue
+        for loc, delta in eff:
+            key = (m.product_id, loc)
+            current[key] = current.get(key, 0) + delta
+        accepted.append(i)
+
+    errors = [{"index": r["index"], "error": r["error"]} for r in results if r["error"]]
+    if atomic and errors:
+        db.rollback()
+        raise ValueError(errors)
+    if not accepted:
+        db.rollback()
+        return results
+
+    net: dict[tuple[int, int], int] = defaultdict(int)
+    for i in accepted:
+        for loc, delta in effects[i]:
+            net[(lines[i].product_id, loc)] += delta
+
+    updates = [
+        {"sid": stock_rows[key][0], "delta": delta}
+        for key, delta in net.items() if key in stock_rows and delta
+    ]
+    inserts = [
+        {"product_id": pid, "location_id": lid, "qty": delta}
+        for (pid, lid), delta in net.items() if (pid, lid) not in stock_rows
+    ]
+    if updates:
+        db.execute(
+            update(models.Stock.__table__)
+            .where(models.Stock.__table__.c.id == bindparam("sid"))
+            .values(qty=models.Stock.__table__.c.qty + bindparam("delta")),
+            updates,
+        )
+    if inserts:
+        db.execute(insert(models.Stock.__table__), inserts)
+    totals: dict[int, int] = defaultdict(int)
+    for (pid, _), delta in net.items():
+        totals[pid] += delta
+    adjust_total_qty(db, totals)
+    shopify_queue.enqueue(db, net)
+
+    now = datetime.utcnow()
+    table = models.StockMovement.__table__
+    rows = db.execute(
+        insert(table).returning(*table.c, sort_by_parameter_order=True),
+        [
+            {**_movement_row(lines[i]), "created_at": now,
+             "unit_cost": costs[lines[i].product_id] if lines[i].type == "sell" else None}
+            for i in accepted
+        ],
+    ).mappings().all()
+    sales_rollup.record_sales(db, [row for row in rows if row["type"] == "sell"])
+    if commit:
+        commit_or_defer(db, low_stock.invalidate)
+
+    for i, row in zip(accepted, rows):
+        results[i]["ok"] = True
+        results[i]["movement"] = dict(row)
+    return results
+
+def set_stock_threshold(db: Session, product_id: int, location_id: int, threshold: int | None) -> models.Stock:
+    """Soglia di riordino per una singola location (None = solo soglia del prodotto)"""
+    s = db.scalar(select(models.Stock).where(
+        (models.Stock.product_id == product_id) & (models.Stock.location_id == location_id)))
+    if not s:
+        if not location_registry.exists(db, location_id) or not db.get(models.Product, product_id):
+            raise ValueError("Prodotto o location inesistente")
+        s = models.Stock(product_id=product_id, location_id=location_id, qty=0)
+        db.add(s)
+    s.reorder_threshold = threshold
+    db.commit()
+    db.refresh(s)
+    low_stock.invalidate()
+    return s
@@ -18,3 +18,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def dialect_insert(db):
+    """insert() del dialetto in uso, per gli upsert ON CONFLICT (Postgres e SQLite)"""
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:  # pragma: no cover - only Postgres/SQLite are deployed
+        raise RuntimeError(f"Upsert non supportato su {name}")
+    return insert
+
+from .core import table_versions  # noqa: E402  (hook sulle scritture per ETag e cache)
+
+table_versions.install(SessionLocal)
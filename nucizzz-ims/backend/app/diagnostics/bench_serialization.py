@@ -0,0 +1,75 @@
+"""
+Confronta la serializzazione standard (validazione response_model + json stdlib)
+con il percorso veloce di app.core.responses sulle liste più pesanti.
+
+    python -m app.diagnostics.bench_serialization --rows 500 --repeat 50
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app import schemas
+from app.core.responses import dumps, serialize_movements
+
+
+def _fake_movements(n: int) -> List[SimpleNamespace]:
+    now = datetime.utcnow()
+    rows = []
+    for i in range(n):
+        product = SimpleNamespace(
+            id=i, sku=f"SKU{i:06d}", barcode=f"80{i:011d}", title=f"Sneaker {i}", brand="Nike",
+            description="Descrizione prodotto di esempio", size="42", color="black", weight_grams=900.0,
+            package_required="Scatola M", cost=80.0, price=150.0, image_url=f"/api/files/{i:032x}.jpg",
+            is_active=True, created_at=now - timedelta(days=i),
+        )
+        rows.append(SimpleNamespace(
+            id=i, product_id=i, type="sell", qty_change=-1, from_location_id=1, to_location_id=None,
+            note="POS vendita", sale_price=149.0, created_at=now - timedelta(minutes=i), product=product,
+        ))
+    return rows
+
+
+def _timeit(fn: Callable[[], bytes], repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = _fake_movements(args.rows)
+    adapter = TypeAdapter(List[schemas.MovementOut])
+
+    def standard() -> bytes:
+        # equivalente di quello che fa FastAPI con response_model + JSONResponse
+        validated = adapter.validate_python(rows, from_attributes=True)
+        content = jsonable_encoder(adapter.dump_python(validated, mode="json"))
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def fast() -> bytes:
+        return dumps(serialize_movements(rows))
+
+    assert json.loads(standard()) == json.loads(fast()), "output diversi"
+    slow_ms = _timeit(standard, args.repeat)
+    fast_ms = _timeit(fast, args.repeat)
+    print(f"/stock/movements con {args.rows} righe")
+    print(f"  response_model + json: {slow_ms:8.2f} ms")
+    print(f"  serializer + orjson:   {fast_ms:8.2f} ms  (x{slow_ms / fast_ms:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,24 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.staticfiles import StaticFiles
 from os import getenv
-from pathlib import Path
 from typing import List
 import logging
 
 from .api.routes.barcode import router as barcode_router
 from .api.routes.health import router as health_router
-from .database import Base, engine, SessionLocal
-from .routers import products, locations, stock, uploads, shopify
-from . import crud
+from .database import engine, SessionLocal
+from .routers import products, locations, stock, uploads, shopify, exports, analytics
+from . import migrations
+from .services import barcode_index, image_mirror, images, location_registry, shopify_orders, shopify_queue
+from .core.config import UPLOAD_DIR
+from .core.static_files import UploadStaticFiles
 
 API_BASE = getenv("API_BASE_PATH", "/api")
 PUBLIC_HOSTNAME = getenv("PUBLIC_HOSTNAME", "").strip()
 FRONTEND_ORIGIN = getenv("FRONTEND_ORIGIN", "").strip()
 EXTRA_ALLOWED_ORIGINS = getenv("ADDITIONAL_ALLOWED_ORIGINS", "")
+# solo per sviluppo locale: applica le migrazioni all'avvio invece del comando dedicato
+AUTO_MIGRATE = getenv("AUTO_MIGRATE", "").lower() in ("1", "true", "yes")
 logger = logging.getLogger(__name__)
 
 
@@ -61,28 +64,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# crea tabelle all'avvio
 @app.on_event("startup")
 def startup():
-    Base.metadata.create_all(bind=engine)
-    # ensure optional columns exist when running without migrations
-    with engine.begin() as conn:
-        dialect = conn.dialect.name
-        try:
-            if dialect == "sqlite":
-                conn.exec_driver_sql("ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS sale_price FLOAT")
-            else:
-                conn.exec_driver_sql("ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS sale_price DOUBLE PRECISION")
-        except Exception as exc:  # pragma: no cover - best effort
-            logger.warning("Unable to ensure sale_price column: %s", exc)
-    # Inizializza le location standard se non esistono
+    # lo schema lo prepara `python -m app.cli migrate`: qui solo il controllo di versione
+    if AUTO_MIGRATE:
+        migrations.migrate(engine)
+    migrations.check(engine)
     db = SessionLocal()
     try:
-        crud.get_or_create_location(db, "warehouse")
-        crud.get_or_create_location(db, "negozio treviso")
+        location_registry.load(db)
+        barcode_index.load(db)
     finally:
         db.close()
 
+@app.on_event("startup")
+async def start_workers():
+    # copia locale delle immagini remote dei prodotti (lookup barcode)
+    image_mirror.start()
+    # giacenze verso Shopify (solo se configurato)
+    shopify_queue.start()
+    # ordini e resi dai webhook Shopify (solo con SHOPIFY_WEBHOOK_SECRET)
+    shopify_orders.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await image_mirror.stop()
+    await shopify_queue.stop()
+    await shopify_orders.stop()
+
+@app.on_event("shutdown")
+def shutdown():
+    images.shutdown()
+
 # routers first (higher priority) - mount with explicit prefixes
 app.include_router(health_router, prefix=f"{API_BASE}")
 app.include_router(barcode_router, prefix=f"{API_BASE}")
@@ -91,11 +104,12 @@ app.include_router(locations.router, prefix=f"{API_BASE}/locations", tags=["loca
 app.include_router(stock.router, prefix=f"{API_BASE}/stock", tags=["stock"])
 app.include_router(uploads.router, prefix=f"{API_BASE}/uploads", tags=["uploads"])
 app.include_router(shopify.router, prefix=f"{API_BASE}/shopify", tags=["shopify"])
+app.include_router(exports.router, prefix=f"{API_BASE}/exports", tags=["exports"])
+app.include_router(analytics.router, prefix=f"{API_BASE}/analytics", tags=["analytics"])
 
 # mount static uploads (serve files under /api/files/* to avoid conflicts) - must be last
-UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-app.mount(f"{API_BASE}/files", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount(f"{API_BASE}/files", UploadStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 @app.get("/")
 def root():
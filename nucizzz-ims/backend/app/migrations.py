@@ -0,0 +1,248 @@
+"""
+Migrazioni di schema versionate.
+
+Si applicano una volta con `python -m app.cli migrate` (prima di avviare i worker); all'avvio l'app
+legge solo la versione registrata in schema_version. Ogni migrazione gira nella propria transazione
+insieme alla riga di schema_version e deve essere idempotente: un database già allineato dal vecchio
+avvio (create_all + ALTER) passa tutte le migrazioni senza modifiche.
+Per cambiare lo schema si aggiunge una funzione in fondo a MIGRATIONS, mai modificare quelle esistenti.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import func, inspect, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from app import models
+from app.core import table_versions
+from app.core.config import LOW_STOCK_THRESHOLD
+from app.database import Base
+
+logger = logging.getLogger(__name__)
+
+# chiave per pg_advisory_lock: due `migrate` lanciati insieme non applicano la stessa migrazione
+_PG_LOCK_KEY = 731_041
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _create_tables(conn: Connection) -> None:
+    Base.metadata.create_all(bind=conn)
+
+
+def _add_columns(conn: Connection) -> None:
+    columns = [
+        ("stock_movements", "sale_price", "FLOAT"),
+        ("products", "reorder_threshold", f"INTEGER NOT NULL DEFAULT {LOW_STOCK_THRESHOLD}"),
+        ("products", "total_qty", "INTEGER NOT NULL DEFAULT 0"),
+        ("stock", "reorder_threshold", "INTEGER"),
+    ]
+    existing: dict[str, set[str]] = {}
+    for table, column, ddl in columns:
+        if table not in existing:
+            existing[table] = {c["name"] for c in inspect(conn).get_columns(table)}
+        if column in existing[table]:
+            continue
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        if (table, column) == ("products", "total_qty"):
+            conn.exec_driver_sql(
+                "UPDATE products SET total_qty = "
+                "(SELECT COALESCE(SUM(qty), 0) FROM stock WHERE stock.product_id = products.id)"
+            )
+
+
+def _stock_indexes(conn: Connection) -> None:
+    if "ux_stock_product_location" not in {ix["name"] for ix in inspect(conn).get_indexes("stock")}:
+        # righe di stock duplicate (stesso prodotto e location) impedirebbero l'indice univoco: si accorpano
+        conn.exec_driver_sql(
+            "UPDATE stock SET qty = (SELECT SUM(s2.qty) FROM stock s2 "
+            "WHERE s2.product_id = stock.product_id AND s2.location_id = stock.location_id) "
+            "WHERE id IN (SELECT MIN(id) FROM stock GROUP BY product_id, location_id HAVING COUNT(*) > 1)"
+        )
+        conn.exec_driver_sql(
+            "DELETE FROM stock WHERE id NOT IN (SELECT MIN(id) FROM stock GROUP BY product_id, location_id)"
+        )
+        conn.exec_driver_sql("CREATE UNIQUE INDEX ux_stock_product_location ON stock (product_id, location_id)")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_stock_product_location")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_products_stock_margin ON products ((total_qty - reorder_threshold))"
+    )
+
+
+def _default_locations(conn: Connection) -> None:
+    loc = models.Location.__table__
+    present = set(conn.scalars(select(loc.c.name)))
+    missing = [{"name": name, "created_at": datetime.utcnow()} for name in ("warehouse", "negozio treviso") if name not in present]
+    if missing:
+        conn.execute(insert(loc), missing)
+
+
+def _seed_table_versions(conn: Connection) -> None:
+    from app.services.barcode_index import CATALOG_KEY
+
+    table_versions.seed(conn, [*Base.metadata.tables, CATALOG_KEY])
+
+
+def _add_columns_if_missing(conn: Connection, table: str, columns: List[tuple[str, str]]) -> None:
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    for column, ddl in columns:
+        if column not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _image_derivative_columns(conn: Connection) -> None:
+    _add_columns_if_missing(conn, "products", [("image_thumb_url", "VARCHAR(512)"), ("image_medium_url", "VARCHAR(512)")])
+
+
+def _image_mirrors(conn: Connection) -> None:
+    models.ImageMirror.__table__.create(conn, checkfirst=True)
+    table_versions.seed(conn, ["image_mirrors"])
+
+
+def _shopify_columns(conn: Connection) -> None:
+    _add_columns_if_missing(conn, "products", [
+        ("shopify_product_id", "VARCHAR(64)"),
+        ("shopify_variant_id", "VARCHAR(64)"),
+        ("shopify_inventory_item_id", "VARCHAR(64)"),
+    ])
+
+
+def _shopify_sync_queue(conn: Connection) -> None:
+    models.ShopifySyncItem.__table__.create(conn, checkfirst=True)
+    table_versions.seed(conn, ["shopify_sync_queue"])
+
+
+def _shopify_reconciliations(conn: Connection) -> None:
+    models.ShopifyReconciliation.__table__.create(conn, checkfirst=True)
+    table_versions.seed(conn, ["shopify_reconciliations"])
+
+
+def _shopify_webhook_events(conn: Connection) -> None:
+    models.ShopifyWebhookEvent.__table__.create(conn, checkfirst=True)
+    table_versions.seed(conn, ["shopify_webhook_events"])
+
+
+def _movement_unit_cost(conn: Connection) -> None:
+    _add_columns_if_missing(conn, "stock_movements", [("unit_cost", "FLOAT")])
+    # vendite già registrate: il costo storico non è noto, si fotografa quello attuale (una volta sola)
+    conn.exec_driver_sql(
+        "UPDATE stock_movements SET unit_cost = "
+        "(SELECT cost FROM products WHERE products.id = stock_movements.product_id) "
+        "WHERE type = 'sell' AND unit_cost IS NULL"
+    )
+
+
+def _legacy_sell_locations(conn: Connection) -> None:
+    """
+    Le vendite del vecchio upsert_stock non registravano la location di origine (from_location_id NULL) e
+    lo storico dello stock le ignorava. Si assegna la location quando il prodotto ne ha una sola (stock o
+    movimenti); le altre restano senza location e vengono segnalate.
+    """
+    m, s = models.StockMovement.__table__, models.Stock.__table__
+    legacy = (m.c.qty_change < 0) & m.c.from_location_id.is_(None) & m.c.to_location_id.is_(None)
+    product_ids = conn.execute(select(m.c.product_id).where(legacy).distinct()).scalars().all()
+    if not product_ids:
+        return
+    places: dict[int, set[int]] = {pid: set() for pid in product_ids}
+    for stmt in (
+        select(s.c.product_id, s.c.location_id).where(s.c.product_id.in_(product_ids)),
+        select(m.c.product_id, m.c.from_location_id).where(m.c.product_id.in_(product_ids), m.c.from_location_id.is_not(None)),
+        select(m.c.product_id, m.c.to_location_id).where(m.c.product_id.in_(product_ids), m.c.to_location_id.is_not(None)),
+    ):
+        for pid, lid in conn.execute(stmt):
+            places[pid].add(lid)
+    ambiguous = []
+    for pid, lids in places.items():
+        if len(lids) == 1:
+            conn.execute(update(m).where(legacy, m.c.product_id == pid).values(from_location_id=next(iter(lids))))
+        else:
+            ambiguous.append(pid)
+    if ambiguous:
+        rows = conn.scalar(select(func.count()).select_from(m).where(legacy, m.c.product_id.in_(ambiguous)))
+        logger.warning(
+            "movimenti in uscita senza location non attribuibili: %s (prodotti %s); lo storico stock li riporta come unlocated",
+            rows, ambiguous[:50],
+        )
+
+
+def _shopify_synced_qty(conn: Connection) -> None:
+    # NULL: il primo invio di ogni prodotto rilegge la disponibilità da Shopify
+    _add_columns_if_missing(conn, "products", [("shopify_synced_qty", "INTEGER")])
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create_tables", _create_tables),
+    Migration(2, "optional_columns", _add_columns),
+    Migration(3, "stock_indexes", _stock_indexes),
+    Migration(4, "default_locations", _default_locations),
+    Migration(5, "seed_table_versions", _seed_table_versions),
+    Migration(6, "image_derivative_columns", _image_derivative_columns),
+    Migration(7, "image_mirrors", _image_mirrors),
+    Migration(8, "shopify_columns", _shopify_columns),
+    Migration(9, "shopify_sync_queue", _shopify_sync_queue),
+    Migration(10, "shopify_reconciliations", _shopify_reconciliations),
+    Migration(11, "shopify_webhook_events", _shopify_webhook_events),
+    Migration(12, "movement_unit_cost", _movement_unit_cost),
+    Migration(13, "legacy_sell_locations", _legacy_sell_locations),
+    Migration(14, "shopify_synced_qty", _shopify_synced_qty),
+]
+LATEST = MIGRATIONS[-1].version
+
+
+def current_version(conn: Connection) -> int:
+    """Versione applicata (0 se schema_version non esiste ancora): una sola query."""
+    table = models.SchemaVersion.__table__
+    try:
+        return conn.scalar(select(func.coalesce(func.max(table.c.version), 0))) or 0
+    except DBAPIError:
+        conn.rollback()
+        return 0
+
+
+def migrate(engine: Engine) -> List[Migration]:
+    """Applica in ordine le migrazioni mancanti e restituisce quelle eseguite."""
+    applied: List[Migration] = []
+    with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.exec_driver_sql(f"SELECT pg_advisory_lock({_PG_LOCK_KEY})")
+            conn.commit()
+        try:
+            with conn.begin():
+                models.SchemaVersion.__table__.create(conn, checkfirst=True)
+            done = current_version(conn)
+            conn.commit()
+            for migration in MIGRATIONS:
+                if migration.version <= done:
+                    continue
+                with conn.begin():
+                    migration.apply(conn)
+                    conn.execute(insert(models.SchemaVersion.__table__).values(
+                        version=migration.version, name=migration.name, applied_at=datetime.utcnow(),
+                    ))
+                logger.info("migration applied", extra={"event": "migration", "version": migration.version})
+                applied.append(migration)
+        finally:
+            if postgres:
+                conn.exec_driver_sql(f"SELECT pg_advisory_unlock({_PG_LOCK_KEY})")
+                conn.commit()
+    return applied
+
+
+def check(engine: Engine) -> int:
+    """Controllo all'avvio: errore se mancano migrazioni, senza toccare lo schema."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version < LATEST:
+        raise RuntimeError(
+            f"Schema del database alla versione {version}, richiesta {LATEST}: eseguire `python -m app.cli migrate`"
+        )
+    return version
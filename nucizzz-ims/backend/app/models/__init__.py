@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, Date, DateTime, Float, ForeignKey, Index, Integer, Sequence, String, Text, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+from app.core.config import LOW_STOCK_THRESHOLD
 from app.database import Base
 
 
@@ -20,6 +21,10 @@ class Location(Base):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # scorta bassa = total_qty - reorder_threshold < 0, confronto servito dall'indice
+        Index("ix_products_stock_margin", text("(total_qty - reorder_threshold)")),
+    )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     sku: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     barcode: Mapped[Optional[str]] = mapped_column(String(64), index=True, nullable=True)
@@ -33,8 +38,21 @@ class Product(Base):
     cost: Mapped[Optional[float]] = mapped_column(Float)
     price: Mapped[Optional[float]] = mapped_column(Float)
     image_url: Mapped[Optional[str]] = mapped_column(String(512))
+    # derivati WebP dell'immagine caricata (app/services/images.py), None se non ancora generati
+    image_thumb_url: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    image_medium_url: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    reorder_threshold: Mapped[int] = mapped_column(Integer, default=lambda: LOW_STOCK_THRESHOLD)
+    # somma di Stock.qty su tutte le location, aggiornata da ogni scrittura di stock
+    total_qty: Mapped[int] = mapped_column(Integer, default=0)
+    # collegamento a Shopify (GID GraphQL), valorizzato dalla prima sincronizzazione
+    shopify_product_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    shopify_variant_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    shopify_inventory_item_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # disponibilità su Shopify dopo l'ultima nostra scrittura (più ordini/resi applicati da allora): è la
+    # compareQuantity del prossimo invio, None = da rileggere
+    shopify_synced_qty: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     stock: Mapped[list["Stock"]] = relationship("Stock", back_populates="product", cascade="all, delete")
     movements: Mapped[list["StockMovement"]] = relationship(
@@ -44,10 +62,13 @@ class Product(Base):
 
 class Stock(Base):
     __tablename__ = "stock"
+    # una sola riga per (prodotto, location): permette l'incremento con upsert ON CONFLICT
+    __table_args__ = (Index("ux_stock_product_location", "product_id", "location_id", unique=True),)
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"))
     location_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"))
     qty: Mapped[int] = mapped_column(Integer, default=0)
+    reorder_threshold: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     product: Mapped[Product] = relationship("Product", back_populates="stock")
     location: Mapped[Location] = relationship("Location", back_populates="products")
@@ -63,6 +84,180 @@ class StockMovement(Base):
     type: Mapped[str] = mapped_column(String(20))
     note: Mapped[Optional[str]] = mapped_column(String(255))
     sale_price: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # costo del prodotto al momento della vendita (solo "sell"): rollup e analytics usano questo
+    unit_cost: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     product: Mapped[Product] = relationship("Product", back_populates="movements")
+
+
+class SalesDaily(Base):
+    """Rollup vendite giorno × prodotto × location, aggiornato a ogni movimento "sell"."""
+
+    __tablename__ = "sales_daily"
+    __table_args__ = (Index("ux_sales_daily_key", "day", "product_id", "location_id", unique=True),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    day: Mapped[date] = mapped_column(Date)
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), index=True)
+    location_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    sales: Mapped[int] = mapped_column(Integer, default=0)
+    units: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[float] = mapped_column(Float, default=0)
+    cost: Mapped[float] = mapped_column(Float, default=0)
+
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    rebuilt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class StockCheckpoint(Base):
+    """Fotografia dello stock per location a un istante, base per ricostruire lo storico."""
+
+    __tablename__ = "stock_checkpoints"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    taken_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    note: Mapped[Optional[str]] = mapped_column(String(255))
+
+    lines: Mapped[list["StockCheckpointLine"]] = relationship(
+        "StockCheckpointLine", back_populates="checkpoint", cascade="all, delete"
+    )
+
+
+class StockCheckpointLine(Base):
+    __tablename__ = "stock_checkpoint_lines"
+    checkpoint_id: Mapped[int] = mapped_column(
+        ForeignKey("stock_checkpoints.id", ondelete="CASCADE"), primary_key=True
+    )
+    product_id: Mapped[int] = mapped_column(primary_key=True)
+    location_id: Mapped[int] = mapped_column(primary_key=True)
+    qty: Mapped[int] = mapped_column(Integer)
+
+    checkpoint: Mapped[StockCheckpoint] = relationship("StockCheckpoint", back_populates="lines")
+
+
+class TableVersion(Base):
+    """Contatore di modifiche per tabella: base per ETag e invalidazione delle cache tra worker."""
+
+    __tablename__ = "table_versions"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# Numerazione degli SKU generati in ricezione. Parte da 1.000.000 per non collidere con i vecchi
+# suffissi a timestamp (sei cifre). Su Postgres è una sequence, altrove si usa la tabella counters.
+SKU_START = 1_000_000
+sku_sequence = Sequence("product_sku_seq", start=SKU_START, metadata=Base.metadata)
+
+
+class Counter(Base):
+    """Contatori atomici (UPDATE ... RETURNING) per i database senza sequence."""
+
+    __tablename__ = "counters"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer)
+
+
+class IdempotencyKey(Base):
+    """Risposte già date alle scritture con header Idempotency-Key, per rispondere ai retry senza rieseguirle."""
+
+    __tablename__ = "idempotency_keys"
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    scope: Mapped[str] = mapped_column(String(64))
+    request_hash: Mapped[str] = mapped_column(String(64))
+    # NULL finché la richiesta originale è in corso
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    response: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class SchemaVersion(Base):
+    """Migrazioni applicate (vedi app/migrations.py): l'avvio controlla solo la versione massima."""
+
+    __tablename__ = "schema_version"
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100))
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ImageMirror(Base):
+    """Stato della copia locale di un'immagine remota (app/services/image_mirror.py), una riga per URL."""
+
+    __tablename__ = "image_mirrors"
+    source_url: Mapped[str] = mapped_column(String(512), primary_key=True)
+    # nome del file in UPLOAD_DIR, valorizzato a copia riuscita
+    file_name: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # prossimo tentativo; NULL = rinuncia definitiva (o copia completata)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
+    # un worker ha preso in carico l'URL fino a questo istante
+    claimed_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ShopifySyncItem(Base):
+    """
+    Coda persistente verso Shopify (app/services/shopify_queue.py): una riga per prodotto da ripubblicare.
+    Le modifiche ripetute allo stesso prodotto incrementano version invece di aggiungere righe.
+    """
+
+    __tablename__ = "shopify_sync_queue"
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=1)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    claim_token: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    claimed_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # dead letter: tentativi esauriti, resta in tabella finché non si rimette in coda a mano
+    dead_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ShopifyReconciliation(Base):
+    """Esito di un confronto giacenze locali / Shopify (app/services/shopify_reconcile.py)."""
+
+    __tablename__ = "shopify_reconciliations"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    dry_run: Mapped[bool] = mapped_column(Boolean, default=False)
+    checked: Mapped[int] = mapped_column(Integer, default=0)
+    differences: Mapped[int] = mapped_column(Integer, default=0)
+    pushed: Mapped[int] = mapped_column(Integer, default=0)
+    # prodotti collegati senza livello sulla location Shopify, prodotti mai collegati, articoli solo su Shopify
+    missing_remote: Mapped[int] = mapped_column(Integer, default=0)
+    not_linked: Mapped[int] = mapped_column(Integer, default=0)
+    unknown_remote: Mapped[int] = mapped_column(Integer, default=0)
+    # già in coda di sincronizzazione o con ordini Shopify non ancora applicati: esclusi dal confronto
+    skipped_pending: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # JSON: le prime differenze trovate (product_id, sku, locale, shopify)
+    details: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+
+class ShopifyWebhookEvent(Base):
+    """
+    Webhook Shopify ricevuti (ordini, rimborsi), coda durevole per app/services/shopify_orders.py.
+    event_key = topic:id della risorsa: lo stesso ordine consegnato più volte viene salvato una volta sola.
+    """
+
+    __tablename__ = "shopify_webhook_events"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    event_key: Mapped[str] = mapped_column(String(128), unique=True)
+    webhook_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    topic: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[str] = mapped_column(Text)
+    received_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # NULL finché l'evento non è stato trasformato in movimenti
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
+    movements: Mapped[int] = mapped_column(Integer, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    claim_token: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    claimed_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # righe non applicate (prodotto sconosciuto, stock insufficiente) o errore dell'ultimo tentativo
+    last_error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    dead_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, Optional
+
+from ..database import get_db
+from .. import schemas
+from ..services import analytics
+
+router = APIRouter(tags=["analytics"])
+
+
+@router.get("/summary", response_model=schemas.SalesSummaryOut)
+def summary(
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Totali vendite (pezzi, ricavi, costo, margine) nel periodo"""
+    return analytics.sales_summary(db, from_dt=from_dt, to_dt=to_dt, location_id=location_id)
+
+
+@router.get("/breakdown", response_model=List[schemas.SalesBucketOut])
+def breakdown(
+    group: str = Query("day", pattern="^(day|week|month|location|brand)$"),
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Vendite raggruppate per giorno/settimana/mese/location/marca"""
+    try:
+        return analytics.sales_breakdown(db, group, from_dt=from_dt, to_dt=to_dt, location_id=location_id)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+
+
+@router.get("/top-products", response_model=List[schemas.TopProductOut])
+def top_products(
+    by: str = Query("revenue", pattern="^(revenue|units|margin)$"),
+    limit: int = Query(10, ge=1, le=100),
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Prodotti più venduti nel periodo"""
+    try:
+        return analytics.top_products(db, from_dt=from_dt, to_dt=to_dt, location_id=location_id, by=by, limit=limit)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
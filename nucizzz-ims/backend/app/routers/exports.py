@@ -0,0 +1,111 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, or_
+from datetime import datetime
+from typing import Iterator, Optional
+import csv
+import io
+
+from ..database import SessionLocal
+from .. import models
+from ..core.responses import dumps
+
+router = APIRouter(tags=["exports"])
+
+EXPORT_BATCH = 2000
+FORMAT_PATTERN = "^(csv|ndjson)$"
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _stream_rows(stmt, columns: list[str], fmt: str) -> Iterator[bytes]:
+    """
+    Esegue la query con un cursore lato server (yield_per) e produce il file a blocchi:
+    la memoria usata non dipende dal numero di righe esportate.
+    La sessione è aperta qui dentro perché deve restare viva per tutta la durata dello stream.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(columns)
+            for partition in result.partitions():
+                writer.writerows(partition)
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+            if buf.tell():
+                yield buf.getvalue().encode("utf-8")
+        else:
+            for partition in result.partitions():
+                yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in partition)
+    finally:
+        db.close()
+
+
+def _response(stmt, columns: list[str], fmt: str, name: str) -> StreamingResponse:
+    ext = "csv" if fmt == "csv" else "ndjson"
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return StreamingResponse(
+        _stream_rows(stmt, columns, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}-{stamp}.{ext}"'},
+    )
+
+
+@router.get("/products")
+def export_products(format: str = Query("csv", pattern=FORMAT_PATTERN), active_only: bool = False):
+    p = models.Product
+    columns = ["id", "sku", "barcode", "title", "brand", "size", "color", "cost", "price", "is_active", "created_at"]
+    stmt = select(*[getattr(p, c) for c in columns]).order_by(p.id)
+    if active_only:
+        stmt = stmt.where(p.is_active.is_(True))
+    return _response(stmt, columns, format, "products")
+
+
+@router.get("/stock")
+def export_stock(format: str = Query("csv", pattern=FORMAT_PATTERN), location_id: Optional[int] = None):
+    s, p, l = models.Stock, models.Product, models.Location
+    stmt = (
+        select(s.product_id, p.sku, p.barcode, p.title, s.location_id, l.name, s.qty)
+        .join(p, p.id == s.product_id)
+        .join(l, l.id == s.location_id)
+        .order_by(s.location_id, s.product_id)
+    )
+    if location_id:
+        stmt = stmt.where(s.location_id == location_id)
+    columns = ["product_id", "sku", "barcode", "title", "location_id", "location", "qty"]
+    return _response(stmt, columns, format, "stock")
+
+
+@router.get("/movements")
+def export_movements(
+    format: str = Query("csv", pattern=FORMAT_PATTERN),
+    type: Optional[str] = Query(None, pattern="^(in|out|transfer|sell)$"),
+    location_id: Optional[int] = None,
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+):
+    m, p = models.StockMovement, models.Product
+    stmt = (
+        select(
+            m.id, m.created_at, m.type, m.product_id, p.sku, p.barcode, p.title,
+            m.qty_change, m.from_location_id, m.to_location_id, m.sale_price, p.cost, m.note,
+        )
+        .join(p, p.id == m.product_id)
+        .order_by(m.created_at, m.id)
+    )
+    if type:
+        stmt = stmt.where(m.type == type)
+    if location_id:
+        stmt = stmt.where(or_(m.from_location_id == location_id, m.to_location_id == location_id))
+    if from_dt:
+        stmt = stmt.where(m.created_at >= from_dt)
+    if to_dt:
+        stmt = stmt.where(m.created_at <= to_dt)
+    columns = [
+        "id", "created_at", "type", "product_id", "sku", "barcode", "title",
+        "qty_change", "from_location_id", "to_location_id", "sale_price", "cost", "note",
+    ]
+    return _response(stmt, columns, format, "movements")
@@ -1,16 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from typing import List
 
 from ..database import get_db
 from .. import schemas, models, crud
+from ..core.http_cache import not_modified, with_cache_headers
+from ..core.responses import FastJSONResponse, serialize_location
 from sqlalchemy import select
 
 router = APIRouter(tags=["locations"])
 
 @router.get("/", response_model=List[schemas.LocationOut])
-def list_locations(db: Session = Depends(get_db)):
-    return db.scalars(select(models.Location)).all()
+def list_locations(request: Request, db: Session = Depends(get_db)):
+    etag, cached = not_modified(db, request, ("locations",))
+    if cached:
+        return cached
+    locations = db.scalars(select(models.Location)).all()
+    return with_cache_headers(FastJSONResponse([serialize_location(loc) for loc in locations]), etag)
 
 @router.post("/", response_model=schemas.LocationOut)
 def create_location(data: schemas.LocationCreate, db: Session = Depends(get_db)):
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, UploadFile, File, Request
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from ..database import get_db
 from .. import schemas, crud, models
-from ..crud import get_or_create_location
+from ..services.product_import import DEFAULT_CHUNK_SIZE, import_products
+from ..core.responses import FastJSONResponse, serialize_products, serialize_product
+from ..core.http_cache import not_modified, with_cache_headers
+from ..core.idempotency import IdempotentRequest
+from ..services import barcode_index
 
 router = APIRouter(tags=["products"])
 
@@ -14,12 +19,21 @@ async def options_receive():
 
 # Static routes first - these will be at /api/products/
 @router.get("/", response_model=List[schemas.ProductOut])
-def list_products(q: Optional[str] = None, location_id: Optional[int] = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
-    return crud.list_products(db, q=q, location_id=location_id, limit=limit, offset=offset)
+def list_products(request: Request, q: Optional[str] = None, location_id: Optional[int] = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
+    tables = ("products", "stock") if location_id is not None else ("products",)
+    etag, cached = not_modified(db, request, tables)
+    if cached:
+        return cached
+    products = crud.list_products(db, q=q, location_id=location_id, limit=limit, offset=offset)
+    return with_cache_headers(FastJSONResponse(serialize_products(products)), etag)
 
 @router.get("/with-stock", response_model=List[schemas.ProductWithStockOut])
-def list_products_with_stock(q: Optional[str] = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
-    return crud.list_products_with_stock(db, q=q, limit=limit, offset=offset)
+def list_products_with_stock(request: Request, q: Optional[str] = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
+    etag, cached = not_modified(db, request, ("products", "stock"))
+    if cached:
+        return cached
+    # i dict arrivano già nel formato di ProductWithStockOut: niente seconda validazione
+    return with_cache_headers(FastJSONResponse(crud.list_products_with_stock(db, q=q, limit=limit, offset=offset)), etag)
 
 @router.post("/", response_model=schemas.ProductOut)
 def create_product(data: schemas.ProductCreate, db: Session = Depends(get_db)):
@@ -28,115 +42,88 @@ def create_product(data: schemas.ProductCreate, db: Session = Depends(get_db)):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/import", response_model=schemas.ImportReport)
+def import_catalogue(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    db: Session = Depends(get_db),
+):
+    """Import massivo da CSV/JSONL: upsert per SKU (o barcode) e stock iniziale per location"""
+    fmt = (format or (file.filename or "").rsplit(".", 1)[-1]).lower()
+    if fmt not in ("csv", "jsonl", "ndjson"):
+        raise HTTPException(400, "Formato non supportato (csv, jsonl)")
+    try:
+        return import_products(db, file.file, fmt=fmt, chunk_size=chunk_size)
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(400, "Il file deve essere in UTF-8")
+
 @router.get("/barcode/{barcode}", response_model=schemas.ProductOut)
 def by_barcode(barcode: str, db: Session = Depends(get_db)):
     """Restituisce il primo prodotto trovato con questo barcode (compatibilità retroattiva)"""
-    p = crud.get_product_by_barcode(db, barcode)
-    if not p:
+    found = barcode_index.lookup(db, barcode)
+    if not found:
         raise HTTPException(404, "Prodotto non trovato")
-    return p
+    return FastJSONResponse(found[0])
 
 @router.get("/barcode/{barcode}/all", response_model=List[schemas.ProductOut])
 def by_barcode_all(barcode: str, db: Session = Depends(get_db)):
     """Restituisce tutti i prodotti con questo barcode"""
-    products = crud.get_products_by_barcode(db, barcode)
+    products = barcode_index.lookup(db, barcode)
     if not products:
         raise HTTPException(404, "Nessun prodotto trovato con questo barcode")
-    return products
+    return FastJSONResponse(products)
 
 @router.post("/receive", response_model=schemas.ProductOut)
-def receive(data: schemas.ReceiveCreate, db: Session = Depends(get_db)):
-    from datetime import datetime
-    import time
-    from sqlalchemy import select
-    from .. import models, crud
-    
-    loc_id = None
-    if data.location:
-        loc = get_or_create_location(db, data.location)
-        loc_id = loc.id
-    
-    # Se il barcode esiste già, usa quel prodotto e aggiungi stock alla location
-    if data.barcode:
-        existing_product = crud.get_product_by_barcode(db, data.barcode)
-        if existing_product:
-            # Prodotto esistente: aggiungi stock alla location specificata
-            if loc_id:
-                # Verifica se esiste già stock per questa location
-                existing_stock = db.scalar(select(models.Stock).where(
-                    (models.Stock.product_id == existing_product.id) &
-                    (models.Stock.location_id == loc_id)
-                ))
-                
-                if existing_stock:
-                    # Incrementa stock esistente
-                    existing_stock.qty += 1
-                else:
-                    # Crea nuovo stock per questa location
-                    new_stock = models.Stock(
-                        product_id=existing_product.id,
-                        location_id=loc_id,
-                        qty=1
-                    )
-                    db.add(new_stock)
-                
-                # Crea movimento
-                mv = models.StockMovement(
-                    product_id=existing_product.id,
-                    type="in",
-                    qty_change=1,
-                    from_location_id=None,
-                    to_location_id=loc_id,
-                    note="Ricezione merce"
-                )
-                db.add(mv)
-                db.commit()
-                db.refresh(existing_product)
-            
-            return existing_product
-    
-    # Prodotto non esiste: crealo
-    # Genera uno SKU univoco basato sul barcode
-    base_sku = data.barcode or f"PROD_{int(time.time())}"
-    timestamp_suffix = int(time.time() * 1000) % 1000000
-    unique_sku = f"{base_sku}_{timestamp_suffix}"
-    
-    # Verifica che lo SKU sia unico
-    counter = 0
-    final_sku = unique_sku
-    while db.scalar(select(models.Product).where(models.Product.sku == final_sku)):
-        counter += 1
-        final_sku = f"{base_sku}_{timestamp_suffix}_{counter}"
-    
-    payload = schemas.ProductCreate(
-        sku=final_sku,
-        barcode=data.barcode,
-        title=data.title,
-        brand=data.brand,
-        description=data.description,
-        size=data.size,
-        color=None,
-        weight_grams=data.weight_g,
-        package_required=data.package_required,
-        cost=data.cost_eur,
-        price=data.price_eur,
-        image_url=data.image_url,
-        is_active=True,
-        initial_qty=1 if loc_id else 0,
-        location_id=loc_id,
-    )
+def receive(data: schemas.ReceiveCreate, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    with IdempotentRequest(db, idempotency_key, "products.receive", data) as idem:
+        if idem.replay is not None:
+            return idem.replay
+        loc_id = crud.resolve_location_id(db, data.location) if data.location else None
+        try:
+            product = crud.receive_product(db, data, loc_id)
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Conflitto durante la ricezione, riprova")
+        return idem.done(schemas.ProductOut, product)
+
+@router.post("/receive/batch", response_model=schemas.ReceiveBatchOut)
+def receive_batch(data: schemas.ReceiveBatchIn, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    """Sessione di scansione completa in una sola chiamata: quantità aggregate per barcode e location"""
+    with IdempotentRequest(db, idempotency_key, "products.receive_batch", data) as idem:
+        if idem.replay is not None:
+            return idem.replay
+        return idem.done(schemas.ReceiveBatchOut, _receive_batch(db, data))
+
+def _receive_batch(db: Session, data: schemas.ReceiveBatchIn) -> dict:
+    names = {line.location or data.location for line in data.lines} - {None}
+    loc_ids = {name: crud.resolve_location_id(db, name) for name in sorted(names)}
     try:
-        return crud.create_product(db, payload)
+        lines = crud.receive_batch(db, data.lines, [loc_ids.get(line.location or data.location) for line in data.lines])
     except ValueError as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Conflitto durante la ricezione, riprova")
+    return {
+        "products_created": len({line["product_id"] for line in lines if line["created"]}),
+        "units": sum(line["qty"] for line in lines if line["location_id"] is not None),
+        "lines": lines,
+    }
 
 # Dynamic routes must be last - these will be at /api/products/{pid}
 @router.get("/{pid}", response_model=schemas.ProductOut)
-def get_one(pid: int, db: Session = Depends(get_db)):
+def get_one(pid: int, request: Request, db: Session = Depends(get_db)):
+    # prima l'esistenza: un ETag vecchio non deve ottenere un 304 per un prodotto eliminato
     p = crud.get_product(db, pid)
     if not p:
         raise HTTPException(404, "Prodotto non trovato")
-    return p
+    etag, cached = not_modified(db, request, ("products",))
+    if cached:
+        return cached
+    return with_cache_headers(FastJSONResponse(serialize_product(p)), etag)
 
 @router.patch("/{pid}", response_model=schemas.ProductOut)
 def update(pid: int, data: dict, db: Session = Depends(get_db)):
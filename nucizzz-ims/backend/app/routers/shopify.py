@@ -1,5 +1,15 @@
-from fastapi import APIRouter, HTTPException
+import json
+from typing import List
+
+from anyio import to_thread
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..database import get_db
+from ..services import shopify_orders
 from ..shopify import ShopifyClient, ShopifyError
 
 router = APIRouter(tags=["shopify"])
@@ -10,10 +20,45 @@ class SetupIn(BaseModel):
     location_id: str | None = None
 
 @router.post("/setup")
-def setup(data: SetupIn):
+async def setup(data: SetupIn):
     try:
-        client = ShopifyClient(data.shop, data.access_token, data.location_id)
-        loc = client.ensure_location(data.location_id)
+        async with ShopifyClient(data.shop, data.access_token, data.location_id) as client:
+            loc = await client.ensure_location(data.location_id)
         return {"location_id": loc}
     except ShopifyError as e:
-        raise HTTPException(400, str(e))
\ No newline at end of file
+        raise HTTPException(400, str(e))
+
+@router.post("/webhooks")
+async def webhooks(request: Request):
+    """
+    Webhook Shopify orders/create e refunds/create: firma verificata, evento salvato in coda e risposta immediata.
+    I movimenti di magazzino li crea il worker (services/shopify_orders).
+    """
+    if not shopify_orders.enabled():
+        raise HTTPException(503, "Webhook Shopify non configurati (SHOPIFY_WEBHOOK_SECRET)")
+    body = await request.body()
+    if not shopify_orders.verify_hmac(body, request.headers.get("X-Shopify-Hmac-Sha256")):
+        raise HTTPException(401, "Firma webhook non valida")
+    topic = request.headers.get("X-Shopify-Topic", "")
+    if topic not in shopify_orders.TOPICS:
+        # sottoscrizioni non gestite: 200 per non far ritentare Shopify all'infinito
+        return {"ok": True, "ignored": topic}
+    try:
+        created = await to_thread.run_sync(
+            shopify_orders.receive, topic, request.headers.get("X-Shopify-Webhook-Id"), body
+        )
+    except shopify_orders.WebhookPayloadError as e:
+        raise HTTPException(400, str(e))
+    return {"ok": True, "duplicate": not created}
+
+@router.get("/reconciliations", response_model=List[schemas.ShopifyReconciliationOut])
+def reconciliations(limit: int = 10, db: Session = Depends(get_db)):
+    """Ultimi report di riconciliazione giacenze (python -m app.cli shopify-reconcile)"""
+    rows = db.scalars(
+        select(models.ShopifyReconciliation).order_by(models.ShopifyReconciliation.id.desc()).limit(min(limit, 100))
+    )
+    return [
+        {**{c.name: getattr(r, c.name) for c in models.ShopifyReconciliation.__table__.columns},
+         "details": json.loads(r.details or "[]")}
+        for r in rows
+    ]
@@ -1,35 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from sqlalchemy.orm import Session
 from ..database import get_db
 from .. import crud, schemas
 from typing import List, Optional
 from sqlalchemy import select, func
 from .. import models
+from ..core.idempotency import IdempotentRequest
+from ..core.responses import FastJSONResponse, serialize_movements
+from ..services import location_registry, stock_history
+from ..services import low_stock as low_stock_service
+from datetime import datetime, timezone
 
 router = APIRouter(tags=["stock"])
 
-@router.get("/low", response_model=List[schemas.ProductOut])
-def low_stock(limit: int = 10, db: Session = Depends(get_db)):
-    """Get products with low stock (less than 5 items total across all locations)"""
-    # Get products with total stock < 5
-    subquery = select(
-        models.Stock.product_id,
-        func.sum(models.Stock.qty).label("total_qty")
-    ).group_by(models.Stock.product_id).subquery()
-    
-    stmt = select(models.Product).join(
-        subquery, models.Product.id == subquery.c.product_id
-    ).where(subquery.c.total_qty < 5).limit(limit)
-    
-    return db.execute(stmt).scalars().all()
+@router.get("/low", response_model=List[schemas.LowStockOut])
+def low_stock(limit: int = Query(10, ge=1, le=500), location_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Prodotti sotto la soglia di riordino (del prodotto o della location), compresi quelli a zero"""
+    return FastJSONResponse(low_stock_service.low_stock(db, limit=limit, location_id=location_id))
+
+@router.put("/thresholds", response_model=schemas.StockOut)
+def set_threshold(data: schemas.StockThresholdIn, db: Session = Depends(get_db)):
+    """Imposta (o rimuove con null) la soglia di riordino di un prodotto in una location"""
+    try:
+        s = crud.set_stock_threshold(db, data.product_id, data.location_id, data.reorder_threshold)
+    except ValueError as exc:
+        raise HTTPException(404, str(exc))
+    return {"location_id": s.location_id, "qty": s.qty}
 
 @router.post("/movement", response_model=schemas.MovementOut)
-def movement(m: schemas.MovementCreate, db: Session = Depends(get_db)):
+def movement(m: schemas.MovementCreate, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    with IdempotentRequest(db, idempotency_key, "stock.movement", m) as idem:
+        if idem.replay is not None:
+            return idem.replay
+        return idem.done(schemas.MovementOut, _apply_movement(db, m))
+
+def _apply_movement(db: Session, m: schemas.MovementCreate):
     if m.qty_change <= 0:
         raise HTTPException(400, "qty_change deve essere positivo")
     if m.type == "transfer":
         if not (m.from_location_id and m.to_location_id and m.qty_change > 0):
             raise HTTPException(400, "Transfer non valido")
+        if not location_registry.exists(db, m.to_location_id):
+            raise HTTPException(400, "Location inesistente")
         try:
             mv = crud.transfer_stock(db, m.product_id, m.from_location_id, m.to_location_id, m.qty_change)
         except ValueError as exc:
@@ -39,10 +51,8 @@ def movement(m: schemas.MovementCreate, db: Session = Depends(get_db)):
         loc = m.to_location_id if m.type == "in" else m.from_location_id
         if not loc:
             raise HTTPException(400, "Location mancante")
-        # valida che la location esista
-        from sqlalchemy import select
-        from ..models import Location
-        if not db.scalar(select(Location).where(Location.id == loc)):
+        # valida che la location esista (registro in memoria, niente query)
+        if not location_registry.exists(db, loc):
             raise HTTPException(400, "Location inesistente")
         sale_price = None
         if m.type == "sell":
@@ -66,12 +76,27 @@ def movement(m: schemas.MovementCreate, db: Session = Depends(get_db)):
     else:
         raise HTTPException(400, "Tipo non supportato")
 
+@router.post("/movements/batch", response_model=schemas.MovementBatchOut)
+def movements_batch(data: schemas.MovementBatchIn, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    """Applica più movimenti (POS, rettifiche massive) in una sola transazione"""
+    with IdempotentRequest(db, idempotency_key, "stock.movements_batch", data) as idem:
+        if idem.replay is not None:
+            return idem.replay
+        try:
+            results = crud.apply_movements_batch(db, data.lines, atomic=data.atomic)
+        except ValueError as exc:
+            errors = exc.args[0] if exc.args and isinstance(exc.args[0], list) else [{"error": str(exc)}]
+            raise HTTPException(400, {"message": "Nessun movimento applicato", "errors": errors})
+        applied = sum(1 for r in results if r["ok"])
+        return idem.done(schemas.MovementBatchOut, {"applied": applied, "failed": len(results) - applied, "results": results})
+
 @router.get("/movements", response_model=List[schemas.MovementOut])
 def list_movements(type: Optional[str] = None, limit: int = 100, offset: int = 0, from_dt: Optional[str] = None, to_dt: Optional[str] = None, db: Session = Depends(get_db)):
     from datetime import datetime
     f = datetime.fromisoformat(from_dt) if from_dt else None
     t = datetime.fromisoformat(to_dt) if to_dt else None
-    return crud.list_movements(db, type=type, limit=limit, offset=offset, from_dt=f, to_dt=t)
+    movements = crud.list_movements(db, type=type, limit=limit, offset=offset, from_dt=f, to_dt=t)
+    return FastJSONResponse(serialize_movements(movements))
 
 # Alias for frontend compatibility - some components call /stock/movements
 @router.get("/stock/movements", response_model=List[schemas.MovementOut])
@@ -79,9 +104,26 @@ def list_movements_stock(type: Optional[str] = None, limit: int = 100, offset: i
     from datetime import datetime
     f = datetime.fromisoformat(from_dt) if from_dt else None
     t = datetime.fromisoformat(to_dt) if to_dt else None
-    return crud.list_movements(db, type=type, limit=limit, offset=offset, from_dt=f, to_dt=t)
+    movements = crud.list_movements(db, type=type, limit=limit, offset=offset, from_dt=f, to_dt=t)
+    return FastJSONResponse(serialize_movements(movements))
 
 @router.get("/by_product/{pid}", response_model=List[schemas.StockOut])
 def by_product(pid: int, db: Session = Depends(get_db)):
     stocks = crud.list_stock_by_product(db, pid)
     return [{"location_id": s.location_id, "qty": s.qty} for s in stocks]
+
+@router.post("/checkpoints", response_model=schemas.CheckpointOut)
+def create_checkpoint(note: Optional[str] = None, db: Session = Depends(get_db)):
+    """Salva una fotografia dello stock attuale (da schedulare, es. ogni notte o a fine mese)"""
+    return stock_history.create_checkpoint(db, note=note)
+
+@router.get("/checkpoints", response_model=List[schemas.CheckpointOut])
+def list_checkpoints(limit: int = 50, db: Session = Depends(get_db)):
+    return db.scalars(select(models.StockCheckpoint).order_by(models.StockCheckpoint.taken_at.desc()).limit(limit)).all()
+
+@router.get("/at", response_model=schemas.StockAtOut)
+def stock_at(ts: datetime, location_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Stock (e valore a costo) a una data/ora passata, es. inventario al 31 dicembre"""
+    if ts.tzinfo:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return stock_history.stock_at(db, ts, location_id=location_id)
@@ -1,10 +1,8 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from pathlib import Path
-import uuid
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 
-UPLOAD_DIR = Path(__file__).resolve().parent.parent / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+from ..core.config import UPLOAD_MAX_BYTES
+from ..services import images
+from ..services.uploads import MULTIPART_OVERHEAD, store_multipart
 
 router = APIRouter(tags=["uploads"])
 
@@ -14,12 +12,15 @@ async def options_uploads():
 
 
 @router.post("/")
-async def upload_image(file: UploadFile = File(...)):
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(400, "Solo immagini")
-    ext = (file.filename or "").split(".")[-1].lower() or "jpg"
-    name = f"{uuid.uuid4().hex}.{ext}"
-    dest = UPLOAD_DIR / name
-    content = await file.read()
-    dest.write_bytes(content)
-    return {"filename": name, "url": f"/api/files/{name}"}
+async def upload_image(request: Request, background: BackgroundTasks):
+    """
+    Campo multipart `file`. Il corpo viene letto in streaming e scritto su disco man mano: un upload dichiarato
+    troppo grande è rifiutato prima di riceverne il corpo, uno senza Content-Length appena supera il limite.
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(413, f"File troppo grande (max {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)")
+    stored = await store_multipart(request.stream(), request.headers.get("content-type"))
+    # miniatura e media vengono generate dopo la risposta, nel pool di processi
+    background.add_task(images.process_upload, stored.name)
+    return {"filename": stored.name, "url": f"/api/files/{stored.name}", "existing": stored.existing}
@@ -26,11 +26,41 @@ class ProductBase(BaseModel):
     price: Optional[float] = None
     image_url: Optional[str] = None
     is_active: Optional[bool] = True
+    reorder_threshold: Optional[int] = Field(default=None, ge=0)
 
 class ProductCreate(ProductBase):
     initial_qty: Optional[int] = 0
     location_id: Optional[int] = None
 
+class ProductImportRow(BaseModel):
+    sku: Optional[str] = None
+    barcode: Optional[str] = None
+    title: Optional[str] = None
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    size: Optional[str] = None
+    color: Optional[str] = None
+    weight_grams: Optional[float] = None
+    package_required: Optional[str] = None
+    cost: Optional[float] = None
+    price: Optional[float] = None
+    image_url: Optional[str] = None
+    is_active: Optional[bool] = None
+    qty: Optional[int] = Field(default=None, ge=0)
+    location: Optional[str] = None
+    location_id: Optional[int] = None
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    processed: int = 0
+    products_upserted: int = 0
+    stock_updated: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+
 class ReceiveCreate(BaseModel):
     barcode: str
     title: str
@@ -44,6 +74,37 @@ class ReceiveCreate(BaseModel):
     location: Optional[str] = None
     image_url: Optional[str] = None
 
+class ReceiveBatchLine(BaseModel):
+    barcode: str = Field(min_length=1)
+    qty: int = Field(default=1, ge=1)
+    location: Optional[str] = None
+    # metadati usati solo se il barcode non esiste ancora
+    title: Optional[str] = None
+    brand: Optional[str] = None
+    description: Optional[str] = None
+    size: Optional[str] = None
+    price_eur: Optional[float] = None
+    cost_eur: Optional[float] = None
+    weight_g: Optional[float] = None
+    package_required: Optional[str] = None
+    image_url: Optional[str] = None
+
+class ReceiveBatchIn(BaseModel):
+    lines: List[ReceiveBatchLine] = Field(min_length=1, max_length=1000)
+    location: Optional[str] = None  # default per le righe senza location
+
+class ReceiveBatchLineOut(BaseModel):
+    barcode: str
+    location_id: Optional[int] = None
+    product_id: int
+    qty: int
+    created: bool
+
+class ReceiveBatchOut(BaseModel):
+    products_created: int
+    units: int
+    lines: List[ReceiveBatchLineOut]
+
 class StockOut(BaseModel):
     location_id: int
     qty: int
@@ -51,9 +112,25 @@ class StockOut(BaseModel):
 class ProductOut(ProductBase):
     id: int
     created_at: datetime
+    image_thumb_url: Optional[str] = None
+    image_medium_url: Optional[str] = None
     class Config:
         from_attributes = True
 
+class LowStockLocationOut(BaseModel):
+    location_id: int
+    qty: int
+    reorder_threshold: int
+
+class LowStockOut(ProductOut):
+    total_qty: int = 0
+    low_locations: List[LowStockLocationOut] = []
+
+class StockThresholdIn(BaseModel):
+    product_id: int
+    location_id: int
+    reorder_threshold: Optional[int] = Field(default=None, ge=0)
+
 class ProductWithStockOut(ProductOut):
     stock: List[StockOut] = []
     total_qty: int = 0
@@ -80,3 +157,85 @@ class MovementOut(BaseModel):
     product: Optional[ProductOut] = None
     class Config:
         from_attributes = True
+
+class MovementBatchIn(BaseModel):
+    lines: List[MovementCreate] = Field(min_length=1, max_length=1000)
+    atomic: bool = True
+
+class MovementBatchLineOut(BaseModel):
+    index: int
+    ok: bool
+    movement: Optional[MovementOut] = None
+    error: Optional[str] = None
+
+class MovementBatchOut(BaseModel):
+    applied: int
+    failed: int
+    results: List[MovementBatchLineOut]
+
+class SalesTotals(BaseModel):
+    sales: int = 0
+    units: int = 0
+    revenue: float = 0
+    cost: float = 0
+    margin: float = 0
+
+class SalesSummaryOut(SalesTotals):
+    from_dt: Optional[datetime] = None
+    to_dt: Optional[datetime] = None
+    active_products: int = 0
+    avg_list_price: Optional[float] = None
+
+class SalesBucketOut(SalesTotals):
+    key: Optional[str] = None
+    label: Optional[str] = None
+
+class TopProductOut(SalesTotals):
+    product_id: int
+    sku: str
+    title: str
+    brand: Optional[str] = None
+
+class CheckpointOut(BaseModel):
+    id: int
+    taken_at: datetime
+    note: Optional[str] = None
+    class Config:
+        from_attributes = True
+
+class StockAtItemOut(BaseModel):
+    product_id: int
+    location_id: int
+    qty: int
+
+class StockAtOut(BaseModel):
+    ts: datetime
+    checkpoint_id: Optional[int] = None
+    reference_at: datetime
+    units: int
+    value: float
+    unlocated: int = 0
+    items: List[StockAtItemOut]
+
+class ReconciliationDiffOut(BaseModel):
+    product_id: int
+    sku: str
+    local: int
+    shopify: Optional[int] = None
+    # cambiata su Shopify durante il confronto: non sovrascritta
+    stale: bool = False
+
+class ShopifyReconciliationOut(BaseModel):
+    id: int
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    dry_run: bool
+    checked: int
+    differences: int
+    pushed: int
+    missing_remote: int
+    not_linked: int
+    unknown_remote: int
+    skipped_pending: int
+    error: Optional[str] = None
+    details: List[ReconciliationDiffOut] = []
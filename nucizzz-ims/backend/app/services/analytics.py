@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Date, cast, func, literal_column, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import sales_rollup
+
+GROUPS = ("day", "week", "month", "location", "brand")
+
+
+def _raw_sales(from_dt: Optional[datetime], to_dt: Optional[datetime], location_id: Optional[int]):
+    m = models.StockMovement
+    units = func.abs(m.qty_change)
+    stmt = (
+        select(
+            m.created_at.label("day"),
+            m.product_id.label("product_id"),
+            m.from_location_id.label("location_id"),
+            literal_column("1").label("sales"),
+            units.label("units"),
+            (func.coalesce(m.sale_price, 0) * units).label("revenue"),
+            (func.coalesce(m.unit_cost, 0) * units).label("cost"),
+        )
+        .where(m.type == "sell")
+    )
+    if from_dt:
+        stmt = stmt.where(m.created_at >= from_dt)
+    if to_dt:
+        stmt = stmt.where(m.created_at <= to_dt)
+    if location_id:
+        stmt = stmt.where(m.from_location_id == location_id)
+    return stmt
+
+
+def _rollup_span(from_dt: Optional[datetime], to_dt: Optional[datetime]) -> Optional[Tuple[Optional[date], date]]:
+    """Giorni interi (fine esclusa) coperti dal rollup: mai oggi, mai giorni tagliati dal filtro."""
+    end = datetime.utcnow().date()
+    if to_dt:
+        end = min(end, to_dt.date())
+    start = None
+    if from_dt:
+        start = from_dt.date() if from_dt.time() == time.min else from_dt.date() + timedelta(days=1)
+        if start >= end:
+            return None
+    return start, end
+
+
+def _sales_lines(db: Session, from_dt: Optional[datetime], to_dt: Optional[datetime], location_id: Optional[int]):
+    """
+    Righe di vendita normalizzate: (day, product_id, location_id, sales, units, revenue, cost).
+    I giorni interi passati vengono letti da sales_daily, il resto (oggi, bordi del periodo)
+    dai movimenti grezzi. Tutte le aggregazioni lavorano su questa sottoquery.
+    """
+    raw = _raw_sales(from_dt, to_dt, location_id)
+    span = _rollup_span(from_dt, to_dt) if sales_rollup.is_ready(db) else None
+    if span is None:
+        return raw.subquery("sales")
+
+    start, end = span
+    m, r = models.StockMovement, models.SalesDaily
+    end_dt = datetime.combine(end, time.min)
+    rollup = select(r.day, r.product_id, r.location_id, r.sales, r.units, r.revenue, r.cost).where(r.day < end)
+    if start:
+        start_dt = datetime.combine(start, time.min)
+        rollup = rollup.where(r.day >= start)
+        raw = raw.where(or_(m.created_at < start_dt, m.created_at >= end_dt))
+    else:
+        raw = raw.where(m.created_at >= end_dt)
+    if location_id:
+        rollup = rollup.where(r.location_id == location_id)
+    return union_all(rollup, raw).subquery("sales")
+
+
+def _totals_columns(sales):
+    revenue = func.coalesce(func.sum(sales.c.revenue), 0)
+    cost = func.coalesce(func.sum(sales.c.cost), 0)
+    return [
+        func.coalesce(func.sum(sales.c.sales), 0).label("sales"),
+        func.coalesce(func.sum(sales.c.units), 0).label("units"),
+        revenue.label("revenue"),
+        cost.label("cost"),
+    ]
+
+
+def _totals(row: Any) -> Dict[str, Any]:
+    revenue = round(float(row.revenue or 0), 2)
+    cost = round(float(row.cost or 0), 2)
+    return {
+        "sales": int(row.sales or 0),
+        "units": int(row.units or 0),
+        "revenue": revenue,
+        "cost": cost,
+        "margin": round(revenue - cost, 2),
+    }
+
+
+def _bucket(db: Session, column, group: str):
+    postgres = db.get_bind().dialect.name == "postgresql"
+    if group == "day":
+        return cast(column, Date) if postgres else func.date(column)
+    if group == "week":
+        if postgres:
+            return cast(func.date_trunc("week", column), Date)
+        return func.date(column, "weekday 0", "-6 days")
+    if postgres:
+        return cast(func.date_trunc("month", column), Date)
+    return func.strftime("%Y-%m-01", column)
+
+
+def sales_summary(
+    db: Session,
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    sales = _sales_lines(db, from_dt, to_dt, location_id)
+    row = db.execute(select(*_totals_columns(sales))).one()
+    p = models.Product
+    catalog = db.execute(
+        select(func.count(p.id), func.avg(p.price)).where(or_(p.is_active.is_(True), p.is_active.is_(None)))
+    ).one()
+    return {
+        **_totals(row),
+        "from_dt": from_dt,
+        "to_dt": to_dt,
+        "active_products": int(catalog[0] or 0),
+        "avg_list_price": round(float(catalog[1]), 2) if catalog[1] is not None else None,
+    }
+
+
+def sales_breakdown(
+    db: Session,
+    group: str,
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    if group not in GROUPS:
+        raise ValueError(f"Raggruppamento non supportato: {group}")
+    sales = _sales_lines(db, from_dt, to_dt, location_id)
+    totals = _totals_columns(sales)
+
+    if group == "location":
+        loc = models.Location
+        stmt = (
+            select(sales.c.location_id.label("key"), loc.name.label("label"), *totals)
+            .select_from(sales)
+            .outerjoin(loc, loc.id == sales.c.location_id)
+            .group_by(sales.c.location_id, loc.name)
+            .order_by(func.sum(sales.c.revenue).desc())
+        )
+    elif group == "brand":
+        p = models.Product
+        stmt = (
+            select(p.brand.label("key"), *totals)
+            .select_from(sales)
+            .join(p, p.id == sales.c.product_id)
+            .group_by(p.brand)
+            .order_by(func.sum(sales.c.revenue).desc())
+        )
+    else:
+        bucket = _bucket(db, sales.c.day, group).label("key")
+        stmt = select(bucket, *totals).group_by(bucket).order_by(bucket)
+
+    results = []
+    for row in db.execute(stmt):
+        key = row.key
+        results.append({
+            "key": None if key is None else str(key),
+            "label": getattr(row, "label", None) or (None if key is None else str(key)),
+            **_totals(row),
+        })
+    return results
+
+
+def top_products(
+    db: Session,
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    location_id: Optional[int] = None,
+    by: str = "revenue",
+    limit: int = 10,
+) -> List[Dict[str, Any]]:
+    if by not in ("revenue", "units", "margin"):
+        raise ValueError(f"Ordinamento non supportato: {by}")
+    sales = _sales_lines(db, from_dt, to_dt, location_id)
+    p = models.Product
+    totals = _totals_columns(sales)
+    order = {
+        "revenue": func.sum(sales.c.revenue),
+        "units": func.sum(sales.c.units),
+        "margin": func.sum(sales.c.revenue) - func.sum(sales.c.cost),
+    }[by]
+    stmt = (
+        select(p.id, p.sku, p.title, p.brand, *totals)
+        .select_from(sales)
+        .join(p, p.id == sales.c.product_id)
+        .group_by(p.id, p.sku, p.title, p.brand)
+        .order_by(order.desc(), p.id)
+        .limit(limit)
+    )
+    return [
+        {"product_id": row.id, "sku": row.sku, "title": row.title, "brand": row.brand, **_totals(row)}
+        for row in db.execute(stmt)
+    ]
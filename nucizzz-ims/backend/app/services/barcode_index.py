@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core import table_versions
+from app.core.config import BARCODE_INDEX_REFRESH
+from app.core.responses import serialize_product
+
+# contatore logico: cambia con anagrafica/barcode dei prodotti, non con le giacenze (products.total_qty)
+CATALOG_KEY = "product_catalog"
+
+_lock = threading.Lock()
+_by_barcode: Dict[str, Tuple[int, ...]] = {}
+_products: Dict[int, Dict[str, Any]] = {}
+_version: Optional[int] = None
+_checked_at = 0.0
+
+
+def _current_version(db: Session) -> int:
+    return table_versions.get_versions(db, [CATALOG_KEY])[CATALOG_KEY]
+
+
+def _put(item: Dict[str, Any]) -> None:
+    pid = item["id"]
+    old = _products.get(pid)
+    if old and old["barcode"] and old["barcode"] != item["barcode"]:
+        ids = tuple(i for i in _by_barcode.get(old["barcode"], ()) if i != pid)
+        if ids:
+            _by_barcode[old["barcode"]] = ids
+        else:
+            _by_barcode.pop(old["barcode"], None)
+    _products[pid] = item
+    if item["barcode"]:
+        _by_barcode[item["barcode"]] = tuple(sorted({*_by_barcode.get(item["barcode"], ()), pid}))
+
+
+def load(db: Session) -> None:
+    """Carica in memoria tutti i prodotti con barcode (stesso formato di ProductOut)."""
+    global _version, _checked_at
+    version = _current_version(db)
+    rows = db.scalars(select(models.Product).where(models.Product.barcode.is_not(None)).order_by(models.Product.id))
+    items = [serialize_product(p) for p in rows]
+    with _lock:
+        _by_barcode.clear()
+        _products.clear()
+        for item in items:
+            _put(item)
+        _version = version
+        _checked_at = time.monotonic()
+
+
+def mark_changed(db: Session) -> None:
+    """Da chiamare nella transazione che crea o modifica prodotti: gli altri worker ricaricano l'indice."""
+    table_versions.bump(db, CATALOG_KEY)
+
+
+def remember(product: models.Product) -> None:
+    """Write-through dopo il commit di una creazione/modifica in questo processo."""
+    item = serialize_product(product)
+    with _lock:
+        _put(item)
+
+
+def invalidate() -> None:
+    global _version
+    with _lock:
+        _version = None
+
+
+def _refresh(db: Session) -> None:
+    global _checked_at
+    if _version is not None and time.monotonic() - _checked_at < BARCODE_INDEX_REFRESH:
+        return
+    if _version is not None and _current_version(db) == _version:
+        _checked_at = time.monotonic()
+        return
+    load(db)
+
+
+def lookup(db: Session, barcode: str) -> List[Dict[str, Any]]:
+    """
+    Prodotti con questo barcode, in ordine di id. Dalla memoria quando possibile; se il barcode
+    non è indicizzato (es. creato da un altro worker da pochi secondi) si interroga il database.
+    """
+    _refresh(db)
+    ids = _by_barcode.get(barcode)
+    if ids:
+        return [_products[pid] for pid in ids]
+    rows = db.scalars(select(models.Product).where(models.Product.barcode == barcode).order_by(models.Product.id)).all()
+    items = [serialize_product(p) for p in rows]
+    with _lock:
+        for item in items:
+            _put(item)
+    return items
+
+
+def first_id(db: Session, barcode: str) -> Optional[int]:
+    found = lookup(db, barcode)
+    return found[0]["id"] if found else None
@@ -0,0 +1,296 @@
+"""
+Copia locale delle immagini remote dei prodotti (URL restituiti dal lookup barcode: OpenFoodFacts, CDN RapidAPI).
+
+Un worker in background scarica le immagini con un client httpx condiviso (connessioni riusate, download
+concorrenti limitati da IMAGE_MIRROR_CONCURRENCY), le salva nello storage degli upload per contenuto, ne genera
+i derivati e riscrive image_url dei prodotti con l'URL locale. Lo stato per URL sta in image_mirrors: la presa in
+carico è un UPDATE condizionato, quindi più worker uvicorn non scaricano la stessa immagine; gli errori
+temporanei si ritentano con backoff, quelli definitivi (404, non immagine, troppo grande) no.
+Gli URL arrivano anche da creazione/modifica/import dei prodotti: prima di ogni richiesta (redirect compresi,
+seguiti a mano) l'host viene risolto e gli indirizzi non pubblici (rete locale, loopback, link-local, metadata
+cloud) sono rifiutati; la connessione va all'indirizzo verificato, non a una nuova risoluzione. Con
+IMAGE_MIRROR_ALLOWED_HOSTS si copiano solo i CDN indicati.
+"""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+from anyio import to_thread
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import (
+    HTTP_TIMEOUT,
+    IMAGE_MIRROR_ALLOWED_HOSTS,
+    IMAGE_MIRROR_CONCURRENCY,
+    IMAGE_MIRROR_ENABLED,
+    IMAGE_MIRROR_INTERVAL,
+    IMAGE_MIRROR_MAX_ATTEMPTS,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_DIR,
+)
+from app.database import dialect_insert
+from app.services import barcode_index, images, workers
+from app.services.uploads import FILES_URL, FileTooLarge, content_extension, store_stream
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+CLAIM_SECONDS = 300
+RETRY_BASE_SECONDS = 300
+RETRY_MAX_SECONDS = 24 * 3600
+MAX_REDIRECTS = 5
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class MirrorError(Exception):
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def is_remote(url: Optional[str]) -> bool:
+    return bool(url) and url.lower().startswith(("http://", "https://"))
+
+
+def client() -> httpx.AsyncClient:
+    """Client condiviso: pool di connessioni keep-alive dimensionato sulla concorrenza dei download."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT * 3, connect=HTTP_TIMEOUT),
+            limits=httpx.Limits(max_connections=IMAGE_MIRROR_CONCURRENCY, max_keepalive_connections=IMAGE_MIRROR_CONCURRENCY),
+            follow_redirects=False,  # seguiti in download(), verificando ogni destinazione
+            headers={"User-Agent": "NucizzzIMS/1.0 (image mirror)", "Accept": "image/*"},
+        )
+    return _client
+
+
+def pending(db: Session, limit: int = BATCH_SIZE) -> List[str]:
+    """URL remoti ancora usati da prodotti: mai visti, già copiati (da riscrivere) o con un nuovo tentativo dovuto."""
+    now = datetime.utcnow()
+    p, m = models.Product, models.ImageMirror
+    remote = or_(p.image_url.like("http://%"), p.image_url.like("https://%"))
+    due = and_(
+        m.next_attempt_at <= now,
+        or_(m.claimed_until.is_(None), m.claimed_until < now),
+    )
+    stmt = (
+        select(p.image_url)
+        .outerjoin(m, m.source_url == p.image_url)
+        .where(remote, or_(m.source_url.is_(None), m.file_name.is_not(None), due))
+        .distinct()
+        .limit(limit)
+    )
+    return list(db.scalars(stmt))
+
+
+def claim(db: Session, url: str) -> tuple[Optional[str], Optional[str]]:
+    """
+    Prende in carico l'URL per CLAIM_SECONDS. Restituisce ("rewrite", file) se l'immagine è già copiata,
+    ("download", None) se tocca a questo worker scaricarla, (None, None) se è di un altro worker o non è dovuta.
+    """
+    now = datetime.utcnow()
+    table = models.ImageMirror.__table__
+    db.execute(
+        dialect_insert(db)(table)
+        .values(source_url=url, attempts=0, next_attempt_at=now, updated_at=now)
+        .on_conflict_do_nothing(index_elements=[table.c.source_url])
+    )
+    row = db.get(models.ImageMirror, url)
+    if row.file_name:
+        if (UPLOAD_DIR / row.file_name).is_file():
+            db.commit()
+            return "rewrite", row.file_name
+        # copia rimossa dal GC quando nessun prodotto la usava: si riscarica
+        row.file_name, row.attempts, row.next_attempt_at = None, 0, now
+        db.flush()
+    res = db.execute(
+        update(table)
+        .where(
+            table.c.source_url == url,
+            table.c.next_attempt_at.is_not(None),
+            table.c.next_attempt_at <= now,
+            or_(table.c.claimed_until.is_(None), table.c.claimed_until < now),
+        )
+        .values(claimed_until=now + timedelta(seconds=CLAIM_SECONDS))
+    )
+    db.commit()
+    return ("download", None) if res.rowcount else (None, None)
+
+
+def rewrite(db: Session, url: str, file_name: str) -> int:
+    """Punta all'immagine locale i prodotti che usano l'URL remoto; restituisce le righe toccate."""
+    local_url = f"{FILES_URL}/{file_name}"
+    res = db.execute(
+        update(models.Product)
+        .where(models.Product.image_url == url)
+        .values(image_url=local_url, **images.derivative_urls(local_url))
+    )
+    if res.rowcount:
+        barcode_index.mark_changed(db)
+    db.commit()
+    if res.rowcount:
+        barcode_index.invalidate()
+    return res.rowcount or 0
+
+
+def record_success(db: Session, url: str, file_name: str) -> int:
+    db.execute(
+        update(models.ImageMirror)
+        .where(models.ImageMirror.source_url == url)
+        .values(file_name=file_name, last_error=None, next_attempt_at=None, claimed_until=None, updated_at=datetime.utcnow())
+    )
+    return rewrite(db, url, file_name)
+
+
+def record_failure(db: Session, url: str, error: MirrorError) -> None:
+    row = db.get(models.ImageMirror, url)
+    row.attempts += 1
+    row.last_error = str(error)[:255]
+    row.claimed_until = None
+    row.updated_at = datetime.utcnow()
+    give_up = error.permanent or row.attempts >= IMAGE_MIRROR_MAX_ATTEMPTS
+    row.next_attempt_at = None if give_up else datetime.utcnow() + workers.backoff(row.attempts, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+    db.commit()
+
+
+async def resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+def _public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_url(url: httpx.URL) -> str:
+    """
+    Rifiuta (errore definitivo) URL verso host fuori lista o che risolvono su indirizzi non pubblici;
+    restituisce l'indirizzo verificato, l'unico a cui ci si collega.
+    """
+    if url.scheme not in ("http", "https") or not url.host:
+        raise MirrorError(f"URL non valido: {url}", permanent=True)
+    host = url.host.lower()
+    if IMAGE_MIRROR_ALLOWED_HOSTS and not any(host == h or host.endswith(f".{h}") for h in IMAGE_MIRROR_ALLOWED_HOSTS):
+        raise MirrorError(f"Host non consentito: {host}", permanent=True)
+    try:
+        addresses = [str(ipaddress.ip_address(host))]
+    except ValueError:
+        try:
+            addresses = await resolve(host, url.port or (443 if url.scheme == "https" else 80))
+        except OSError as exc:
+            raise MirrorError(f"DNS: {exc}")
+    if not addresses or not all(_public(a) for a in addresses):
+        raise MirrorError(f"Indirizzo non pubblico per {host}", permanent=True)
+    return addresses[0].split("%", 1)[0]
+
+
+def _pinned(url: httpx.URL, address: str) -> dict:
+    """
+    Argomenti della richiesta verso l'indirizzo già verificato: httpx non risolve di nuovo l'host (niente DNS
+    rebinding tra controllo e connessione). Host e SNI restano quelli originali, il certificato TLS si verifica
+    sul nome.
+    """
+    return {
+        "url": url.copy_with(host=address),
+        "headers": {"Host": url.netloc.decode("ascii")},
+        "extensions": {"sni_hostname": url.host},
+    }
+
+
+async def download(http: httpx.AsyncClient, url: str) -> str:
+    """Scarica l'immagine in streaming nello storage degli upload e restituisce il nome del file."""
+    target = httpx.URL(url)
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            address = await check_url(target)
+            async with http.stream("GET", **_pinned(target, address)) as res:
+                if res.is_redirect:
+                    target = target.join(res.headers["location"])
+                    continue
+                if res.status_code != 200:
+                    permanent = 400 <= res.status_code < 500 and res.status_code not in (408, 429)
+                    raise MirrorError(f"HTTP {res.status_code}", permanent=permanent)
+                content_type = res.headers.get("content-type", "")
+                if not content_type.lower().startswith("image/"):
+                    raise MirrorError(f"Non è un'immagine ({content_type or 'content-type assente'})", permanent=True)
+                extension = content_extension(content_type, target.path)
+                stored = await store_stream(res.aiter_bytes(UPLOAD_CHUNK_SIZE), extension)
+                return stored.name
+    except FileTooLarge as exc:
+        raise MirrorError(str(exc), permanent=True)
+    except httpx.HTTPError as exc:
+        raise MirrorError(f"{type(exc).__name__}: {exc}")
+    raise MirrorError("Troppi redirect", permanent=True)
+
+
+async def mirror_one(http: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, stats: Dict[str, int]) -> None:
+    action, file_name = await to_thread.run_sync(workers.in_new_session, claim, url)
+    if action is None:
+        stats["skipped"] += 1
+        return
+    if action == "rewrite":
+        stats["products"] += await to_thread.run_sync(workers.in_new_session, rewrite, url, file_name)
+        return
+    try:
+        async with semaphore:
+            name = await download(http, url)
+    except MirrorError as exc:
+        stats["failed"] += 1
+        logger.warning("image mirror failed", extra={"event": "image_mirror", "url": url, "error": str(exc)})
+        await to_thread.run_sync(workers.in_new_session, record_failure, url, exc)
+        return
+    stats["mirrored"] += 1
+    stats["products"] += await to_thread.run_sync(workers.in_new_session, record_success, url, name)
+    # derivati dopo la riscrittura: process_upload li registra sui prodotti che ora usano l'URL locale
+    await images.process_upload(name)
+
+
+async def run_once(http: Optional[httpx.AsyncClient] = None, limit: int = BATCH_SIZE) -> Dict[str, int]:
+    """Un giro del worker: copia (o ricollega) fino a `limit` URL remoti."""
+    stats = {"mirrored": 0, "failed": 0, "skipped": 0, "products": 0}
+    urls = await to_thread.run_sync(workers.in_new_session, pending, limit)
+    semaphore = asyncio.Semaphore(IMAGE_MIRROR_CONCURRENCY)
+    http = http or client()
+    await asyncio.gather(*(mirror_one(http, semaphore, url, stats) for url in urls))
+    stats["pending"] = len(urls)
+    return stats
+
+
+async def _round() -> bool:
+    return (await run_once())["pending"] >= BATCH_SIZE
+
+
+_worker = workers.Worker("image_mirror", _round, IMAGE_MIRROR_INTERVAL)
+
+
+def start() -> None:
+    """Avvia il worker nell'event loop corrente (startup dell'app)."""
+    if IMAGE_MIRROR_ENABLED:
+        _worker.start()
+
+
+async def stop() -> None:
+    global _client
+    await _worker.stop()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def notify(*urls: Optional[str]) -> None:
+    """Sveglia il worker se tra gli URL appena salvati c'è un'immagine remota (sicura da qualsiasi thread)."""
+    if any(is_remote(url) for url in urls):
+        _worker.notify()
@@ -0,0 +1,178 @@
+"""
+Derivati delle immagini caricate: miniatura (card/liste) e media (dettaglio) in WebP, più AVIF se il
+Pillow installato lo supporta. La codifica gira in un pool di processi, fuori dai worker delle richieste.
+Pillow è una dipendenza opzionale: senza, gli upload funzionano ma senza derivati.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from anyio import to_thread
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import IMAGE_AVIF, IMAGE_MEDIUM_PX, IMAGE_THUMB_PX, IMAGE_WORKERS, UPLOAD_DIR
+
+try:  # pragma: no cover - dipende dall'ambiente
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+
+try:  # pragma: no cover - plugin AVIF per Pillow < 11.2
+    import pillow_avif  # noqa: F401
+except ImportError:  # pragma: no cover
+    pass
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = UPLOAD_DIR / "derived"
+FILES_URL = "/api/files"
+VARIANTS = (("thumb", IMAGE_THUMB_PX), ("medium", IMAGE_MEDIUM_PX))
+_QUALITY = {"webp": 80, "avif": 60}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def avif_enabled() -> bool:
+    if not IMAGE_AVIF or Image is None:
+        return False
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+def derived_name(source: str, variant: str, fmt: str = "webp") -> str:
+    return f"{Path(source).stem}.{variant}.{fmt}"
+
+
+def derivative_urls(image_url: Optional[str]) -> Dict[str, Optional[str]]:
+    """URL dei derivati WebP già generati per un'immagine servita da /api/files (altrimenti None)."""
+    urls: Dict[str, Optional[str]] = {"image_thumb_url": None, "image_medium_url": None}
+    prefix = f"{FILES_URL}/"
+    if not image_url or not image_url.startswith(prefix) or "/" in image_url[len(prefix):]:
+        return urls
+    source = image_url[len(prefix):]
+    for variant, _ in VARIANTS:
+        name = derived_name(source, variant)
+        if (DERIVED_DIR / name).is_file():
+            urls[f"image_{variant}_url"] = f"{FILES_URL}/derived/{name}"
+    return urls
+
+
+def render(source: str, upload_dir: str, out_dir: str, formats: List[str]) -> List[str]:
+    """Eseguita nel pool di processi: crea i derivati di un file e restituisce i nomi scritti."""
+    written = []
+    with Image.open(Path(upload_dir) / source) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        for variant, size in VARIANTS:
+            resized = img.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                name = derived_name(source, variant, fmt)
+                part = Path(out_dir) / f".{name}.part"
+                resized.save(part, format=fmt.upper(), quality=_QUALITY[fmt])
+                os.replace(part, Path(out_dir) / name)
+                written.append(name)
+    return written
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _formats() -> List[str]:
+    return ["webp", "avif"] if avif_enabled() else ["webp"]
+
+
+def has_derivatives(source: str, formats: List[str]) -> bool:
+    return all((DERIVED_DIR / derived_name(source, variant, fmt)).is_file() for variant, _ in VARIANTS for fmt in formats)
+
+
+def record(db: Session, source: str) -> int:
+    """Aggiorna i prodotti che usano questa immagine con gli URL dei derivati; restituisce le righe toccate."""
+    from app.services import barcode_index
+
+    image_url = f"{FILES_URL}/{source}"
+    urls = derivative_urls(image_url)
+    if not urls["image_thumb_url"]:
+        return 0
+    res = db.execute(update(models.Product).where(models.Product.image_url == image_url).values(**urls))
+    if res.rowcount:
+        barcode_index.mark_changed(db)
+    db.commit()
+    if res.rowcount:
+        barcode_index.invalidate()
+    return res.rowcount or 0
+
+
+def _record_in_new_session(source: str) -> int:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return record(db, source)
+    finally:
+        db.close()
+
+
+async def process_upload(source: str) -> None:
+    """Task in background dopo l'upload: codifica nel pool, poi registra gli URL sui prodotti."""
+    if not available():
+        return
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    formats = _formats()
+    loop = asyncio.get_running_loop()
+    try:
+        # upload già visto (stesso contenuto): i derivati ci sono già
+        if not has_derivatives(source, formats):
+            await loop.run_in_executor(_executor(), render, source, str(UPLOAD_DIR), str(DERIVED_DIR), formats)
+        await to_thread.run_sync(_record_in_new_session, source)
+    except Exception as exc:
+        logger.warning("image derivatives failed", extra={"event": "image_derivatives", "source": source, "error": str(exc)})
+
+
+def backfill(db: Session, sources: List[str], force: bool = False) -> Dict[str, int]:
+    """Genera i derivati mancanti (o tutti con force) per i file indicati e aggiorna i prodotti."""
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    formats = _formats()
+    todo = [source for source in sources if force or not has_derivatives(source, formats)]
+    stats = {"generated": 0, "failed": 0, "skipped": len(sources) - len(todo), "products": 0}
+    futures = {source: _executor().submit(render, source, str(UPLOAD_DIR), str(DERIVED_DIR), formats) for source in todo}
+    for source, future in futures.items():
+        try:
+            future.result()
+            stats["generated"] += 1
+        except Exception as exc:
+            stats["failed"] += 1
+            logger.warning("image derivatives failed", extra={"event": "image_derivatives", "source": source, "error": str(exc)})
+    for source in sources:
+        stats["products"] += record(db, source)
+    return stats
+
+
+def upload_sources() -> List[str]:
+    """File originali in UPLOAD_DIR (esclusi derivati e upload in corso)."""
+    if not UPLOAD_DIR.is_dir():
+        return []
+    return sorted(p.name for p in UPLOAD_DIR.iterdir() if p.is_file() and not p.name.startswith("."))
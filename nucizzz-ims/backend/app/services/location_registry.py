@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import LOCATION_REGISTRY_REFRESH
+from app.core.table_versions import get_versions
+
+_lock = threading.Lock()
+_by_id: Dict[int, str] = {}
+_by_name: Dict[str, int] = {}
+# lookup mancati già verificati contro il contatore: validi finché la versione di locations non cambia
+_missing_ids: Set[int] = set()
+_missing_names: Set[str] = set()
+_version: Optional[int] = None
+_checked_at = 0.0
+
+
+def load(db: Session) -> None:
+    """(Ri)carica tutte le location: sono poche righe, si legge sempre la tabella intera."""
+    global _version, _checked_at
+    version = get_versions(db, ["locations"])["locations"]
+    rows = db.execute(select(models.Location.id, models.Location.name)).all()
+    with _lock:
+        _by_id.clear()
+        _by_name.clear()
+        _missing_ids.clear()
+        _missing_names.clear()
+        for lid, name in rows:
+            _by_id[lid] = name
+            _by_name[name] = lid
+        _version = version
+        _checked_at = time.monotonic()
+
+
+def remember(location_id: int, name: str) -> None:
+    """Write-through dopo la creazione di una location in questo processo."""
+    with _lock:
+        _by_id[location_id] = name
+        _by_name[name] = location_id
+        _missing_ids.discard(location_id)
+        _missing_names.discard(name)
+
+
+def invalidate() -> None:
+    global _version
+    with _lock:
+        _version = None
+
+
+def _refresh(db: Session, force: bool = False) -> None:
+    """
+    Gli altri worker scrivono sulla stessa tabella: al più ogni LOCATION_REGISTRY_REFRESH secondi
+    si confronta il contatore in table_versions e si ricarica solo se è cambiato.
+    """
+    global _checked_at
+    if _version is not None and not force and time.monotonic() - _checked_at < LOCATION_REGISTRY_REFRESH:
+        return
+    if _version is not None and get_versions(db, ["locations"])["locations"] == _version:
+        _checked_at = time.monotonic()
+        return
+    load(db)
+
+
+def get_id(db: Session, name: str) -> Optional[int]:
+    _refresh(db)
+    lid = _by_name.get(name)
+    if lid is None and name not in _missing_names:
+        # location creata da un altro worker dopo l'ultimo controllo? Un confronto di versione, poi si ricorda il mancato
+        _refresh(db, force=True)
+        lid = _by_name.get(name)
+        if lid is None:
+            with _lock:
+                _missing_names.add(name)
+    return lid
+
+
+def exists(db: Session, location_id: int) -> bool:
+    _refresh(db)
+    if location_id in _by_id:
+        return True
+    if location_id in _missing_ids:
+        return False
+    _refresh(db, force=True)
+    if location_id in _by_id:
+        return True
+    with _lock:
+        _missing_ids.add(location_id)
+    return False
+
+
+def names(db: Session) -> Dict[str, int]:
+    _refresh(db)
+    with _lock:
+        return dict(_by_name)
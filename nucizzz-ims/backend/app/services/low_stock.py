@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import LOW_STOCK_CACHE_TTL
+from app.core.responses import serialize_product
+
+_lock = threading.Lock()
+_generation = 0
+_cache: Dict[Tuple[int, Optional[int]], Tuple[int, float, List[Dict[str, Any]]]] = {}
+
+
+def invalidate() -> None:
+    """Da chiamare dopo ogni scrittura che cambia stock, soglie o stato dei prodotti."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+
+
+def _query(db: Session, limit: int, location_id: Optional[int]) -> List[Dict[str, Any]]:
+    p, s = models.Product, models.Stock
+    active = or_(p.is_active.is_(True), p.is_active.is_(None))
+
+    low_locations: Dict[int, List[Dict[str, int]]] = {}
+    stmt = select(s.product_id, s.location_id, s.qty, s.reorder_threshold).where(
+        s.reorder_threshold.is_not(None) & ((s.qty - s.reorder_threshold) < 0)
+    )
+    if location_id:
+        stmt = stmt.where(s.location_id == location_id)
+    for pid, lid, qty, threshold in db.execute(stmt):
+        low_locations.setdefault(pid, []).append({"location_id": lid, "qty": qty, "reorder_threshold": threshold})
+
+    if location_id:
+        products = db.scalars(select(p).where(p.id.in_(low_locations), active)).all() if low_locations else []
+    else:
+        products = db.scalars(
+            select(p)
+            .where(active & (((p.total_qty - p.reorder_threshold) < 0) | p.id.in_(low_locations)))
+            .order_by(p.total_qty, p.id)
+            .limit(limit)
+        ).all()
+
+    results = []
+    for product in sorted(products, key=lambda x: (x.total_qty, x.id))[:limit]:
+        results.append({
+            **serialize_product(product),
+            "total_qty": product.total_qty,
+            "low_locations": sorted(low_locations.get(product.id, []), key=lambda x: x["location_id"]),
+        })
+    return results
+
+
+def low_stock(db: Session, limit: int = 10, location_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Prodotti sotto soglia (anche a stock zero), con cache in memoria invalidata dai movimenti."""
+    key = (limit, location_id)
+    now = time.monotonic()
+    with _lock:
+        generation = _generation
+        cached = _cache.get(key)
+    if cached and cached[0] == generation and cached[1] > now:
+        return cached[2]
+    results = _query(db, limit, location_id)
+    with _lock:
+        if generation == _generation:
+            _cache[key] = (generation, now + LOW_STOCK_CACHE_TTL, results)
+    return results
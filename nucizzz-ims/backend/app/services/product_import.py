@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.crud import adjust_total_qty
+from app.database import dialect_insert
+from app.services import barcode_index, image_mirror, images, location_registry, low_stock, shopify_queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 500
+
+PRODUCT_FIELDS = (
+    "barcode",
+    "title",
+    "brand",
+    "description",
+    "size",
+    "color",
+    "weight_grams",
+    "package_required",
+    "cost",
+    "price",
+    "image_url",
+    "is_active",
+)
+
+Row = Tuple[int, Dict[str, Any]]
+
+
+def iter_csv(stream: IO[str]) -> Iterator[Row]:
+    reader = csv.DictReader(stream)
+    for record in reader:
+        cleaned = {
+            (k or "").strip(): (v.strip() if isinstance(v, str) else v)
+            for k, v in record.items()
+            if k
+        }
+        yield reader.line_num, {k: v for k, v in cleaned.items() if v not in ("", None)}
+
+
+def iter_jsonl(stream: IO[str]) -> Iterator[Row]:
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            payload = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_no, {"__error__": f"JSON non valido: {exc.msg}"}
+            continue
+        if not isinstance(payload, dict):
+            yield line_no, {"__error__": "Ogni riga deve essere un oggetto JSON"}
+            continue
+        yield line_no, payload
+
+
+def iter_rows(stream: IO[bytes], fmt: str) -> Iterator[Row]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        return iter_csv(text)
+    if fmt in ("jsonl", "ndjson"):
+        return iter_jsonl(text)
+    raise ValueError(f"Formato non supportato: {fmt}")
+
+
+def _chunks(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    chunk: List[Row] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _product_upsert(db: Session):
+    table = models.Product.__table__
+    stmt = dialect_insert(db)(table)
+    # prodotto creato nel frattempo da un'altra richiesta: i campi NULL non sovrascrivono i valori esistenti
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.sku],
+        set_={name: func.coalesce(stmt.excluded[name], table.c[name]) for name in PRODUCT_FIELDS},
+    )
+
+
+class ProductImporter:
+    """
+    Import massivo di prodotti e stock iniziale da CSV/JSONL.
+    Le righe vengono validate e scritte a blocchi (un commit per blocco), quindi la memoria
+    resta costante qualunque sia la dimensione del file.
+    """
+
+    def __init__(self, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        self.db = db
+        self.chunk_size = max(1, chunk_size)
+        self.report = schemas.ImportReport()
+        self._locations_by_name = {name.lower(): lid for name, lid in location_registry.names(db).items()}
+        self._location_ids = set(self._locations_by_name.values())
+
+    def _error(self, line: int, message: str) -> None:
+        self.report.failed += 1
+        if len(self.report.errors) < MAX_REPORTED_ERRORS:
+            self.report.errors.append(schemas.ImportRowError(line=line, error=message))
+
+    def _resolve_location(self, row: schemas.ProductImportRow) -> Optional[int]:
+        if row.location_id is not None:
+            if row.location_id not in self._location_ids:
+                raise ValueError("Location inesistente")
+            return row.location_id
+        if row.location:
+            lid = self._locations_by_name.get(row.location.strip().lower())
+            if lid is None:
+                raise ValueError(f"Location inesistente: {row.location}")
+            return lid
+        return None
+
+    def run(self, rows: Iterable[Row]) -> schemas.ImportReport:
+        for chunk in _chunks(rows, self.chunk_size):
+            self._import_chunk(chunk)
+        return self.report
+
+    def _import_chunk(self, chunk: List[Row]) -> None:
+        db = self.db
+        self.report.processed += len(chunk)
+
+        parsed: List[Tuple[int, schemas.ProductImportRow, Optional[int]]] = []
+        for line, raw in chunk:
+            if "__error__" in raw:
+                self._error(line, raw["__error__"])
+                continue
+            try:
+                row = schemas.ProductImportRow.model_validate(raw)
+                loc_id = self._resolve_location(row)
+            except ValidationError as exc:
+                first = exc.errors()[0]
+                field = ".".join(str(p) for p in first.get("loc", ()))
+                self._error(line, f"{field}: {first.get('msg')}")
+                continue
+            except ValueError as exc:
+                self._error(line, str(exc))
+                continue
+            if not row.sku and not row.barcode:
+                self._error(line, "SKU o barcode obbligatorio")
+                continue
+            if row.qty is not None and loc_id is None:
+                self._error(line, "Location obbligatoria per impostare lo stock")
+                continue
+            parsed.append((line, row, loc_id))
+        if not parsed:
+            return
+
+        # righe senza SKU: si aggancia il prodotto esistente con lo stesso barcode, altrimenti SKU = barcode
+        missing_sku = {row.barcode for _, row, _ in parsed if not row.sku}
+        by_barcode: Dict[str, str] = {}
+        if missing_sku:
+            for barcode, sku in db.execute(
+                select(models.Product.barcode, func.min(models.Product.sku))
+                .where(models.Product.barcode.in_(missing_sku))
+                .group_by(models.Product.barcode)
+            ):
+                by_barcode[barcode] = sku
+        for _, row, _ in parsed:
+            if not row.sku:
+                row.sku = by_barcode.get(row.barcode, row.barcode)
+
+        skus = {row.sku for _, row, _ in parsed}
+        existing = set(db.scalars(select(models.Product.sku).where(models.Product.sku.in_(skus))))
+
+        products: Dict[str, Dict[str, Any]] = {}
+        stock_targets: Dict[Tuple[str, int], int] = {}
+        for line, row, loc_id in parsed:
+            if row.sku not in existing and row.sku not in products and not row.title:
+                self._error(line, "title obbligatorio per i nuovi prodotti")
+                continue
+            values = row.model_dump(include=set(PRODUCT_FIELDS))
+            merged = products.setdefault(row.sku, {"sku": row.sku, **{k: None for k in PRODUCT_FIELDS}})
+            merged.update({k: v for k, v in values.items() if v is not None})
+            if row.qty is not None:
+                stock_targets[(row.sku, loc_id)] = row.qty
+
+        if not products:
+            db.rollback()
+            return
+
+        new_rows = [values for sku, values in products.items() if sku not in existing]
+        for values in new_rows:
+            if values["is_active"] is None:
+                values["is_active"] = True
+        if new_rows:
+            db.execute(_product_upsert(db), new_rows)
+        changed = [
+            {"match_sku": sku, **{k: values[k] for k in PRODUCT_FIELDS}}
+            for sku, values in products.items()
+            if sku in existing
+        ]
+        if changed:
+            table = models.Product.__table__
+            db.execute(
+                update(table)
+                .where(table.c.sku == bindparam("match_sku"))
+                .values({name: func.coalesce(bindparam(name), table.c[name]) for name in PRODUCT_FIELDS}),
+                changed,
+            )
+        # immagine cambiata: i derivati seguono il nuovo URL (None se non è un upload già elaborato)
+        thumbs = [
+            {"match_sku": sku, **images.derivative_urls(values["image_url"])}
+            for sku, values in products.items()
+            if values["image_url"] is not None
+        ]
+        if thumbs:
+            table = models.Product.__table__
+            db.execute(
+                update(table)
+                .where(table.c.sku == bindparam("match_sku"))
+                .values(image_thumb_url=bindparam("image_thumb_url"), image_medium_url=bindparam("image_medium_url")),
+                thumbs,
+            )
+        self.report.products_upserted += len(products)
+
+        if stock_targets:
+            self._apply_stock(stock_targets)
+        barcode_index.mark_changed(db)
+        db.commit()
+        low_stock.invalidate()
+        barcode_index.invalidate()
+        image_mirror.notify(*(values["image_url"] for values in products.values()))
+
+    def _apply_stock(self, targets: Dict[Tuple[str, int], int]) -> None:
+        db = self.db
+        skus = {sku for sku, _ in targets}
+        ids = dict(db.execute(select(models.Product.sku, models.Product.id).where(models.Product.sku.in_(skus))).all())
+        locs = {lid for _, lid in targets}
+        current: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for sid, pid, lid, qty in db.execute(
+            select(models.Stock.id, models.Stock.product_id, models.Stock.location_id, models.Stock.qty).where(
+                models.Stock.product_id.in_(ids.values()) & models.Stock.location_id.in_(locs)
+            )
+        ):
+            current[(pid, lid)] = (sid, qty)
+
+        updates: List[Dict[str, Any]] = []
+        inserts: List[Dict[str, Any]] = []
+        movements: List[Dict[str, Any]] = []
+        for (sku, lid), qty in targets.items():
+            pid = ids[sku]
+            sid, old = current.get((pid, lid), (None, 0))
+            delta = qty - old
+            if not delta:
+                continue
+            if sid is None:
+                inserts.append({"product_id": pid, "location_id": lid, "qty": qty})
+            else:
+                updates.append({"sid": sid, "new_qty": qty})
+            movements.append({
+                "product_id": pid,
+                "type": "in" if delta > 0 else "out",
+                "qty_change": delta,
+                "from_location_id": lid if delta < 0 else None,
+                "to_location_id": lid if delta > 0 else None,
+                "note": "Import",
+                "sale_price": None,
+            })
+
+        totals: Dict[int, int] = {}
+        for (sku, lid), qty in targets.items():
+            pid = ids[sku]
+            totals[pid] = totals.get(pid, 0) + qty - current.get((pid, lid), (None, 0))[1]
+
+        stock = models.Stock.__table__
+        if updates:
+            db.execute(update(stock).where(stock.c.id == bindparam("sid")).values(qty=bindparam("new_qty")), updates)
+        if inserts:
+            db.execute(insert(stock), inserts)
+        if movements:
+            db.execute(insert(models.StockMovement.__table__), movements)
+        adjust_total_qty(db, totals)
+        shopify_queue.enqueue(db, [(m["product_id"], m["from_location_id"] or m["to_location_id"]) for m in movements])
+        self.report.stock_updated += len(movements)
+
+
+def import_products(
+    db: Session,
+    stream: IO[bytes],
+    fmt: str = "csv",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> schemas.ImportReport:
+    importer = ProductImporter(db, chunk_size=chunk_size)
+    report = importer.run(iter_rows(stream, fmt))
+    logger.info(
+        "product_import",
+        extra={
+            "event": "product_import",
+            "processed": report.processed,
+            "upserted": report.products_upserted,
+            "failed": report.failed,
+        },
+    )
+    return report
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Date, cast, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import dialect_insert
+
+ROLLUP_NAME = "sales_daily"
+
+Key = Tuple[date, int, Optional[int]]
+
+
+def record_sales(db: Session, lines: Iterable[Dict[str, Any]]) -> None:
+    """
+    Aggiorna il rollup giornaliero con le vendite appena scritte (senza commit).
+    Ogni riga: created_at, product_id, from_location_id, qty_change (negativo), sale_price, unit_cost.
+    Il costo è quello fotografato sul movimento, come in rebuild() e nelle letture grezze di analytics.
+    """
+    agg: Dict[Key, list] = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    for line in lines:
+        units = abs(line["qty_change"])
+        key = (line["created_at"].date(), line["product_id"], line.get("from_location_id"))
+        bucket = agg[key]
+        bucket[0] += 1
+        bucket[1] += units
+        bucket[2] += (line.get("sale_price") or 0) * units
+        bucket[3] += (line.get("unit_cost") or 0) * units
+    if not agg:
+        return
+
+    table = models.SalesDaily.__table__
+    rows = [
+        {"day": day, "product_id": pid, "location_id": lid, "sales": s, "units": u, "revenue": r, "cost": c}
+        for (day, pid, lid), (s, u, r, c) in agg.items()
+    ]
+    keyed = [row for row in rows if row["location_id"] is not None]
+    if keyed:
+        stmt = dialect_insert(db)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.product_id, table.c.location_id],
+            set_={
+                "sales": table.c.sales + stmt.excluded.sales,
+                "units": table.c.units + stmt.excluded.units,
+                "revenue": table.c.revenue + stmt.excluded.revenue,
+                "cost": table.c.cost + stmt.excluded.cost,
+            },
+        )
+        db.execute(stmt, keyed)
+    # vendite senza location (storico): NULL non collide nell'indice unico, l'accumulo va fatto a mano
+    for row in rows:
+        if row["location_id"] is not None:
+            continue
+        res = db.execute(
+            update(table)
+            .where(table.c.day == row["day"], table.c.product_id == row["product_id"], table.c.location_id.is_(None))
+            .values(
+                sales=table.c.sales + row["sales"], units=table.c.units + row["units"],
+                revenue=table.c.revenue + row["revenue"], cost=table.c.cost + row["cost"],
+            )
+        )
+        if not res.rowcount:
+            db.execute(insert(table).values(**row))
+
+
+def _day_expr(db: Session, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(column, Date)
+    return func.date(column)
+
+
+def rebuild(db: Session) -> int:
+    """Ricostruisce l'intero rollup dallo storico dei movimenti, in una transazione."""
+    m = models.StockMovement
+    table = models.SalesDaily.__table__
+    day = _day_expr(db, m.created_at)
+    units = func.abs(m.qty_change)
+    source = (
+        select(
+            day,
+            m.product_id,
+            m.from_location_id,
+            func.count(m.id),
+            func.sum(units),
+            func.sum(func.coalesce(m.sale_price, 0) * units),
+            func.sum(func.coalesce(m.unit_cost, 0) * units),
+        )
+        .where(m.type == "sell")
+        .group_by(day, m.product_id, m.from_location_id)
+    )
+    db.execute(delete(table))
+    db.execute(
+        insert(table).from_select(
+            ["day", "product_id", "location_id", "sales", "units", "revenue", "cost"], source
+        )
+    )
+    state = db.get(models.RollupState, ROLLUP_NAME)
+    if state:
+        state.rebuilt_at = datetime.utcnow()
+    else:
+        db.add(models.RollupState(name=ROLLUP_NAME, rebuilt_at=datetime.utcnow()))
+    db.commit()
+    return db.scalar(select(func.count()).select_from(table)) or 0
+
+
+def is_ready(db: Session) -> bool:
+    """Il rollup è affidabile solo dopo la prima ricostruzione completa."""
+    return db.get(models.RollupState, ROLLUP_NAME) is not None
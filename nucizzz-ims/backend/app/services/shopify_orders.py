@@ -0,0 +1,371 @@
+"""
+Vendite online da Shopify: webhook orders/create e refunds/create trasformati in movimenti di stock.
+
+L'endpoint verifica la firma HMAC, salva il corpo in shopify_webhook_events e risponde subito: nessuna logica
+di magazzino nel tempo di risposta del webhook. Un worker in background prende in carico gli eventi a blocchi e
+li applica con una sola apply_movements_batch per blocco ("sell" per le righe d'ordine, "in" per i resi con
+rientro a magazzino), segnando gli eventi come elaborati nella stessa transazione dei movimenti. Un evento che non
+si può applicare (stock insufficiente, payload malformato) ritenta da solo con backoff senza fermare gli altri.
+La chiave topic:id rende idempotente la consegna multipla dello stesso ordine.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from anyio import to_thread
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import crud, models, schemas
+from app.core.config import SHOPIFY_ORDERS_BATCH, SHOPIFY_ORDERS_LOCATION, SHOPIFY_SYNC_MAX_ATTEMPTS, SHOPIFY_WEBHOOK_SECRET
+from app.database import SessionLocal, dialect_insert
+from app.services import location_registry, low_stock, workers
+from app.shopify import gid
+
+logger = logging.getLogger(__name__)
+
+TOPICS = ("orders/create", "refunds/create")
+# resi che riportano la merce a magazzino (gli altri sono solo rimborsi economici)
+RESTOCK_TYPES = ("return", "cancel", "legacy_restock")
+CLAIM_SECONDS = 300
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+INTERVAL_SECONDS = 30
+
+
+class WebhookPayloadError(ValueError):
+    pass
+
+
+def enabled() -> bool:
+    return bool(SHOPIFY_WEBHOOK_SECRET)
+
+
+def verify_hmac(body: bytes, signature: Optional[str], secret: Optional[str] = None) -> bool:
+    """X-Shopify-Hmac-Sha256 = base64(HMAC-SHA256(secret, corpo grezzo)), confronto a tempo costante."""
+    secret = secret or SHOPIFY_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+
+def store_event(db: Session, topic: str, webhook_id: Optional[str], body: bytes) -> bool:
+    """Salva il webhook in coda; False se lo stesso ordine/rimborso era già stato ricevuto."""
+    try:
+        payload = json.loads(body)
+        resource_id = payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise WebhookPayloadError("Payload webhook non valido")
+    table = models.ShopifyWebhookEvent.__table__
+    now = datetime.utcnow()
+    res = db.execute(
+        dialect_insert(db)(table)
+        .values(
+            event_key=f"{topic}:{resource_id}", webhook_id=webhook_id, topic=topic, payload=body.decode(),
+            received_at=now, next_attempt_at=now, attempts=0, movements=0,
+        )
+        .on_conflict_do_nothing(index_elements=[table.c.event_key])
+    )
+    db.commit()
+    return bool(res.rowcount)
+
+
+def receive(topic: str, webhook_id: Optional[str], body: bytes) -> bool:
+    """store_event in una sessione propria (chiamata dall'endpoint in un thread) e sveglia del worker."""
+    db = SessionLocal()
+    try:
+        created = store_event(db, topic, webhook_id, body)
+    finally:
+        db.close()
+    if created:
+        notify()
+    return created
+
+
+def _line_key(item: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    variant = item.get("variant_id")
+    return (str(variant) if variant else None, (item.get("sku") or "").strip() or None)
+
+
+def _product_index(db: Session, items: Iterable[Dict[str, Any]]) -> Dict[Tuple[Optional[str], Optional[str]], int]:
+    """Righe d'ordine -> prodotto locale: per variante Shopify, poi per SKU (= barcode o SKU locale)."""
+    keys = {_line_key(item) for item in items}
+    variants = {v for v, _ in keys if v}
+    skus = {s for _, s in keys if s}
+    by_variant: Dict[str, int] = {}
+    if variants:
+        forms = variants | {gid("ProductVariant", v) for v in variants}
+        for pid, variant in db.execute(
+            select(models.Product.id, models.Product.shopify_variant_id).where(models.Product.shopify_variant_id.in_(forms))
+        ):
+            by_variant[variant.rsplit("/", 1)[-1]] = pid
+    by_sku: Dict[str, int] = {}
+    if skus:
+        p = models.Product
+        for pid, sku, barcode in db.execute(
+            select(p.id, p.sku, p.barcode).where(or_(p.sku.in_(skus), p.barcode.in_(skus))).order_by(p.id)
+        ):
+            by_sku.setdefault(sku, pid)
+            if barcode:
+                by_sku.setdefault(barcode, pid)
+    index = {}
+    for variant, sku in keys:
+        pid = by_variant.get(variant) if variant else None
+        if pid is None and sku:
+            pid = by_sku.get(sku)
+        if pid is not None:
+            index[(variant, sku)] = pid
+    return index
+
+
+def _event_lines(topic: str, payload: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str, int, Optional[float]]]:
+    """(riga Shopify, tipo movimento, quantità, prezzo unitario) per ogni articolo dell'evento."""
+    lines = []
+    if topic == "orders/create":
+        for item in payload.get("line_items") or []:
+            qty = int(item.get("quantity") or 0)
+            if qty > 0:
+                lines.append((item, "sell", qty, float(item.get("price") or 0)))
+    elif topic == "refunds/create":
+        for refund in payload.get("refund_line_items") or []:
+            qty = int(refund.get("quantity") or 0)
+            if qty > 0 and refund.get("restock_type") in RESTOCK_TYPES:
+                lines.append((refund.get("line_item") or {}, "in", qty, None))
+    return lines
+
+
+def _note(topic: str, payload: Dict[str, Any]) -> str:
+    if topic == "orders/create":
+        return f"Shopify ordine {payload.get('name') or payload['id']}"
+    return f"Shopify reso ordine {payload.get('order_id')}"
+
+
+def claim(db: Session, token: str, limit: int = SHOPIFY_ORDERS_BATCH) -> List[int]:
+    now = datetime.utcnow()
+    ev = models.ShopifyWebhookEvent
+    available = (
+        ev.processed_at.is_(None),
+        ev.dead_at.is_(None),
+        ev.next_attempt_at <= now,
+        or_(ev.claimed_until.is_(None), ev.claimed_until < now),
+    )
+    ids = list(db.scalars(select(ev.id).where(*available).order_by(ev.id).limit(limit)))
+    if not ids:
+        return []
+    db.execute(
+        update(ev).where(ev.id.in_(ids), *available)
+        .values(claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_SECONDS))
+    )
+    db.commit()
+    return list(db.scalars(select(ev.id).where(ev.claim_token == token).order_by(ev.id)))
+
+
+def _track_shopify_levels(db: Session, movements: List[schemas.MovementCreate]) -> None:
+    """
+    Shopify ha già scalato (o rimesso) la disponibilità per ordini e resi: la disponibilità attesa alla prossima
+    pubblicazione (shopify_synced_qty) segue, anche per le righe che localmente non si sono potute applicare.
+    """
+    deltas: Dict[int, int] = defaultdict(int)
+    for m in movements:
+        deltas[m.product_id] += -m.qty_change if m.type == "sell" else m.qty_change
+    rows = [{"pid": pid, "delta": delta} for pid, delta in sorted(deltas.items()) if delta]
+    if rows:
+        table = models.Product.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("pid"))
+            .values(shopify_synced_qty=table.c.shopify_synced_qty + bindparam("delta")),
+            rows,
+        )
+
+
+def held_products(db: Session) -> Set[int]:
+    """
+    Prodotti citati da eventi non ancora applicati (in coda o in dead letter): su Shopify la disponibilità è già
+    cambiata ma lo stock locale no, quindi fino all'elaborazione non vanno pubblicati né riconciliati.
+    """
+    ev = models.ShopifyWebhookEvent
+    lines = []
+    for topic, payload in db.execute(select(ev.topic, ev.payload).where(ev.processed_at.is_(None))):
+        try:
+            lines += [item for item, *_ in _event_lines(topic, json.loads(payload))]
+        except (ValueError, TypeError, AttributeError):
+            continue  # payload malformato: nessun prodotto riconoscibile
+    return set(_product_index(db, lines).values()) if lines else set()
+
+
+def apply_events(db: Session, token: str, event_id: Optional[int] = None) -> Dict[str, int]:
+    """
+    Trasforma gli eventi presi in carico (o solo `event_id`) in movimenti con una sola apply_movements_batch e li
+    segna elaborati nella stessa transazione. Ogni evento è tutto o niente: se una sua vendita non trova stock
+    sufficiente l'evento non si applica, resta in coda e ritenta con backoff (poi dead letter da verificare),
+    così la vendita online non va persa; gli altri eventi del blocco proseguono.
+    """
+    stmt = select(models.ShopifyWebhookEvent).where(models.ShopifyWebhookEvent.claim_token == token)
+    if event_id is not None:
+        stmt = stmt.where(models.ShopifyWebhookEvent.id == event_id)
+    events = list(db.scalars(stmt.order_by(models.ShopifyWebhookEvent.id)))
+    location_id = location_registry.get_id(db, SHOPIFY_ORDERS_LOCATION)
+    if location_id is None:
+        raise RuntimeError(f"Location {SHOPIFY_ORDERS_LOCATION!r} (SHOPIFY_ORDERS_LOCATION) inesistente")
+
+    parsed = [(event, json.loads(event.payload)) for event in events]
+    per_event = [(event, payload, _event_lines(event.topic, payload)) for event, payload in parsed]
+    index = _product_index(db, (item for _, _, lines in per_event for item, *_ in lines))
+
+    movements: Dict[int, List[schemas.MovementCreate]] = defaultdict(list)
+    problems: Dict[int, List[str]] = defaultdict(list)
+    for n, (event, payload, lines) in enumerate(per_event):
+        note = _note(event.topic, payload)
+        for item, kind, qty, price in lines:
+            pid = index.get(_line_key(item))
+            if pid is None:
+                problems[n].append(f"articolo sconosciuto {item.get('sku') or item.get('variant_id') or item.get('title')}")
+                continue
+            movements[n].append(schemas.MovementCreate(
+                product_id=pid, type=kind, qty_change=qty, note=note, sale_price=price,
+                from_location_id=location_id if kind == "sell" else None,
+                to_location_id=location_id if kind == "in" else None,
+            ))
+
+    # gli eventi con righe rifiutate escono dal blocco e si riprova con i restanti (la batch atomica annulla tutto)
+    rejected: Dict[int, str] = {}
+    while True:
+        applied = [n for n in movements if n not in rejected]
+        batch = [m for n in applied for m in movements[n]]
+        origin = [n for n in applied for _ in movements[n]]
+        try:
+            if batch:
+                crud.apply_movements_batch(db, batch, atomic=True, commit=False)
+            break
+        except ValueError as exc:
+            for error in exc.args[0]:
+                n = origin[error["index"]]
+                rejected.setdefault(n, f"{batch[error['index']].product_id}: {error['error']}")
+    _track_shopify_levels(db, batch)
+
+    now = datetime.utcnow()
+    for n, (event, _, _) in enumerate(per_event):
+        event.claim_token = event.claimed_until = None
+        if n in rejected:
+            _back_off(event, rejected[n], now)
+            continue
+        event.processed_at = now
+        event.movements = len(movements.get(n, ()))
+        event.last_error = "; ".join(problems[n])[:255] or None
+        if problems[n]:
+            logger.warning("shopify order lines skipped", extra={"event": "shopify_orders", "key": event.event_key, "error": event.last_error})
+    db.commit()
+    low_stock.invalidate()
+    stats = {
+        "events": len(events) - len(rejected),
+        "movements": len(batch),
+        "skipped": sum(len(p) for n, p in problems.items() if n not in rejected),
+    }
+    if rejected:
+        stats["failed"] = len(rejected)
+    return stats
+
+
+def _back_off(event: models.ShopifyWebhookEvent, error: str, now: datetime) -> None:
+    event.attempts += 1
+    event.last_error = error[:255]
+    event.next_attempt_at = now + workers.backoff(event.attempts, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+    event.claim_token = event.claimed_until = None
+    if event.attempts >= SHOPIFY_SYNC_MAX_ATTEMPTS:
+        event.dead_at = now
+        logger.warning("shopify order dead letter", extra={"event": "shopify_orders", "key": event.event_key, "error": event.last_error})
+
+
+def record_failure(db: Session, token: str, error: str, event_id: Optional[int] = None) -> None:
+    stmt = select(models.ShopifyWebhookEvent).where(models.ShopifyWebhookEvent.claim_token == token)
+    if event_id is not None:
+        stmt = stmt.where(models.ShopifyWebhookEvent.id == event_id)
+    now = datetime.utcnow()
+    for event in db.scalars(stmt):
+        _back_off(event, error, now)
+    db.commit()
+
+
+def process_batch(limit: int = SHOPIFY_ORDERS_BATCH) -> Dict[str, int]:
+    """
+    Un giro del worker (sincrono, in un thread): claim e applicazione del blocco. Se il blocco fallisce (es. un
+    payload malformato) si riprova un evento alla volta: il backoff tocca solo quello che fallisce davvero.
+    """
+    token = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        ids = claim(db, token, limit)
+        if not ids:
+            return {"events": 0, "movements": 0, "skipped": 0}
+        try:
+            return apply_events(db, token)
+        except Exception as exc:
+            db.rollback()
+            logger.warning("shopify orders batch failed", extra={"event": "shopify_orders", "error": str(exc)})
+            if len(ids) == 1:
+                record_failure(db, token, f"{type(exc).__name__}: {exc}")
+                return {"events": 0, "movements": 0, "skipped": 0, "failed": 1}
+        totals = {"events": 0, "movements": 0, "skipped": 0, "failed": 0}
+        for event_id in ids:
+            try:
+                stats = apply_events(db, token, event_id)
+            except Exception as exc:
+                db.rollback()
+                record_failure(db, token, f"{type(exc).__name__}: {exc}", event_id)
+                stats = {"failed": 1}
+            for key, value in stats.items():
+                totals[key] += value
+        return totals
+    finally:
+        db.close()
+
+
+def status(db: Session) -> Dict[str, int]:
+    ev = models.ShopifyWebhookEvent
+    pending, dead, partial = db.execute(select(
+        func.count().filter(ev.processed_at.is_(None), ev.dead_at.is_(None)),
+        func.count().filter(ev.dead_at.is_not(None)),
+        func.count().filter(ev.processed_at.is_not(None), ev.last_error.is_not(None)),
+    )).one()
+    return {"pending": pending or 0, "dead": dead or 0, "with_skipped_lines": partial or 0}
+
+
+def retry_dead(db: Session) -> int:
+    """Rimette in coda gli eventi in dead letter; restituisce quanti."""
+    res = db.execute(
+        update(models.ShopifyWebhookEvent)
+        .where(models.ShopifyWebhookEvent.dead_at.is_not(None))
+        .values(dead_at=None, attempts=0, next_attempt_at=datetime.utcnow(), last_error=None)
+    )
+    db.commit()
+    return res.rowcount or 0
+
+
+async def _round() -> bool:
+    return (await to_thread.run_sync(process_batch))["events"] >= SHOPIFY_ORDERS_BATCH
+
+
+_worker = workers.Worker("shopify_orders", _round, INTERVAL_SECONDS)
+
+
+def notify() -> None:
+    _worker.notify()
+
+
+def start() -> None:
+    """Avvia il worker nell'event loop corrente se i webhook sono configurati."""
+    if enabled():
+        _worker.start()
+
+
+async def stop() -> None:
+    await _worker.stop()
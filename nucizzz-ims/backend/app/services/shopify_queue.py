@@ -0,0 +1,309 @@
+"""
+Coda persistente delle giacenze da pubblicare su Shopify.
+
+Le scritture di stock chiamano enqueue() dentro la propria transazione: la riga in shopify_sync_queue esiste
+solo se lo stock è stato davvero salvato, e più modifiche allo stesso prodotto si accorpano in una riga (version
+incrementata). Un worker in background, svegliato al commit, prende in carico un blocco di righe, legge le
+quantità correnti e le invia con inventorySetQuantities (i prodotti non ancora collegati vengono prima creati con
+productSet), condizionate alla disponibilità Shopify annotata all'invio precedente (compareQuantity). Il client
+rispetta il budget di costo GraphQL, gli errori ritentano con backoff e dopo SHOPIFY_SYNC_MAX_ATTEMPTS la riga
+resta in coda come dead letter (dead_at) finché non la si rimette in coda.
+"""
+from __future__ import annotations
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from anyio import to_thread
+from sqlalchemy import bindparam, case, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import (
+    SHOPIFY_STOCK_LOCATION,
+    SHOPIFY_SYNC_BATCH,
+    SHOPIFY_SYNC_DEBOUNCE,
+    SHOPIFY_SYNC_INTERVAL,
+    SHOPIFY_SYNC_MAX_ATTEMPTS,
+)
+from app.database import SessionLocal, dialect_insert
+from app.services import location_registry, shopify_orders, shopify_sync, workers
+from app.shopify import ShopifyClient, gid
+
+logger = logging.getLogger(__name__)
+
+CLAIM_SECONDS = 300
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+# prodotti con ordini Shopify ricevuti ma non ancora applicati: si riprova dopo il giro del worker ordini
+HOLD_SECONDS = 30
+HELD_ERROR = "In attesa degli ordini Shopify da elaborare"
+STALE_ERROR = "Giacenza cambiata su Shopify dall'ultimo invio (ordine non ancora ricevuto?): non sovrascritta"
+
+_client: Optional[ShopifyClient] = None
+
+
+def enqueue(db: Session, changes: Iterable[Tuple[int, Optional[int]]]) -> None:
+    """
+    Mette in coda i prodotti con stock cambiato, come coppie (product_id, location_id), senza commit.
+    Con SHOPIFY_STOCK_LOCATION impostata contano solo le modifiche a quella location.
+    """
+    if not shopify_sync.configured():
+        return
+    published = location_registry.get_id(db, SHOPIFY_STOCK_LOCATION) if SHOPIFY_STOCK_LOCATION else None
+    product_ids = sorted({pid for pid, lid in changes if published is None or lid == published})
+    if not product_ids:
+        return
+    now = datetime.utcnow()
+    table = models.ShopifySyncItem.__table__
+    stmt = dialect_insert(db)(table)
+    revived = table.c.dead_at.is_not(None)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id],
+            set_={
+                "version": table.c.version + 1,
+                # una dead letter torna in coda da zero; una riga in backoff mantiene il suo ritmo
+                "attempts": case((revived, 0), else_=table.c.attempts),
+                "next_attempt_at": case((revived, stmt.excluded.next_attempt_at), else_=table.c.next_attempt_at),
+                "dead_at": None,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        ),
+        [{"product_id": pid, "version": 1, "attempts": 0, "next_attempt_at": now, "updated_at": now} for pid in product_ids],
+    )
+    db.info["shopify_queue_dirty"] = True
+
+
+def claim(db: Session, token: str, limit: int = SHOPIFY_SYNC_BATCH) -> Dict[int, int]:
+    """Prende in carico fino a `limit` righe dovute; restituisce {product_id: version} di quelle ottenute."""
+    now = datetime.utcnow()
+    item = models.ShopifySyncItem
+    available = (
+        item.dead_at.is_(None),
+        item.next_attempt_at <= now,
+        or_(item.claimed_until.is_(None), item.claimed_until < now),
+    )
+    ids = list(db.scalars(select(item.product_id).where(*available).order_by(item.next_attempt_at).limit(limit)))
+    if not ids:
+        return {}
+    # condizione ripetuta nell'UPDATE: un altro worker può aver preso alcune righe nel frattempo
+    db.execute(
+        update(item)
+        .where(item.product_id.in_(ids), *available)
+        .values(claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_SECONDS))
+    )
+    db.commit()
+    return dict(db.execute(select(item.product_id, item.version).where(item.claim_token == token)).all())
+
+
+def finish(
+    db: Session,
+    token: str,
+    claimed: Dict[int, int],
+    done: Iterable[int],
+    failures: Dict[int, str],
+    synced: Optional[Dict[int, int]] = None,
+    held: Iterable[int] = (),
+) -> None:
+    """
+    Chiude il giro: elimina le righe pubblicate (se non modificate nel frattempo), ritenta o archivia le altre,
+    rimanda senza contare tentativi quelle `held` e annota la disponibilità scritta su Shopify (`synced`).
+    """
+    table = models.ShopifySyncItem.__table__
+    if synced:
+        # riga rimodificata durante l'invio: un ordine Shopify applicato nel frattempo può aver già corretto
+        # il valore annotato, che quindi si scarta e al prossimo invio si rilegge
+        current = dict(db.execute(select(table.c.product_id, table.c.version).where(
+            table.c.product_id.in_(synced), table.c.claim_token == token
+        )).all())
+        products = models.Product.__table__
+        db.execute(
+            update(products).where(products.c.id == bindparam("pid")).values(shopify_synced_qty=bindparam("qty")),
+            [{"pid": pid, "qty": qty if current.get(pid) == claimed[pid] else None} for pid, qty in sorted(synced.items())],
+        )
+    done_rows = [{"pid": pid, "ver": claimed[pid]} for pid in done]
+    if done_rows:
+        db.execute(
+            delete(table).where(
+                table.c.product_id == bindparam("pid"), table.c.version == bindparam("ver"), table.c.claim_token == token
+            ),
+            done_rows,
+        )
+    now = datetime.utcnow()
+    held = list(held)
+    if held:
+        db.execute(
+            update(table).where(table.c.product_id.in_(held), table.c.claim_token == token)
+            .values(next_attempt_at=now + timedelta(seconds=HOLD_SECONDS), last_error=HELD_ERROR, updated_at=now)
+        )
+    if failures:
+        for row in db.scalars(select(models.ShopifySyncItem).where(
+            models.ShopifySyncItem.product_id.in_(failures), models.ShopifySyncItem.claim_token == token
+        )):
+            row.attempts += 1
+            row.last_error = failures[row.product_id][:255]
+            row.next_attempt_at = now + workers.backoff(row.attempts, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+            row.updated_at = now
+            if row.attempts >= SHOPIFY_SYNC_MAX_ATTEMPTS:
+                row.dead_at = now
+                logger.warning("shopify sync dead letter", extra={
+                    "event": "shopify_sync", "product_id": row.product_id, "error": row.last_error,
+                })
+        db.flush()
+    # righe ancora in coda (fallite o rimodificate durante l'invio): il claim si libera subito
+    db.execute(update(table).where(table.c.claim_token == token).values(claim_token=None, claimed_until=None))
+    db.commit()
+
+
+def _snapshot(db: Session, product_ids: List[int]) -> Tuple[List[models.Product], Dict[int, int], Set[int]]:
+    products, quantities = shopify_sync.load_catalogue(db, product_ids)
+    held = shopify_orders.held_products(db) & set(product_ids)
+    db.expunge_all()  # oggetti staccati: il client ci scrive i GID fuori da questa sessione
+    return products, quantities, held
+
+
+def save_links(db: Session, products: Iterable[models.Product]) -> None:
+    rows = [
+        {"pid": p.id, "product_gid": p.shopify_product_id, "variant_gid": p.shopify_variant_id,
+         "item_gid": p.shopify_inventory_item_id}
+        for p in products if p.shopify_product_id or p.shopify_variant_id or p.shopify_inventory_item_id
+    ]
+    if rows:
+        table = models.Product.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("pid")).values(
+                shopify_product_id=bindparam("product_gid"),
+                shopify_variant_id=bindparam("variant_gid"),
+                shopify_inventory_item_id=bindparam("item_gid"),
+            ),
+            rows,
+        )
+        db.commit()
+
+
+async def _expected_levels(client: ShopifyClient, products: List[models.Product]) -> Dict[int, Optional[int]]:
+    """Disponibilità attesa su Shopify per la compareQuantity: quella annotata, altrimenti riletta adesso."""
+    await client.resolve_inventory_items(products)
+    expected = {p.id: p.shopify_synced_qty for p in products}
+    unknown = [p for p in products if p.shopify_synced_qty is None and p.shopify_inventory_item_id]
+    if unknown:
+        levels = await client.item_levels([p.shopify_inventory_item_id for p in unknown])
+        expected.update({p.id: levels.get(gid("InventoryItem", p.shopify_inventory_item_id)) for p in unknown})
+    return expected
+
+
+async def run_once(client: ShopifyClient, limit: int = SHOPIFY_SYNC_BATCH) -> Dict[str, int]:
+    """
+    Un giro del worker: pubblica le giacenze correnti di un blocco di prodotti in coda. L'invio è condizionato alla
+    disponibilità attesa su Shopify: se nel frattempo è cambiata (un ordine online non ancora ricevuto) l'articolo
+    non viene sovrascritto e ritenta con backoff; i prodotti con ordini ricevuti ma non elaborati aspettano.
+    """
+    token = uuid.uuid4().hex
+    claimed = await to_thread.run_sync(workers.in_new_session, claim, token, limit)
+    stats = {"claimed": len(claimed), "synced": 0, "failed": 0}
+    if not claimed:
+        return stats
+    products: List[models.Product] = []
+    held: Set[int] = set()
+    done: Set[int] = set()
+    failures: Dict[int, str] = {}
+    synced: Dict[int, int] = {}
+    try:
+        products, quantities, held = await to_thread.run_sync(workers.in_new_session, _snapshot, list(claimed))
+        # prodotto eliminato nel frattempo: niente da pubblicare
+        done = set(claimed) - {p.id for p in products}
+        products = [p for p in products if p.id not in held]
+        unlinked = [p for p in products if not p.shopify_variant_id and not p.shopify_inventory_item_id]
+        rejected = set(await client.upsert_products(unlinked)) if unlinked else set()
+        pushable = [p for p in products if p.sku not in rejected]
+        compare = await _expected_levels(client, pushable)
+        stale = {p.id for p in await client.set_inventory(
+            [(p, max(quantities.get(p.id, 0), 0)) for p in pushable], compare=compare
+        )}
+        synced = {p.id: p.shopify_synced_qty for p in pushable if p.id not in stale}
+        done |= set(synced)
+        failures = {p.id: "Prodotto rifiutato da Shopify (productSet)" for p in products if p.sku in rejected}
+        failures.update({pid: STALE_ERROR for pid in stale})
+    except Exception as exc:
+        # qualsiasi errore (anche una risposta malformata) conta come tentativo: niente claim lasciati a scadere
+        # e un prodotto che fa fallire ogni giro arriva comunque in dead letter
+        logger.warning("shopify sync failed", extra={"event": "shopify_sync", "products": len(claimed), "error": str(exc)})
+        done -= set(synced)
+        synced = {}
+        failures = {pid: f"{type(exc).__name__}: {exc}" for pid in set(claimed) - done - held}
+    finally:
+        # i GID ottenuti valgono anche se l'invio delle giacenze è fallito: il tentativo successivo non duplica
+        if products:
+            await to_thread.run_sync(workers.in_new_session, save_links, products)
+    await to_thread.run_sync(workers.in_new_session, finish, token, claimed, done - set(failures), failures, synced, held)
+    stats["synced"] = len(done - set(failures))
+    stats["failed"] = len(failures)
+    if held:
+        stats["held"] = len(held)
+    return stats
+
+
+def status(db: Session) -> Dict[str, int]:
+    item = models.ShopifySyncItem
+    pending, dead = db.execute(select(
+        func.count().filter(item.dead_at.is_(None)), func.count().filter(item.dead_at.is_not(None))
+    )).one()
+    return {"pending": pending or 0, "dead": dead or 0}
+
+
+def retry_dead(db: Session) -> int:
+    """Rimette in coda le dead letter; restituisce quante."""
+    res = db.execute(
+        update(models.ShopifySyncItem)
+        .where(models.ShopifySyncItem.dead_at.is_not(None))
+        .values(dead_at=None, attempts=0, next_attempt_at=datetime.utcnow(), last_error=None)
+    )
+    db.commit()
+    return res.rowcount or 0
+
+
+async def _round() -> bool:
+    return (await run_once(_client))["claimed"] >= SHOPIFY_SYNC_BATCH
+
+
+# il debounce accorpa le modifiche che arrivano a raffica (vendite in sequenza alla cassa)
+_worker = workers.Worker("shopify_sync", _round, SHOPIFY_SYNC_INTERVAL, debounce=SHOPIFY_SYNC_DEBOUNCE)
+
+
+def _after_commit(session: Session) -> None:
+    if session.info.pop("shopify_queue_dirty", False):
+        notify()
+
+
+def _after_rollback(session: Session) -> None:
+    session.info.pop("shopify_queue_dirty", None)
+
+
+def notify() -> None:
+    """Sveglia il worker (sicura da qualsiasi thread)."""
+    _worker.notify()
+
+
+def start() -> None:
+    """Avvia il worker nell'event loop corrente se Shopify è configurato."""
+    global _client
+    if not shopify_sync.configured() or _worker.running:
+        return
+    _client = shopify_sync.client_from_env()
+    event.listen(SessionLocal, "after_commit", _after_commit)
+    event.listen(SessionLocal, "after_rollback", _after_rollback)
+    _worker.start()
+
+
+async def stop() -> None:
+    global _client
+    if not _worker.running:
+        return
+    event.remove(SessionLocal, "after_commit", _after_commit)
+    event.remove(SessionLocal, "after_rollback", _after_rollback)
+    await _worker.stop()
+    await _client.aclose()
+    _client = None
@@ -0,0 +1,109 @@
+"""
+Riconciliazione giacenze locali / Shopify per differenza.
+
+Legge a pagine i livelli di inventario della location Shopify (poche richieste per tutto il catalogo), li
+confronta in memoria con le quantità locali pubblicate indicizzate per inventory item e reinvia solo gli articoli
+diversi, condizionati al livello appena letto (compareQuantity). Sono esclusi i prodotti in coda di
+sincronizzazione (li sta già aggiornando il worker) e quelli citati da ordini/resi Shopify non ancora applicati
+(su Shopify la disponibilità è già cambiata, lo stock locale non ancora). L'esito viene salvato in
+shopify_reconciliations. Pensata per un passaggio notturno (`python -m app.cli shopify-reconcile`).
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import shopify_orders, shopify_sync
+from app.shopify import ShopifyClient, ShopifyError, gid
+
+MAX_DETAILS = 200
+
+
+def local_levels(db: Session) -> Dict[str, Tuple[int, str, int]]:
+    """{inventory item GID: (product_id, sku, quantità pubblicata)} per i prodotti collegati a Shopify."""
+    p = models.Product
+    lid = shopify_sync.published_location_id(db)
+    if lid is None:
+        stmt = select(p.id, p.sku, p.shopify_inventory_item_id, p.total_qty)
+    else:
+        s = models.Stock
+        stmt = (
+            select(p.id, p.sku, p.shopify_inventory_item_id, func.coalesce(s.qty, 0))
+            .outerjoin(s, (s.product_id == p.id) & (s.location_id == lid))
+        )
+    rows = db.execute(stmt.where(p.shopify_inventory_item_id.is_not(None)))
+    return {gid("InventoryItem", item): (pid, sku, max(qty or 0, 0)) for pid, sku, item, qty in rows}
+
+
+def _save_synced(db: Session, products: List[models.Product]) -> None:
+    if products:
+        table = models.Product.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("pid")).values(shopify_synced_qty=bindparam("qty")),
+            [{"pid": p.id, "qty": p.shopify_synced_qty} for p in products],
+        )
+
+
+async def reconcile(db: Session, client: ShopifyClient, dry_run: bool = False) -> models.ShopifyReconciliation:
+    """
+    Confronta e riallinea; restituisce il report salvato. Come sync_catalogue usa la sessione in modo sincrono:
+    va lanciata da CLI o da un worker dedicato, non dall'event loop delle richieste.
+    """
+    report = models.ShopifyReconciliation(started_at=datetime.utcnow(), dry_run=dry_run)
+    db.add(report)
+    db.commit()
+    try:
+        remote = await client.inventory_levels()
+        # esclusioni lette dopo lo stock locale: un prodotto modificato durante il giro delle pagine è già in coda
+        local = local_levels(db)
+        skipped = set(db.scalars(
+            select(models.ShopifySyncItem.product_id).where(models.ShopifySyncItem.dead_at.is_(None))
+        )) | shopify_orders.held_products(db)
+        report.not_linked = db.scalar(
+            select(func.count()).select_from(models.Product)
+            .where(models.Product.shopify_inventory_item_id.is_(None), models.Product.is_active.is_(True))
+        ) or 0
+
+        to_push = []
+        details = []
+        for item, (pid, sku, qty) in local.items():
+            if pid in skipped:
+                report.skipped_pending += 1
+                continue
+            report.checked += 1
+            shopify_qty = remote.get(item)
+            if shopify_qty == qty:
+                continue
+            if shopify_qty is None:
+                # articolo non attivo sulla location Shopify: si segnala, l'attivazione è una scelta del negozio
+                report.missing_remote += 1
+            else:
+                report.differences += 1
+                to_push.append((models.Product(id=pid, sku=sku, shopify_inventory_item_id=item), qty))
+            if len(details) < MAX_DETAILS:
+                details.append({"product_id": pid, "sku": sku, "local": qty, "shopify": shopify_qty})
+        report.unknown_remote = len(remote.keys() - local.keys())
+        report.details = json.dumps(details, ensure_ascii=False)
+
+        if to_push and not dry_run:
+            # condizionato al livello appena letto: una vendita online arrivata nel frattempo non viene sovrascritta
+            stale = {p.id for p in await client.set_inventory(
+                to_push, reason="correction", compare={p.id: remote[p.shopify_inventory_item_id] for p, _ in to_push}
+            )}
+            pushed = [p for p, _ in to_push if p.id not in stale]
+            report.pushed = len(pushed)
+            _save_synced(db, pushed)
+            if stale:
+                report.details = json.dumps([{**d, "stale": d["product_id"] in stale} for d in details], ensure_ascii=False)
+    except ShopifyError as exc:
+        report.error = str(exc)[:255]
+        raise
+    finally:
+        report.finished_at = datetime.utcnow()
+        db.commit()
+    return report
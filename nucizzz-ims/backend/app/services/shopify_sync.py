@@ -0,0 +1,91 @@
+"""
+Sincronizzazione catalogo e giacenze verso Shopify (vedi app/shopify.py per il client GraphQL).
+
+Lo stock pubblicato è quello della location SHOPIFY_STOCK_LOCATION, oppure il totale di tutte le location
+se non è impostata. I GID restituiti da Shopify vengono salvati sui prodotti a fine sincronizzazione.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import (
+    DISABLE_SHOPIFY,
+    SHOPIFY_ACCESS_TOKEN,
+    SHOPIFY_BULK_THRESHOLD,
+    SHOPIFY_LOCATION_ID,
+    SHOPIFY_SHOP,
+    SHOPIFY_STOCK_LOCATION,
+)
+from app.services import location_registry
+from app.shopify import ShopifyClient, ShopifyError
+
+
+def configured() -> bool:
+    return not DISABLE_SHOPIFY and bool(SHOPIFY_SHOP and SHOPIFY_ACCESS_TOKEN)
+
+
+def client_from_env(**kwargs: Any) -> ShopifyClient:
+    if DISABLE_SHOPIFY:
+        raise ShopifyError("Integrazione Shopify disattivata (DISABLE_SHOPIFY)")
+    return ShopifyClient(SHOPIFY_SHOP, SHOPIFY_ACCESS_TOKEN, SHOPIFY_LOCATION_ID or None, **kwargs)
+
+
+def published_location_id(db: Session) -> Optional[int]:
+    """Location locale pubblicata su Shopify (None = totale di tutte le location)."""
+    if not SHOPIFY_STOCK_LOCATION:
+        return None
+    lid = location_registry.get_id(db, SHOPIFY_STOCK_LOCATION)
+    if lid is None:
+        raise ShopifyError(f"Location {SHOPIFY_STOCK_LOCATION!r} (SHOPIFY_STOCK_LOCATION) inesistente")
+    return lid
+
+
+def published_quantities(db: Session, product_ids: Sequence[int]) -> Dict[int, int]:
+    """Quantità da pubblicare per prodotto: stock della location configurata o total_qty."""
+    if not product_ids:
+        return {}
+    lid = published_location_id(db)
+    if lid is not None:
+        rows = db.execute(
+            select(models.Stock.product_id, models.Stock.qty)
+            .where(models.Stock.location_id == lid, models.Stock.product_id.in_(product_ids))
+        )
+    else:
+        rows = db.execute(select(models.Product.id, models.Product.total_qty).where(models.Product.id.in_(product_ids)))
+    quantities = {pid: 0 for pid in product_ids}
+    quantities.update({pid: qty or 0 for pid, qty in rows})
+    return quantities
+
+
+def load_catalogue(db: Session, product_ids: Optional[Sequence[int]] = None) -> Tuple[List[models.Product], Dict[int, int]]:
+    """Prodotti da pubblicare (attivi, più quelli già collegati che vanno messi in bozza) e relative quantità."""
+    stmt = select(models.Product).order_by(models.Product.id)
+    if product_ids is not None:
+        stmt = stmt.where(models.Product.id.in_(product_ids))
+    else:
+        stmt = stmt.where(models.Product.is_active.is_(True) | models.Product.shopify_product_id.is_not(None))
+    products = list(db.scalars(stmt))
+    return products, published_quantities(db, [p.id for p in products])
+
+
+async def sync_catalogue(
+    db: Session,
+    client: ShopifyClient,
+    product_ids: Optional[Sequence[int]] = None,
+    bulk_threshold: int = SHOPIFY_BULK_THRESHOLD,
+) -> Dict[str, Any]:
+    """
+    Pubblica prodotti e giacenze e salva i GID. Le query al database sono sincrone: da un event loop
+    condiviso con le richieste HTTP va chiamata solo tramite worker dedicato (CLI o thread).
+    """
+    products, quantities = load_catalogue(db, product_ids)
+    try:
+        result = await client.sync_products(products, quantities, bulk_threshold)
+    finally:
+        # i collegamenti ottenuti prima di un errore restano salvati: la prossima sync aggiorna invece di duplicare
+        db.commit()
+    return result
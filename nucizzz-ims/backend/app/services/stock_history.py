@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app import models
+
+Key = Tuple[int, int]
+
+
+# i movimenti prendono created_at dall'app prima del commit: oltre questo margine si considerano tutti committati
+SETTLE_SECONDS = 300
+
+
+def create_checkpoint(db: Session, note: Optional[str] = None) -> models.StockCheckpoint:
+    """
+    Fotografia dello stock a taken_at = adesso - SETTLE_SECONDS, con un solo INSERT ... SELECT: stock corrente
+    meno i movimenti successivi a taken_at, letti nello stesso statement (stessa snapshot del database). Un
+    movimento in corso di commit durante la copia o è in entrambe le parti o in nessuna, e il replay in avanti
+    (created_at > taken_at) lo conta una volta sola.
+    """
+    cp = models.StockCheckpoint(taken_at=datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS), note=note)
+    db.add(cp)
+    db.flush()
+    s = models.Stock
+    later = _delta_lines(models.StockMovement.created_at > cp.taken_at, None)
+    lines = union_all(
+        select(s.product_id.label("product_id"), s.location_id.label("location_id"), s.qty.label("delta")),
+        select(later.c.product_id, later.c.location_id, -later.c.delta),
+    ).subquery()
+    db.execute(
+        insert(models.StockCheckpointLine.__table__).from_select(
+            ["checkpoint_id", "product_id", "location_id", "qty"],
+            select(literal(cp.id), lines.c.product_id, lines.c.location_id, func.sum(lines.c.delta))
+            .group_by(lines.c.product_id, lines.c.location_id)
+            .having(func.sum(lines.c.delta) != 0),
+        )
+    )
+    db.commit()
+    db.refresh(cp)
+    return cp
+
+
+def _delta_lines(window: Any, location_id: Optional[int]) -> Any:
+    """Righe (product_id, location_id, delta) dei movimenti in window: entrate a destinazione, uscite all'origine."""
+    m = models.StockMovement
+    qty = func.abs(m.qty_change)
+    incoming = select(
+        m.product_id.label("product_id"), m.to_location_id.label("location_id"), qty.label("delta")
+    ).where(window & m.to_location_id.is_not(None))
+    outgoing = select(
+        m.product_id.label("product_id"), m.from_location_id.label("location_id"), (-qty).label("delta")
+    ).where(window & m.from_location_id.is_not(None))
+    if location_id:
+        incoming = incoming.where(m.to_location_id == location_id)
+        outgoing = outgoing.where(m.from_location_id == location_id)
+    return union_all(incoming, outgoing).subquery()
+
+
+def _deltas(db: Session, after: datetime, until: datetime, location_id: Optional[int]) -> Dict[Key, int]:
+    """
+    Variazione netta per (prodotto, location) dei movimenti con after < created_at <= until,
+    calcolata con un'unica aggregazione: entrate sulla location di destinazione, uscite su quella di origine.
+    """
+    m = models.StockMovement
+    lines = _delta_lines((m.created_at > after) & (m.created_at <= until), location_id)
+    stmt = select(lines.c.product_id, lines.c.location_id, func.sum(lines.c.delta)).group_by(
+        lines.c.product_id, lines.c.location_id
+    )
+    return {(pid, lid): int(delta) for pid, lid, delta in db.execute(stmt)}
+
+
+def _unlocated(db: Session, after: datetime, until: datetime) -> int:
+    """Movimenti nella finestra senza nessuna location (vendite storiche non attribuite): non ricostruibili."""
+    m = models.StockMovement
+    return db.scalar(
+        select(func.count()).select_from(m).where(
+            m.created_at > after, m.created_at <= until,
+            m.from_location_id.is_(None), m.to_location_id.is_(None),
+        )
+    ) or 0
+
+
+def _base(db: Session, checkpoint: Optional[models.StockCheckpoint], location_id: Optional[int]) -> Dict[Key, int]:
+    if checkpoint is None:
+        s = models.Stock
+        stmt = select(s.product_id, s.location_id, s.qty)
+        if location_id:
+            stmt = stmt.where(s.location_id == location_id)
+    else:
+        line = models.StockCheckpointLine
+        stmt = select(line.product_id, line.location_id, line.qty).where(line.checkpoint_id == checkpoint.id)
+        if location_id:
+            stmt = stmt.where(line.location_id == location_id)
+    base: Dict[Key, int] = defaultdict(int)
+    for pid, lid, qty in db.execute(stmt):
+        base[(pid, lid)] += qty
+    return base
+
+
+def stock_at(db: Session, ts: datetime, location_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Stock per prodotto/location all'istante ts.
+    Si parte dal punto di riferimento più vicino (checkpoint precedente, successivo o stock attuale)
+    e si applica la differenza dei movimenti in avanti o all'indietro. I movimenti storici senza location
+    (migrazione 13) non si possono attribuire: vengono contati in "unlocated".
+    """
+    now = datetime.utcnow()
+    cp = models.StockCheckpoint
+    before = db.scalar(select(cp).where(cp.taken_at <= ts).order_by(cp.taken_at.desc()).limit(1))
+    after = db.scalar(select(cp).where(cp.taken_at > ts).order_by(cp.taken_at.asc()).limit(1))
+
+    # (distanza, checkpoint, istante di riferimento); None = stock attuale
+    candidates: List[Tuple[float, Optional[models.StockCheckpoint], datetime]] = [
+        (abs((now - ts).total_seconds()), None, now)
+    ]
+    if before:
+        candidates.append(((ts - before.taken_at).total_seconds(), before, before.taken_at))
+    if after:
+        candidates.append(((after.taken_at - ts).total_seconds(), after, after.taken_at))
+    _, ref, ref_at = min(candidates, key=lambda c: c[0])
+
+    result = _base(db, ref, location_id)
+    window = (ref_at, ts) if ref_at <= ts else (ts, ref_at)
+    sign = 1 if ref_at <= ts else -1
+    for key, delta in _deltas(db, *window, location_id).items():
+        result[key] += sign * delta
+
+    items = [
+        {"product_id": pid, "location_id": lid, "qty": qty}
+        for (pid, lid), qty in sorted(result.items())
+        if qty
+    ]
+    costs: Dict[int, Optional[float]] = {}
+    if items:
+        p = models.Product
+        ids = {item["product_id"] for item in items}
+        costs = dict(db.execute(select(p.id, p.cost).where(p.id.in_(ids))).all())
+    value = sum(item["qty"] * (costs.get(item["product_id"]) or 0) for item in items)
+    return {
+        "ts": ts,
+        "checkpoint_id": ref.id if ref else None,
+        "reference_at": ref_at,
+        "units": sum(item["qty"] for item in items),
+        # movimenti senza location nel periodo ripercorso: se > 0 il risultato è approssimato
+        "unlocated": _unlocated(db, *window),
+        "value": round(value, 2),
+        "items": items,
+    }
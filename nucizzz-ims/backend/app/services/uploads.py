@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, NamedTuple
+
+from anyio import to_thread
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header  # python-multipart, come Starlette
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import UPLOAD_DIR, UPLOAD_MAX_BYTES
+
+INCOMING_DIR = UPLOAD_DIR / ".incoming"
+TRASH_DIR = UPLOAD_DIR / ".trash"
+FILES_URL = "/api/files"
+# margine per intestazioni multipart e altri campi del form oltre al file
+MULTIPART_OVERHEAD = 64 * 1024
+_EXT_RE = re.compile(r"^[a-z0-9]{1,5}$")
+# stessa immagine = stesso nome anche se il telefono la chiama .JPG, .jpeg o senza estensione
+_EXT_BY_TYPE = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/avif": "avif",
+    "image/heic": "heic",
+    "image/heif": "heif",
+}
+
+
+class FileTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File troppo grande (max {max_bytes // (1024 * 1024)} MB)")
+        self.max_bytes = max_bytes
+
+
+class StoredUpload(NamedTuple):
+    name: str
+    existing: bool
+
+
+def safe_extension(filename: str | None, default: str = "jpg") -> str:
+    ext = (filename or "").rsplit(".", 1)[-1].lower() if "." in (filename or "") else ""
+    return ext if _EXT_RE.match(ext) else default
+
+
+def content_extension(content_type: str | None, filename: str | None) -> str:
+    mime = (content_type or "").split(";", 1)[0].strip().lower()
+    return _EXT_BY_TYPE.get(mime) or safe_extension(filename)
+
+
+def _open_part() -> tuple[Path, BinaryIO]:
+    INCOMING_DIR.mkdir(parents=True, exist_ok=True)
+    part = INCOMING_DIR / f"{uuid.uuid4().hex}.part"
+    return part, part.open("wb")
+
+
+def _discard(part: Path, fh: BinaryIO) -> None:
+    fh.close()
+    part.unlink(missing_ok=True)
+
+
+def _finish(part: Path, fh: BinaryIO, dest: Path) -> bool:
+    """Sposta il file completo sul nome definitivo; se il contenuto esiste già lo riusa. True = già presente."""
+    fh.close()
+    if dest.exists():
+        try:
+            os.utime(dest)  # il periodo di grazia del GC riparte dall'ultimo upload
+        except FileNotFoundError:
+            pass  # appena eliminato da collect_garbage: si salva questa copia
+        else:
+            part.unlink(missing_ok=True)
+            return True
+    with part.open("rb+") as synced:
+        os.fsync(synced.fileno())
+    os.replace(part, dest)
+    return False
+
+
+async def store_stream(chunks: AsyncIterator[bytes], extension: str, max_bytes: int | None = None) -> StoredUpload:
+    """
+    Salva un flusso di byte in UPLOAD_DIR con le scritture su disco fuori dall'event loop.
+    Il nome è lo SHA-256 del contenuto, calcolato durante la copia: la stessa foto salvata più volte è un solo
+    file e il suo URL non cambia mai. Il limite di dimensione è verificato durante la copia (FileTooLarge); il
+    file compare con il nome finale solo a copia completata (rename atomico dalla cartella .incoming).
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    digest = hashlib.sha256()
+    part, fh = await to_thread.run_sync(_open_part)
+    written = 0
+    try:
+        async for chunk in chunks:
+            written += len(chunk)
+            if written > max_bytes:
+                raise FileTooLarge(max_bytes)
+            digest.update(chunk)
+            await to_thread.run_sync(fh.write, chunk)
+        name = f"{digest.hexdigest()}.{extension}"
+        existing = await to_thread.run_sync(_finish, part, fh, UPLOAD_DIR / name)
+    except BaseException:
+        await to_thread.run_sync(_discard, part, fh)
+        raise
+    return StoredUpload(name, existing)
+
+
+class _FilePart:
+    """Stato del parser multipart: intestazioni della parte corrente e dati del campo file già ricevuti."""
+
+    def __init__(self, field: str) -> None:
+        self.field = field
+        self.headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self.in_file = False
+        self.found = False
+        self.done = False
+        self.content_type: str | None = None
+        self.filename: str | None = None
+        self.data: list[bytes] = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._add("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._add("_header_value", data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _add(self, attr: str, chunk: bytes) -> None:
+        setattr(self, attr, getattr(self, attr) + chunk)
+
+    def _part_begin(self) -> None:
+        self.headers = {}
+
+    def _header_end(self) -> None:
+        self.headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if self.found or options.get(b"name", b"").decode("latin-1") != self.field:
+            return
+        self.found = self.in_file = True
+        self.content_type = self.headers.get(b"content-type", b"").decode("latin-1") or None
+        self.filename = options[b"filename"].decode("utf-8", "replace") if b"filename" in options else None
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.data.append(bytes(data[start:end]))
+
+    def _part_end(self) -> None:
+        if self.in_file:
+            self.in_file = False
+            self.done = True
+
+
+async def store_multipart(body: AsyncIterator[bytes], content_type: str | None, field: str = "file",
+                          max_bytes: int | None = None) -> StoredUpload:
+    """
+    Salva il campo immagine `field` di un corpo multipart leggendo il flusso della richiesta: niente form
+    bufferizzato da Starlette, il limite vale anche per upload chunked senza Content-Length e la lettura si
+    ferma appena lo supera (413). Gli altri campi del form vengono ignorati.
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    mime, options = parse_options_header(content_type or "")
+    if mime != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(400, "Richiesta multipart/form-data attesa")
+    state = _FilePart(field)
+    parser = MultipartParser(options[b"boundary"], state.callbacks())
+    stream = body.__aiter__()
+    received = 0
+
+    async def feed() -> bool:
+        """Passa al parser il prossimo blocco del corpo; False a fine corpo."""
+        nonlocal received
+        try:
+            chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            parser.finalize()
+            return False
+        received += len(chunk)
+        if received > max_bytes + MULTIPART_OVERHEAD:
+            raise HTTPException(413, str(FileTooLarge(max_bytes)))
+        parser.write(chunk)
+        return True
+
+    while not state.found:
+        if not await feed():
+            raise HTTPException(422, "Campo file mancante")
+    if not (state.content_type or "").startswith("image/"):
+        raise HTTPException(400, "Solo immagini")
+
+    async def chunks() -> AsyncIterator[bytes]:
+        while True:
+            while state.data:
+                yield state.data.pop(0)
+            if state.done or not await feed():
+                break
+
+    try:
+        return await store_stream(chunks(), content_extension(state.content_type, state.filename), max_bytes)
+    except FileTooLarge as exc:
+        raise HTTPException(413, str(exc))
+
+
+def references(db: Session) -> Counter:
+    """Conteggio riferimenti per file caricato: quanti prodotti lo usano come image_url."""
+    prefix = f"{FILES_URL}/"
+    rows = db.execute(
+        select(models.Product.image_url, func.count())
+        .where(models.Product.image_url.like(f"{prefix}%"))
+        .group_by(models.Product.image_url)
+    )
+    return Counter({url[len(prefix):]: count for url, count in rows})
+
+
+def _trash(path: Path, cutoff: float) -> bool:
+    """
+    Elimina un originale senza perdere un upload concorrente: il file si sposta in .trash (rename atomico) e si
+    rilegge l'mtime. Se un nuovo upload dello stesso contenuto lo ha toccato dopo il primo controllo (_finish lo
+    ha già riusato) torna al suo posto. False = file tenuto.
+    """
+    TRASH_DIR.mkdir(parents=True, exist_ok=True)
+    trashed = TRASH_DIR / path.name
+    try:
+        os.replace(path, trashed)
+    except FileNotFoundError:
+        return False
+    if trashed.stat().st_mtime > cutoff:
+        os.replace(trashed, path)  # stesso contenuto anche se nel frattempo è comparsa una nuova copia
+        return False
+    trashed.unlink(missing_ok=True)
+    return True
+
+
+def collect_garbage(db: Session, grace_hours: float = 24, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Elimina i file caricati che nessun prodotto usa più (con i loro derivati) e gli upload interrotti.
+    Si toccano solo file più vecchi di grace_hours: un upload appena fatto non è ancora collegato al prodotto.
+    """
+    from app.services.images import DERIVED_DIR
+
+    refs = references(db)
+    cutoff = time.time() - grace_hours * 3600
+    stats = {"kept": 0, "removed": 0, "derived_removed": 0, "bytes_freed": 0}
+
+    def _remove(path: Path, recheck: bool = False) -> int:
+        size = path.stat().st_size
+        if not dry_run:
+            if recheck and not _trash(path, cutoff):
+                return 0
+            path.unlink(missing_ok=True)
+        stats["bytes_freed"] += size
+        return 1
+
+    kept_stems = set()
+    for path in sorted(UPLOAD_DIR.iterdir()) if UPLOAD_DIR.is_dir() else []:
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        if refs[path.name] or path.stat().st_mtime > cutoff or not _remove(path, recheck=True):
+            stats["kept"] += 1
+            kept_stems.add(path.stem)
+            continue
+        stats["removed"] += 1
+
+    # derivati il cui originale non c'è più (appena rimosso o cancellato a mano)
+    if DERIVED_DIR.is_dir():
+        for path in DERIVED_DIR.iterdir():
+            if path.is_file() and path.name.split(".", 1)[0] not in kept_stems and path.stat().st_mtime <= cutoff:
+                stats["derived_removed"] += _remove(path)
+    if INCOMING_DIR.is_dir():
+        for path in INCOMING_DIR.iterdir():
+            if path.is_file() and path.stat().st_mtime <= cutoff:
+                _remove(path)
+    return stats
@@ -0,0 +1,88 @@
+"""
+Scheletro comune dei worker in background (copia immagini, coda giacenze Shopify, ordini Shopify).
+
+Il servizio fornisce solo il giro, che restituisce True se è rimasto lavoro arretrato: il worker lo ripete
+subito, altrimenti aspetta `interval` secondi o una sveglia da notify() (sicura da qualsiasi thread, anche dai
+commit nel threadpool). Un errore nel giro si registra e il worker prosegue. Le righe in coda dei servizi
+ritentano con backoff() esponenziale; in_new_session() esegue un passo sincrono con una sessione propria.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempts: int, base: float, maximum: float) -> timedelta:
+    """Attesa prima del tentativo successivo: base, poi il doppio a ogni fallimento, fino a `maximum` secondi."""
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), maximum))
+
+
+def in_new_session(fn, *args):
+    """fn(db, *args) in una sessione aperta e chiusa qui (per to_thread.run_sync)."""
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+class Worker:
+    def __init__(self, name: str, run_round: Callable[[], Awaitable[bool]], interval: float, debounce: float = 0):
+        self.name = name
+        self.run_round = run_round
+        self.interval = interval
+        # dopo una sveglia si aspetta ancora `debounce` secondi: le modifiche a raffica finiscono nello stesso giro
+        self.debounce = debounce
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """Avvia il worker nell'event loop corrente (startup dell'app); già avviato = niente."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._loop = self._wakeup = None
+
+    def notify(self) -> None:
+        """Sveglia il worker (sicura da qualsiasi thread)."""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                busy = await self.run_round()
+            except Exception as exc:  # il worker non deve morire per un errore di DB o di rete
+                logger.warning("worker round failed", extra={"event": self.name, "error": str(exc)})
+                busy = False
+            if busy:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                if self.debounce:
+                    await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
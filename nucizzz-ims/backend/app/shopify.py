@@ -1,107 +1,495 @@
+"""
+Client Shopify Admin API (GraphQL), asincrono e con connessioni riusate.
+
+- upsert_products: productSet a blocchi, più mutation con alias in una sola richiesta HTTP;
+- set_inventory: inventorySetQuantities con fino a INVENTORY_BATCH quantità per mutation, opzionalmente
+  condizionata alla disponibilità attesa (compareQuantity) per non sovrascrivere vendite fatte su Shopify;
+- inventory_levels / item_levels: giacenze di una location a pagine (cursor) o di articoli specifici;
+- bulk_upsert_products / export_catalogue: bulk operation per il catalogo completo (file JSONL caricato
+  su staged upload, poi risultati scaricati a operazione finita), senza i limiti di costo per richiesta.
+
+Gli id salvati sui prodotti sono GID GraphQL (gid://shopify/Product/…); quelli numerici del vecchio client
+REST vengono convertiti al volo.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
 import httpx
-import os
-from typing import Optional
+
+from .core.config import HTTP_TIMEOUT, SHOPIFY_API_VERSION, SHOPIFY_BULK_TIMEOUT
 from .models import Product
 
+logger = logging.getLogger(__name__)
+
+PRODUCT_BATCH = 10
+INVENTORY_BATCH = 250
+MAX_THROTTLE_RETRIES = 5
+
+
 class ShopifyError(Exception):
     pass
 
+
+def gid(kind: str, value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    value = str(value)
+    return value if value.startswith("gid://") else f"gid://shopify/{kind}/{value}"
+
+
+_PRODUCT_FIELDS = "product { id variants(first: 1) { nodes { id inventoryItem { id } } } } userErrors { field message }"
+
+PRODUCT_SET_MUTATION = (
+    "mutation productSet($input: ProductSetInput!) { productSet(synchronous: true, input: $input) { %s } }"
+    % _PRODUCT_FIELDS
+)
+
+INVENTORY_SET_MUTATION = """
+mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
+  inventorySetQuantities(input: $input) { userErrors { field message code } }
+}
+"""
+
+CATALOGUE_QUERY = """
+{
+  products {
+    edges { node { id title variants { edges { node { id sku price inventoryItem { id } } } } } }
+  }
+}
+"""
+
+INVENTORY_LEVELS_QUERY = """
+query levels($id: ID!, $after: String) {
+  location(id: $id) {
+    inventoryLevels(first: 250, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { item { id } quantities(names: ["available"]) { name quantity } }
+    }
+  }
+}
+"""
+
+ITEM_LEVELS_QUERY = """
+query itemLevels($ids: [ID!]!, $location: ID!) {
+  nodes(ids: $ids) {
+    ... on InventoryItem { id inventoryLevel(locationId: $location) { quantities(names: ["available"]) { name quantity } } }
+  }
+}
+"""
+
+_BULK_FIELDS = "bulkOperation { id status } userErrors { field message }"
+
+
+def product_input(p: Product) -> Dict[str, Any]:
+    """ProductSetInput con una sola variante (SKU Shopify = barcode, opzione Taglia)."""
+    size = p.size or "Default Title"
+    option = "Size" if p.size else "Title"
+    variant: Dict[str, Any] = {
+        "optionValues": [{"optionName": option, "name": size}],
+        "price": f"{(p.price or 0):.2f}",
+        "inventoryItem": {"sku": p.barcode or p.sku, "tracked": True},
+    }
+    if p.shopify_variant_id:
+        variant["id"] = gid("ProductVariant", p.shopify_variant_id)
+    data: Dict[str, Any] = {
+        "title": p.title,
+        "status": "ACTIVE" if p.is_active is not False else "DRAFT",
+        "productOptions": [{"name": option, "values": [{"name": size}]}],
+        "variants": [variant],
+    }
+    if p.shopify_product_id:
+        data["id"] = gid("Product", p.shopify_product_id)
+    else:
+        data["descriptionHtml"] = f"Taglia: {p.size}" if p.size else ""
+    return data
+
+
+def _quantity_index(error: Dict[str, Any]) -> Optional[int]:
+    """Posizione nella lista quantities di un userError (field = ["input", "quantities", "3", "compareQuantity"])."""
+    field = error.get("field") or []
+    if len(field) >= 3 and field[1] == "quantities" and str(field[2]).isdigit():
+        return int(field[2])
+    return None
+
+
+def _link(p: Product, result: Dict[str, Any]) -> None:
+    errors = result.get("userErrors") or []
+    if errors:
+        raise ShopifyError(f"productSet {p.sku}: " + "; ".join(e.get("message", "") for e in errors))
+    product = result.get("product") or {}
+    variants = (product.get("variants") or {}).get("nodes") or []
+    p.shopify_product_id = product.get("id") or p.shopify_product_id
+    if variants:
+        p.shopify_variant_id = variants[0]["id"]
+        p.shopify_inventory_item_id = (variants[0].get("inventoryItem") or {}).get("id") or p.shopify_inventory_item_id
+
+
+def _link_or_log(p: Product, result: Dict[str, Any]) -> bool:
+    try:
+        _link(p, result)
+    except ShopifyError as exc:
+        logger.warning("shopify upsert failed", extra={"event": "shopify_upsert", "sku": p.sku, "error": str(exc)})
+        return False
+    return True
+
+
 class ShopifyClient:
-    def __init__(self, shop: str, access_token: str, default_location_id: Optional[str] = None):
+    """
+    Un'istanza = un pool di connessioni verso lo shop. Va chiusa con `await client.aclose()` oppure usata
+    come `async with ShopifyClient(...) as client:`. `transport` permette di sostituire la rete nei test.
+    """
+
+    def __init__(
+        self,
+        shop: str,
+        access_token: str,
+        default_location_id: Optional[str] = None,
+        *,
+        api_version: str = SHOPIFY_API_VERSION,
+        max_connections: int = 4,
+        poll_interval: float = 2.0,
+        bulk_timeout: float = SHOPIFY_BULK_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
         if not shop or not access_token:
             raise ShopifyError("Config Shopify mancante: shop o token vuoti")
         self.shop = shop
         self.token = access_token
-        self.api_base = f"https://{shop}/admin/api/2024-10"
-        self.location_id = default_location_id
-
-    def _headers(self):
-        return {
-            "X-Shopify-Access-Token": self.token,
-            "Content-Type": "application/json"
-        }
-
-    def ensure_location(self, location_id: Optional[str]) -> str:
-        if location_id:
-            return location_id
-        # fetch first active location
-        url = f"{self.api_base}/locations.json"
-        r = httpx.get(url, headers=self._headers(), timeout=30)
-        if r.status_code >= 300:
-            raise ShopifyError(f"Errore location: {r.text}")
-        data = r.json()
-        locs = data.get("locations", [])
-        if not locs:
-            raise ShopifyError("Nessuna location attiva trovata su Shopify")
-        self.location_id = str(locs[0]["id"])
-        return self.location_id
+        self.api_base = f"https://{shop}/admin/api/{api_version}"
+        self.location_id = gid("Location", default_location_id)
+        self.poll_interval = poll_interval
+        self.bulk_timeout = bulk_timeout
+        # budget di costo GraphQL (leaky bucket) dall'ultima risposta: si aspetta prima di andare in THROTTLED
+        self._available: Optional[float] = None
+        self._maximum = 0.0
+        self._restore_rate = 50.0
+        self._budget_at = 0.0
+        self._last_cost = 0.0
+        # il token va solo verso lo shop: niente header di default, gli URL di staged upload/bulk sono esterni
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=HTTP_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def __aenter__(self) -> "ShopifyClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
 
-    def upsert_product(self, p: Product):
-        # if product linked, update; else create
-        if p.shopify_product_id and p.shopify_variant_id:
-            # update price/title
-            url = f"{self.api_base}/products/{p.shopify_product_id}.json"
-            body = {
-                "product": {
-                    "id": int(p.shopify_product_id),
-                    "title": p.title,
-                    "variants": [{
-                        "id": int(p.shopify_variant_id),
-                        "price": f"{(p.price or 0):.2f}",
-                        "sku": p.barcode,
-                        "option1": p.size
-                    }]
-                }
-            }
-            r = httpx.put(url, headers=self._headers(), json=body, timeout=30)
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    def _headers(self) -> Dict[str, str]:
+        return {"X-Shopify-Access-Token": self.token, "Content-Type": "application/json"}
+
+    async def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Esegue una richiesta GraphQL; sui THROTTLED attende il ripristino del budget di costo e riprova."""
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            await self._wait_for_budget()
+            r = await self._http.post(
+                f"{self.api_base}/graphql.json", headers=self._headers(), json={"query": query, "variables": variables or {}}
+            )
+            if r.status_code == 429 and attempt < MAX_THROTTLE_RETRIES:
+                await asyncio.sleep(float(r.headers.get("Retry-After", "1")))
+                continue
             if r.status_code >= 300:
-                raise ShopifyError(f"Update product failed: {r.text}")
+                raise ShopifyError(f"GraphQL HTTP {r.status_code}: {r.text[:500]}")
+            body = r.json()
+            self._note_budget(body, r.headers)
+            errors = body.get("errors") or []
+            if any((e.get("extensions") or {}).get("code") == "THROTTLED" for e in errors) and attempt < MAX_THROTTLE_RETRIES:
+                await asyncio.sleep(self._throttle_wait(body))
+                continue
+            if errors:
+                raise ShopifyError("GraphQL: " + "; ".join(e.get("message", "") for e in errors))
+            return body.get("data") or {}
+        raise ShopifyError("GraphQL: limite di richieste Shopify superato")
+
+    def _note_budget(self, body: Dict[str, Any], headers: httpx.Headers) -> None:
+        cost = (body.get("extensions") or {}).get("cost") or {}
+        status = cost.get("throttleStatus") or {}
+        if status:
+            self._available = float(status.get("currentlyAvailable") or 0)
+            self._maximum = float(status.get("maximumAvailable") or self._maximum)
+            self._restore_rate = float(status.get("restoreRate") or self._restore_rate)
+            self._last_cost = float(cost.get("actualQueryCost") or cost.get("requestedQueryCost") or 0)
+        elif "X-Shopify-Shop-Api-Call-Limit" in headers:
+            # limite a chiamate (es. "32/40", ripristino 2 al secondo): stesso bucket, costo 1 per chiamata
+            used, _, limit = headers["X-Shopify-Shop-Api-Call-Limit"].partition("/")
+            if used.isdigit() and limit.isdigit():
+                self._maximum, self._available = float(limit), float(int(limit) - int(used))
+                self._restore_rate, self._last_cost = 2.0, 1.0
+        else:
             return
+        self._budget_at = time.monotonic()
 
-        # create new product
-        url = f"{self.api_base}/products.json"
-        body = {
-            "product": {
-                "title": p.title,
-                "body_html": f"Taglia: {p.size}",
-                "status": "active",
-                "variants": [{
-                    "price": f"{(p.price or 0):.2f}",
-                    "sku": p.barcode,
-                    "inventory_management": "shopify",
-                    "option1": p.size
-                }],
-                "options": [{"name": "Size"}]
-            }
-        }
-        r = httpx.post(url, headers=self._headers(), json=body, timeout=30)
-        if r.status_code >= 300:
-            raise ShopifyError(f"Create product failed: {r.text}")
-        data = r.json()["product"]
-        p.shopify_product_id = str(data["id"])
-        variant = data["variants"][0]
-        p.shopify_variant_id = str(variant["id"])
-        p.shopify_inventory_item_id = str(variant["inventory_item_id"])
-
-    def set_inventory(self, p: Product, quantity: int):
-        loc = self.location_id or self.ensure_location(self.location_id)
-        if not p.shopify_inventory_item_id:
-            # fetch variant to get inventory item id
-            if not p.shopify_variant_id:
-                raise ShopifyError("Variant non impostata per l'articolo")
-            vurl = f"{self.api_base}/variants/{p.shopify_variant_id}.json"
-            vr = httpx.get(vurl, headers=self._headers(), timeout=30)
-            if vr.status_code >= 300:
-                raise ShopifyError(f"Variant fetch failed: {vr.text}")
-            p.shopify_inventory_item_id = str(vr.json()["variant"]["inventory_item_id"])
-
-        # set inventory level
-        url = f"{self.api_base}/inventory_levels/set.json"
-        body = {
-            "location_id": int(loc),
-            "inventory_item_id": int(p.shopify_inventory_item_id),
-            "available": quantity
-        }
-        r = httpx.post(url, headers=self._headers(), json=body, timeout=30)
+    async def _wait_for_budget(self) -> None:
+        """Se la prossima richiesta (costo stimato = ultima osservata) sforerebbe il budget, attende il ripristino."""
+        if self._available is None:
+            return
+        available = min(self._maximum or float("inf"), self._available + (time.monotonic() - self._budget_at) * self._restore_rate)
+        if available < self._last_cost:
+            await asyncio.sleep((self._last_cost - available) / self._restore_rate)
+
+    @staticmethod
+    def _throttle_wait(body: Dict[str, Any]) -> float:
+        cost = (body.get("extensions") or {}).get("cost") or {}
+        status = cost.get("throttleStatus") or {}
+        missing = (cost.get("requestedQueryCost") or 0) - (status.get("currentlyAvailable") or 0)
+        return max(missing, 0) / (status.get("restoreRate") or 50) or 1.0
+
+    async def ensure_location(self, location_id: Optional[str] = None) -> str:
+        if location_id or self.location_id:
+            self.location_id = gid("Location", location_id) or self.location_id
+            return self.location_id
+        data = await self.graphql('{ locations(first: 1, query: "active:true") { nodes { id name } } }')
+        nodes = (data.get("locations") or {}).get("nodes") or []
+        if not nodes:
+            raise ShopifyError("Nessuna location attiva trovata su Shopify")
+        self.location_id = nodes[0]["id"]
+        return self.location_id
+
+    async def upsert_products(self, products: Sequence[Product]) -> List[str]:
+        """
+        Crea/aggiorna i prodotti con productSet, PRODUCT_BATCH per richiesta; salva i GID sui modelli.
+        Restituisce gli SKU rifiutati da Shopify (userErrors), che non bloccano il resto del blocco.
+        """
+        failed: List[str] = []
+        for start in range(0, len(products), PRODUCT_BATCH):
+            chunk = products[start:start + PRODUCT_BATCH]
+            params = ", ".join(f"$p{i}: ProductSetInput!" for i in range(len(chunk)))
+            fields = " ".join(f"p{i}: productSet(synchronous: true, input: $p{i}) {{ {_PRODUCT_FIELDS} }}" for i in range(len(chunk)))
+            data = await self.graphql(
+                f"mutation upsertProducts({params}) {{ {fields} }}",
+                {f"p{i}": product_input(p) for i, p in enumerate(chunk)},
+            )
+            for i, p in enumerate(chunk):
+                if not _link_or_log(p, data.get(f"p{i}") or {}):
+                    failed.append(p.sku)
+        return failed
+
+    async def resolve_inventory_items(self, products: Iterable[Product]) -> None:
+        """Recupera in una query (nodes) l'inventory item delle varianti collegate che non lo hanno ancora."""
+        todo = {gid("ProductVariant", p.shopify_variant_id): p for p in products if p.shopify_variant_id and not p.shopify_inventory_item_id}
+        ids = list(todo)
+        for start in range(0, len(ids), INVENTORY_BATCH):
+            data = await self.graphql(
+                "query variants($ids: [ID!]!) { nodes(ids: $ids) { ... on ProductVariant { id inventoryItem { id } } } }",
+                {"ids": ids[start:start + INVENTORY_BATCH]},
+            )
+            for node in data.get("nodes") or []:
+                if node and node.get("inventoryItem"):
+                    todo[node["id"]].shopify_inventory_item_id = node["inventoryItem"]["id"]
+
+    async def set_inventory(
+        self,
+        quantities: Sequence[Tuple[Product, int]],
+        reason: str = "correction",
+        compare: Optional[Dict[int, Optional[int]]] = None,
+    ) -> List[Product]:
+        """
+        Imposta la disponibilità sulla location Shopify per più prodotti per mutation e la annota sui modelli
+        (shopify_synced_qty). Con `compare` ({product_id: disponibilità attesa su Shopify}) la scrittura è
+        condizionata (compareQuantity): gli articoli cambiati su Shopify nel frattempo non vengono toccati e sono
+        restituiti; quelli con attesa None (nessun livello noto) si impostano senza confronto.
+        """
+        if not quantities:
+            return []
+        location = await self.ensure_location()
+        await self.resolve_inventory_items(p for p, _ in quantities)
+        missing = [p.sku for p, _ in quantities if not p.shopify_inventory_item_id]
+        if missing:
+            raise ShopifyError(f"Prodotti non collegati a Shopify: {', '.join(missing[:10])}")
+        stale: List[Product] = []
+        if compare is None:
+            groups = [(list(quantities), None)]
+        else:
+            groups = [
+                ([(p, qty) for p, qty in quantities if compare.get(p.id) is not None], compare),
+                ([(p, qty) for p, qty in quantities if compare.get(p.id) is None], None),
+            ]
+        for items, expected in groups:
+            for start in range(0, len(items), INVENTORY_BATCH):
+                stale += await self._set_quantities(location, items[start:start + INVENTORY_BATCH], reason, expected)
+        return stale
+
+    async def _set_quantities(
+        self, location: str, chunk: List[Tuple[Product, int]], reason: str, compare: Optional[Dict[int, Optional[int]]]
+    ) -> List[Product]:
+        """Una mutation; se Shopify segnala compareQuantity superate (la mutation non applica nulla) si ripete senza quelle."""
+        stale: List[Product] = []
+        while chunk:
+            quantities = []
+            for p, qty in chunk:
+                row = {"inventoryItemId": gid("InventoryItem", p.shopify_inventory_item_id), "locationId": location, "quantity": qty}
+                if compare is not None:
+                    row["compareQuantity"] = compare[p.id]
+                quantities.append(row)
+            data = await self.graphql(INVENTORY_SET_MUTATION, {"input": {
+                "name": "available", "reason": reason, "ignoreCompareQuantity": compare is None, "quantities": quantities,
+            }})
+            errors = (data.get("inventorySetQuantities") or {}).get("userErrors") or []
+            if not errors:
+                for p, qty in chunk:
+                    p.shopify_synced_qty = qty
+                return stale
+            positions = {_quantity_index(e) if e.get("code") == "COMPARE_QUANTITY_STALE" else None for e in errors}
+            if None in positions or max(positions) >= len(chunk):
+                raise ShopifyError("inventorySetQuantities: " + "; ".join(e.get("message", "") for e in errors))
+            stale += [chunk[i][0] for i in sorted(positions)]
+            chunk = [item for i, item in enumerate(chunk) if i not in positions]
+        return stale
+
+    async def item_levels(self, item_ids: Sequence[str], location_id: Optional[str] = None) -> Dict[str, Optional[int]]:
+        """Disponibilità di inventory item specifici sulla location (nodes, 250 per richiesta); None se non attivi lì."""
+        location = await self.ensure_location(location_id)
+        ids = [gid("InventoryItem", i) for i in item_ids]
+        levels: Dict[str, Optional[int]] = {}
+        for start in range(0, len(ids), INVENTORY_BATCH):
+            data = await self.graphql(ITEM_LEVELS_QUERY, {"ids": ids[start:start + INVENTORY_BATCH], "location": location})
+            for node in data.get("nodes") or []:
+                if not node:
+                    continue
+                level = node.get("inventoryLevel")
+                quantities = {q["name"]: q["quantity"] for q in (level or {}).get("quantities") or []}
+                levels[node["id"]] = quantities.get("available", 0) if level else None
+        return levels
+
+    async def inventory_levels(self, location_id: Optional[str] = None) -> Dict[str, int]:
+        """Disponibilità per inventory item sulla location, a pagine da 250 (una richiesta ogni 250 articoli)."""
+        location = await self.ensure_location(location_id)
+        levels: Dict[str, int] = {}
+        cursor = None
+        while True:
+            data = await self.graphql(INVENTORY_LEVELS_QUERY, {"id": location, "after": cursor})
+            if not data.get("location"):
+                raise ShopifyError(f"Location Shopify {location} non trovata")
+            page = data["location"]["inventoryLevels"]
+            for node in page.get("nodes") or []:
+                quantities = {q["name"]: q["quantity"] for q in node.get("quantities") or []}
+                levels[node["item"]["id"]] = quantities.get("available", 0)
+            if not page["pageInfo"]["hasNextPage"]:
+                return levels
+            cursor = page["pageInfo"]["endCursor"]
+
+    # --- bulk operations -------------------------------------------------------------------------------
+
+    async def _staged_upload(self, lines: List[Dict[str, Any]]) -> str:
+        data = await self.graphql(
+            """mutation { stagedUploadsCreate(input: [{resource: BULK_MUTATION_VARIABLES, filename: "products.jsonl",
+            mimeType: "text/jsonl", httpMethod: POST}]) { stagedTargets { url resourceUrl parameters { name value } }
+            userErrors { field message } } }"""
+        )
+        staged = data.get("stagedUploadsCreate") or {}
+        if staged.get("userErrors"):
+            raise ShopifyError("stagedUploadsCreate: " + "; ".join(e["message"] for e in staged["userErrors"]))
+        target = staged["stagedTargets"][0]
+        params = {item["name"]: item["value"] for item in target["parameters"]}
+        payload = "\n".join(json.dumps(line, separators=(",", ":")) for line in lines).encode()
+        r = await self._http.post(target["url"], data=params, files={"file": ("products.jsonl", payload, "text/jsonl")})
         if r.status_code >= 300:
-            raise ShopifyError(f"Inventory set failed: {r.text}")
+            raise ShopifyError(f"Upload JSONL fallito: HTTP {r.status_code}")
+        return params.get("key") or target["resourceUrl"]
+
+    async def _wait_bulk(self, operation_id: str) -> Optional[str]:
+        """
+        Attende la fine della bulk operation; restituisce l'URL del JSONL dei risultati (None se vuoto).
+        Oltre bulk_timeout secondi senza esito si rinuncia con ShopifyError (l'operazione resta sullo shop).
+        """
+        deadline = time.monotonic() + self.bulk_timeout
+        while True:
+            data = await self.graphql(
+                "query op($id: ID!) { node(id: $id) { ... on BulkOperation { id status errorCode objectCount url partialDataUrl } } }",
+                {"id": operation_id},
+            )
+            op = data.get("node") or {}
+            status = op.get("status")
+            if status == "COMPLETED":
+                return op.get("url")
+            if status in ("FAILED", "CANCELED", "EXPIRED"):
+                raise ShopifyError(f"Bulk operation {status}: {op.get('errorCode') or ''}".strip())
+            if time.monotonic() >= deadline:
+                raise ShopifyError(f"Bulk operation {operation_id} ancora {status} dopo {self.bulk_timeout:.0f}s")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _download_jsonl(self, url: Optional[str]) -> List[Dict[str, Any]]:
+        if not url:
+            return []
+        rows = []
+        async with self._http.stream("GET", url) as r:
+            if r.status_code >= 300:
+                raise ShopifyError(f"Download risultati bulk fallito: HTTP {r.status_code}")
+            async for line in r.aiter_lines():
+                if line.strip():
+                    rows.append(json.loads(line))
+        return rows
+
+    @staticmethod
+    def _bulk_operation(result: Dict[str, Any]) -> str:
+        errors = result.get("userErrors") or []
+        if errors:
+            raise ShopifyError("Bulk operation: " + "; ".join(e.get("message", "") for e in errors))
+        return result["bulkOperation"]["id"]
+
+    async def bulk_upsert_products(self, products: Sequence[Product]) -> List[str]:
+        """
+        productSet per tutto il catalogo con una bulk operation. Restituisce gli SKU con errori
+        (gli altri prodotti vengono collegati ai GID come con upsert_products).
+        """
+        if not products:
+            return []
+        path = await self._staged_upload([{"input": product_input(p)} for p in products])
+        data = await self.graphql(
+            "mutation run($mutation: String!, $path: String!) { bulkOperationRunMutation(mutation: $mutation,"
+            f" stagedUploadPath: $path) {{ {_BULK_FIELDS} }} }}",
+            {"mutation": PRODUCT_SET_MUTATION, "path": path},
+        )
+        operation_id = self._bulk_operation(data.get("bulkOperationRunMutation") or {})
+        failed = []
+        for row in await self._download_jsonl(await self._wait_bulk(operation_id)):
+            p = products[row["__lineNumber"]]
+            if not _link_or_log(p, ((row.get("data") or {}).get("productSet")) or {}):
+                failed.append(p.sku)
+        return failed
+
+    async def export_catalogue(self) -> List[Dict[str, Any]]:
+        """Tutte le varianti dello shop via bulk query: [{product_id, variant_id, inventory_item_id, sku, price, title}]."""
+        data = await self.graphql(
+            f"mutation run($query: String!) {{ bulkOperationRunQuery(query: $query) {{ {_BULK_FIELDS} }} }}",
+            {"query": CATALOGUE_QUERY},
+        )
+        operation_id = self._bulk_operation(data.get("bulkOperationRunQuery") or {})
+        titles: Dict[str, str] = {}
+        variants = []
+        # il JSONL è piatto: prima la riga del prodotto, poi le sue varianti con __parentId
+        for row in await self._download_jsonl(await self._wait_bulk(operation_id)):
+            if "__parentId" not in row:
+                titles[row["id"]] = row.get("title")
+                continue
+            variants.append({
+                "product_id": row["__parentId"],
+                "variant_id": row["id"],
+                "inventory_item_id": (row.get("inventoryItem") or {}).get("id"),
+                "sku": row.get("sku"),
+                "price": row.get("price"),
+                "title": titles.get(row["__parentId"]),
+            })
+        return variants
+
+    async def sync_products(self, products: Sequence[Product], quantities: Dict[int, int], bulk_threshold: int) -> Dict[str, Any]:
+        """Catalogo + giacenze: bulk operation sopra bulk_threshold prodotti, altrimenti mutation a blocchi."""
+        if len(products) > bulk_threshold:
+            failed = await self.bulk_upsert_products(products)
+        else:
+            failed = await self.upsert_products(products)
+        skipped = set(failed)
+        linked = [p for p in products if p.sku not in skipped and (p.shopify_variant_id or p.shopify_inventory_item_id)]
+        await self.set_inventory([(p, max(quantities.get(p.id, 0), 0)) for p in linked])
+        return {"products": len(linked), "failed": failed}
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="ims-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP_DIR}/test.db")
+os.environ.setdefault("UPLOAD_DIR", f"{_TMP_DIR}/uploads")
+os.environ.setdefault("IMAGE_MIRROR_ENABLED", "false")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import Base, SessionLocal, engine
+from app.main import app
+from app import migrations, models
+
+
+@pytest.fixture()
+def client():
+    migrations.migrate(engine)
+    with TestClient(app) as c:
+        yield c
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def db(client):
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture()
+def locations(db):
+    return {loc.name: loc.id for loc in db.query(models.Location).all()}
+
+
+@pytest.fixture()
+def make_product(client):
+    def _make(sku: str, qty: int = 0, location_id: int | None = None, **extra):
+        payload = {"sku": sku, "title": extra.pop("title", sku), "initial_qty": qty, "location_id": location_id, **extra}
+        res = client.post("/api/products/", json=payload)
+        assert res.status_code == 200, res.text
+        return res.json()
+    return _make
@@ -0,0 +1,108 @@
+import json
+
+import httpx
+
+SHOP = "test-shop.myshopify.com"
+STAGED_URL = "https://shopify-staged-uploads.storage.googleapis.com/"
+RESULT_URL = "https://storage.googleapis.com/bulk/result.jsonl"
+
+
+class FakeShopify:
+    """Admin API GraphQL minimale in memoria (productSet, inventorySetQuantities con compareQuantity, bulk operation)."""
+
+    def __init__(self, throttle_first: bool = False):
+        self.requests = []
+        self.products = {}
+        self.inventory = {}
+        self.uploaded = None
+        self.result_lines = []
+        self.throttle_first = throttle_first
+        self.page_size = 250
+        self.bulk_status = "COMPLETED"
+
+    def _product_set(self, data):
+        pid = data.get("id") or f"gid://shopify/Product/{len(self.products) + 1}"
+        n = pid.rsplit("/", 1)[-1]
+        self.products[pid] = data
+        if data["title"] == "RIFIUTATO":
+            return {"product": None, "userErrors": [{"field": ["title"], "message": "Titolo non valido"}]}
+        return {
+            "product": {"id": pid, "variants": {"nodes": [
+                {"id": f"gid://shopify/ProductVariant/{n}", "inventoryItem": {"id": f"gid://shopify/InventoryItem/{n}"}}
+            ]}},
+            "userErrors": [],
+        }
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url == STAGED_URL:
+            assert "X-Shopify-Access-Token" not in request.headers
+            boundary = request.headers["content-type"].split("boundary=", 1)[1].encode()
+            parts = request.read().split(b"--" + boundary)
+            file_part = next(part for part in parts if b'filename="products.jsonl"' in part)
+            self.uploaded = file_part.split(b"\r\n\r\n", 1)[1].rstrip(b"\r\n")
+            return httpx.Response(201)
+        if url == RESULT_URL:
+            assert "X-Shopify-Access-Token" not in request.headers
+            return httpx.Response(200, text="\n".join(json.dumps(line) for line in self.result_lines))
+        assert url == f"https://{SHOP}/admin/api/2024-10/graphql.json"
+        assert request.headers["X-Shopify-Access-Token"] == "tok"
+        body = json.loads(request.content)
+        query, variables = body["query"], body["variables"]
+        self.requests.append(query)
+        if self.throttle_first:
+            self.throttle_first = False
+            return httpx.Response(200, json={
+                "errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                "extensions": {"cost": {"requestedQueryCost": 10, "throttleStatus": {"currentlyAvailable": 9, "restoreRate": 1000}}},
+            })
+        if "inventoryLevels" in query:
+            items = sorted(self.inventory.items())
+            start = int(variables["after"] or 0)
+            page = items[start:start + self.page_size]
+            return httpx.Response(200, json={"data": {"location": {"inventoryLevels": {
+                "pageInfo": {"hasNextPage": start + self.page_size < len(items), "endCursor": str(start + self.page_size)},
+                "nodes": [{"item": {"id": item}, "quantities": [{"name": "available", "quantity": qty}]}
+                          for (item, _), qty in page],
+            }}}})
+        if "locations(" in query:
+            return httpx.Response(200, json={"data": {"locations": {"nodes": [{"id": "gid://shopify/Location/7", "name": "Shop"}]}}})
+        if "upsertProducts" in query:
+            return httpx.Response(200, json={"data": {k: self._product_set(v) for k, v in variables.items()}})
+        if "itemLevels" in query:
+            levels = {item: qty for (item, location), qty in self.inventory.items() if location == variables["location"]}
+            return httpx.Response(200, json={"data": {"nodes": [
+                {"id": item, "inventoryLevel": None if item not in levels else
+                 {"quantities": [{"name": "available", "quantity": levels[item]}]}}
+                for item in variables["ids"]
+            ]}})
+        if "inventorySetQuantities" in query:
+            data = variables["input"]
+            quantities = data["quantities"]
+            # come Shopify: una compareQuantity superata annulla l'intera mutation
+            stale = [
+                {"field": ["input", "quantities", str(i), "compareQuantity"], "message": "The compareQuantity value does not match",
+                 "code": "COMPARE_QUANTITY_STALE"}
+                for i, q in enumerate(quantities)
+                if not data["ignoreCompareQuantity"] and self.inventory.get((q["inventoryItemId"], q["locationId"])) != q["compareQuantity"]
+            ]
+            if not stale:
+                for q in quantities:
+                    self.inventory[(q["inventoryItemId"], q["locationId"])] = q["quantity"]
+            return httpx.Response(200, json={"data": {"inventorySetQuantities": {"userErrors": stale}}})
+        if "stagedUploadsCreate" in query:
+            return httpx.Response(200, json={"data": {"stagedUploadsCreate": {"userErrors": [], "stagedTargets": [{
+                "url": STAGED_URL, "resourceUrl": None,
+                "parameters": [{"name": "key", "value": "tmp/bulk/products.jsonl"}, {"name": "acl", "value": "private"}],
+            }]}}})
+        if "bulkOperationRunMutation" in query:
+            assert variables["path"] == "tmp/bulk/products.jsonl"
+            for i, line in enumerate(self.uploaded.splitlines()):
+                result = self._product_set(json.loads(line)["input"])
+                self.result_lines.append({"data": {"productSet": result}, "__lineNumber": i})
+            return httpx.Response(200, json={"data": {"bulkOperationRunMutation": {
+                "bulkOperation": {"id": "gid://shopify/BulkOperation/1", "status": "CREATED"}, "userErrors": []}}})
+        if "BulkOperation" in query:
+            return httpx.Response(200, json={"data": {"node": {
+                "id": variables["id"], "status": self.bulk_status, "url": RESULT_URL, "objectCount": "1"}}})
+        raise AssertionError(f"query inattesa: {query}")
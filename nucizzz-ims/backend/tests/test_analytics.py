@@ -0,0 +1,37 @@
+def _sell(client, pid, loc, qty, price):
+    res = client.post("/api/stock/movement", json={
+        "product_id": pid, "type": "sell", "qty_change": qty, "from_location_id": loc, "sale_price": price,
+    })
+    assert res.status_code == 200, res.text
+
+
+def test_sales_summary_breakdown_and_top_products(client, locations, make_product):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    nike = make_product("NK", qty=10, location_id=wh, brand="Nike", cost=50, price=120)
+    adidas = make_product("AD", qty=10, location_id=shop, brand="Adidas", cost=30, price=90)
+    _sell(client, nike["id"], wh, 2, 100)
+    _sell(client, adidas["id"], shop, 1, 80)
+    _sell(client, adidas["id"], shop, 3, 70)
+
+    summary = client.get("/api/analytics/summary").json()
+    assert summary["sales"] == 3
+    assert summary["units"] == 6
+    assert summary["revenue"] == 490
+    assert summary["cost"] == 220
+    assert summary["margin"] == 270
+    assert summary["active_products"] == 2
+
+    by_brand = client.get("/api/analytics/breakdown", params={"group": "brand"}).json()
+    assert [(b["key"], b["units"], b["revenue"]) for b in by_brand] == [("Adidas", 4, 290), ("Nike", 2, 200)]
+
+    by_location = client.get("/api/analytics/breakdown", params={"group": "location"}).json()
+    assert {b["label"]: b["revenue"] for b in by_location} == {"negozio treviso": 290, "warehouse": 200}
+
+    by_day = client.get("/api/analytics/breakdown", params={"group": "week"}).json()
+    assert len(by_day) == 1 and by_day[0]["units"] == 6
+
+    top = client.get("/api/analytics/top-products", params={"by": "margin", "limit": 1}).json()
+    assert [(t["sku"], t["margin"]) for t in top] == [("AD", 170)]
+
+    shop_only = client.get("/api/analytics/summary", params={"location_id": shop}).json()
+    assert shop_only["units"] == 4
@@ -0,0 +1,41 @@
+from sqlalchemy import event
+
+from app import models
+from app.core import table_versions
+from app.database import engine
+from app.services import barcode_index
+
+
+def test_barcode_lookup_from_memory_with_db_fallback(client, db, make_product):
+    first = make_product("SKU-A", barcode="800100")
+    second = make_product("SKU-B", barcode="800100")
+
+    statements = []
+    listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/api/products/barcode/800100").json()["id"] == first["id"]
+        res = client.get("/api/products/barcode/800100/all").json()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert [p["id"] for p in res] == [first["id"], second["id"]]
+    assert not [sql for sql in statements if "FROM products" in sql]
+
+    # cambio barcode: l'indice segue la modifica
+    client.patch(f"/api/products/{second['id']}", json={"barcode": "800200", "title": "Nuovo titolo"})
+    assert [p["id"] for p in client.get("/api/products/barcode/800100/all").json()] == [first["id"]]
+    assert client.get("/api/products/barcode/800200").json()["title"] == "Nuovo titolo"
+
+    # prodotto creato da un altro worker: miss in memoria, trovato sul database
+    other = models.Product(sku="SKU-C", barcode="800300", title="Da altro worker")
+    db.add(other)
+    db.commit()
+    assert client.get("/api/products/barcode/800300").json()["id"] == other.id
+    assert client.get("/api/products/barcode/999999").status_code == 404
+
+    # modifica da un altro worker: il contatore cambia e l'indice viene ricaricato
+    db.get(models.Product, first["id"]).title = "Rinominato"
+    table_versions.bump(db, barcode_index.CATALOG_KEY)
+    db.commit()
+    barcode_index._checked_at = 0.0
+    assert client.get("/api/products/barcode/800100").json()["title"] == "Rinominato"
@@ -0,0 +1,33 @@
+import csv
+import io
+import json
+
+
+def test_export_movements_csv_and_ndjson(client, locations, make_product):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    p = make_product("SKU-E", qty=3, location_id=wh, cost=40)
+    client.post("/api/stock/movement", json={
+        "product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 70,
+    })
+    client.post("/api/stock/movement", json={
+        "product_id": p["id"], "type": "transfer", "qty_change": 1, "from_location_id": wh, "to_location_id": shop,
+    })
+
+    res = client.get("/api/exports/movements", params={"type": "sell"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(res.text)))
+    assert len(rows) == 1
+    assert rows[0]["sku"] == "SKU-E" and rows[0]["sale_price"] == "70.0" and rows[0]["cost"] == "40.0"
+
+    res = client.get("/api/exports/movements", params={"format": "ndjson", "location_id": shop})
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [line["type"] for line in lines] == ["transfer"]
+
+
+def test_export_stock_filters_by_location(client, locations, make_product):
+    make_product("SKU-F", qty=2, location_id=locations["warehouse"])
+    make_product("SKU-G", qty=1, location_id=locations["negozio treviso"])
+    res = client.get("/api/exports/stock", params={"format": "ndjson", "location_id": locations["warehouse"]})
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [(line["sku"], line["location"], line["qty"]) for line in lines] == [("SKU-F", "warehouse", 2)]
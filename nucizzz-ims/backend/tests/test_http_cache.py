@@ -0,0 +1,55 @@
+from sqlalchemy import delete, update
+
+from app import models
+from app.core import table_versions
+from app.database import engine
+
+
+def test_catalogue_etag_revalidates_until_a_write(client, locations, make_product):
+    wh = locations["warehouse"]
+    product = make_product("SKU-ETAG", qty=2, location_id=wh)
+
+    first = client.get("/api/products/with-stock")
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"') and "no-cache" in first.headers["cache-control"]
+
+    cached = client.get("/api/products/with-stock", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    # query diverse hanno ETag diversi
+    assert client.get("/api/products/with-stock", params={"q": "x"}).headers["etag"] != etag
+
+    # un movimento tocca stock e products.total_qty: entrambe le risposte vanno rigenerate
+    detail = client.get(f"/api/products/{product['id']}").headers["etag"]
+    client.post("/api/stock/movement", json={"product_id": product["id"], "type": "in", "qty_change": 1, "to_location_id": wh})
+    fresh = client.get("/api/products/with-stock", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.headers["etag"] != etag
+    assert fresh.json()[0]["total_qty"] == 3
+    assert client.get(f"/api/products/{product['id']}", headers={"If-None-Match": detail}).status_code == 200
+
+    locs = client.get("/api/locations/")
+    assert client.get("/api/locations/", headers={"If-None-Match": locs.headers["etag"]}).status_code == 304
+    client.post("/api/locations/", json={"name": "outlet"})
+    assert client.get("/api/locations/", headers={"If-None-Match": locs.headers["etag"]}).status_code == 200
+
+
+def test_versions_are_bumped_once_at_commit(db, make_product):
+    product = make_product("SKU-VER")
+    before = table_versions.get_versions(db, ("products", "stock"))
+    db.get(models.Product, product["id"]).title = "Annullato"
+    db.flush()
+    db.rollback()
+    assert table_versions.get_versions(db, ("products", "stock")) == before
+
+    # scrittura ORM + UPDATE Core sulla stessa tabella: un solo incremento, al commit
+    db.get(models.Product, product["id"]).title = "Nuovo"
+    db.execute(update(models.Product).where(models.Product.id == product["id"]).values(price=10))
+    db.commit()
+    assert table_versions.get_versions(db, ("products", "stock")) == {"products": before["products"] + 1, "stock": before["stock"]}
+
+
+def test_stale_etag_does_not_hide_a_missing_product(client, make_product):
+    product = make_product("SKU-GONE")
+    etag = client.get(f"/api/products/{product['id']}").headers["etag"]
+    with engine.begin() as conn:  # eliminato senza passare dagli hook di sessione
+        conn.execute(delete(models.Product).where(models.Product.id == product["id"]))
+    assert client.get(f"/api/products/{product['id']}", headers={"If-None-Match": etag}).status_code == 404
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app import models
+
+
+def test_movement_retry_with_same_key_is_replayed(client, db, locations, make_product):
+    wh = locations["warehouse"]
+    product = make_product("SKU-IDEM", qty=5, location_id=wh)
+    sell = {"product_id": product["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 30}
+
+    first = client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-1"})
+    retry = client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-1"})
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json() and retry.headers["idempotent-replayed"] == "true"
+    assert db.get(models.Product, product["id"]).total_qty == 4
+    sells = select(func.count()).select_from(models.StockMovement).where(models.StockMovement.type == "sell")
+    assert db.scalar(sells) == 1
+
+    # stessa chiave, corpo diverso
+    res = client.post("/api/stock/movement", json={**sell, "qty_change": 2}, headers={"Idempotency-Key": "pos-1"})
+    assert res.status_code == 422
+
+    # una richiesta fallita libera la chiave
+    too_many = {**sell, "qty_change": 50}
+    assert client.post("/api/stock/movement", json=too_many, headers={"Idempotency-Key": "pos-2"}).status_code == 400
+    assert db.scalar(select(func.count()).select_from(models.IdempotencyKey).where(models.IdempotencyKey.key == "pos-2")) == 0
+
+    scan = {"barcode": "800777", "title": "Felpa", "location": "warehouse"}
+    a = client.post("/api/products/receive", json=scan, headers={"Idempotency-Key": "scan-1"}).json()
+    b = client.post("/api/products/receive", json=scan, headers={"Idempotency-Key": "scan-1"}).json()
+    assert a == b
+    assert db.get(models.Product, a["id"]).total_qty == 1
+
+
+def test_write_and_saved_response_commit_together(client, db, monkeypatch, locations, make_product):
+    from app.core import idempotency
+
+    wh = locations["warehouse"]
+    product = make_product("SKU-IDEM2", qty=5, location_id=wh)
+    sell = {"product_id": product["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 30}
+
+    # errore dopo la scrittura ma prima del salvataggio della risposta: il movimento non resta applicato
+    def broken(body):
+        raise RuntimeError("serializzazione fallita")
+    monkeypatch.setattr(idempotency, "dumps", broken)
+    with pytest.raises(RuntimeError):
+        client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-3"})
+    monkeypatch.undo()
+    db.expire_all()
+    assert db.get(models.Product, product["id"]).total_qty == 5
+    assert db.get(models.IdempotencyKey, "pos-3") is None
+
+    assert client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-3"}).status_code == 200
+    db.expire_all()
+    assert db.get(models.Product, product["id"]).total_qty == 4
+
+
+def test_abandoned_reservation_is_taken_over(client, db, locations, make_product):
+    wh = locations["warehouse"]
+    product = make_product("SKU-IDEM3", qty=5, location_id=wh)
+    sell = {"product_id": product["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 30}
+    client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-4"})
+    row = db.get(models.IdempotencyKey, "pos-4")
+    row.key, row.status_code, row.response = "pos-5", None, None  # prenotazione di un processo terminato
+    db.commit()
+
+    assert client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-5"}).status_code == 409
+    row.created_at = datetime.utcnow() - timedelta(hours=1)
+    db.commit()
+    assert client.post("/api/stock/movement", json=sell, headers={"Idempotency-Key": "pos-5"}).status_code == 200
+    db.expire_all()
+    assert db.get(models.Product, product["id"]).total_qty == 3
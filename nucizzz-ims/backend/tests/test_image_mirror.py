@@ -0,0 +1,150 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+
+from app import models
+from app.services import image_mirror, images
+
+REMOTE = "https://images.openfoodfacts.org/images/products/800/front.400.jpg"
+MISSING = "https://cdn.example.com/missing.jpg"
+NOT_IMAGE = "https://cdn.example.com/page.jpg"
+
+
+@pytest.fixture(autouse=True)
+def public_dns(monkeypatch):
+    # niente rete nei test: ogni host risolve su un indirizzo pubblico, salvo quelli "interni"
+    async def resolve(host, port):
+        return ["10.0.0.5"] if host.endswith(".internal") else ["93.184.216.34"]
+    monkeypatch.setattr(image_mirror, "resolve", resolve)
+
+
+def _requested(request: httpx.Request) -> str:
+    """URL originale di una richiesta inviata all'indirizzo verificato (host nell'header Host)."""
+    return f"{request.url.scheme}://{request.headers['host']}{request.url.raw_path.decode()}"
+
+
+def _jpeg() -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0 finto jpeg"
+    buf = io.BytesIO()
+    Image.new("RGB", (1200, 900), (10, 120, 200)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_remote_images_are_mirrored_and_rewritten(client, db, make_product):
+    body = _jpeg()
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(_requested(request))
+        if _requested(request) == REMOTE:
+            return httpx.Response(200, content=body, headers={"content-type": "image/jpeg"})
+        if _requested(request) == NOT_IMAGE:
+            return httpx.Response(200, content=b"<html></html>", headers={"content-type": "text/html"})
+        return httpx.Response(404)
+
+    async def run_once():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await image_mirror.run_once(http)
+
+    a = make_product("SKU-MIR-A", image_url=REMOTE)
+    b = make_product("SKU-MIR-B", image_url=REMOTE)
+    c = make_product("SKU-MIR-C", image_url=MISSING)
+    d = make_product("SKU-MIR-D", image_url=NOT_IMAGE)
+    local = make_product("SKU-MIR-E", image_url="/api/files/locale.jpg")
+
+    stats = asyncio.run(run_once())
+    assert stats["mirrored"] == 1 and stats["failed"] == 2 and stats["products"] == 2
+    assert calls.count(REMOTE) == 1 and len(calls) == 3
+
+    url = client.get(f"/api/products/{a['id']}").json()["image_url"]
+    assert url.startswith("/api/files/") and url.endswith(".jpg")
+    assert client.get(url).content == body
+    assert client.get(f"/api/products/{b['id']}").json()["image_url"] == url
+    if images.available():
+        assert client.get(f"/api/products/{a['id']}").json()["image_thumb_url"].endswith(".thumb.webp")
+    assert client.get(f"/api/products/{c['id']}").json()["image_url"] == MISSING
+    assert client.get(f"/api/products/{local['id']}").json()["image_url"] == "/api/files/locale.jpg"
+
+    # 404 e pagina HTML sono errori definitivi: nessun nuovo tentativo
+    for failed in (MISSING, NOT_IMAGE):
+        row = db.get(models.ImageMirror, failed)
+        assert row.attempts == 1 and row.next_attempt_at is None and row.last_error
+    assert asyncio.run(run_once())["pending"] == 0
+
+    # nuovo prodotto con lo stesso URL remoto: ricollegato alla copia esistente senza riscaricare
+    e = make_product("SKU-MIR-F", image_url=REMOTE)
+    stats = asyncio.run(run_once())
+    assert stats["mirrored"] == 0 and stats["products"] == 1
+    assert calls.count(REMOTE) == 1
+    assert client.get(f"/api/products/{e['id']}").json()["image_url"] == url
+    assert d["image_url"] == NOT_IMAGE
+
+
+def test_transient_errors_are_retried_with_backoff(client, db, make_product):
+    make_product("SKU-MIR-RETRY", image_url=MISSING)
+
+    async def run_once(status):
+        transport = httpx.MockTransport(lambda request: httpx.Response(status))
+        async with httpx.AsyncClient(transport=transport) as http:
+            return await image_mirror.run_once(http)
+
+    assert asyncio.run(run_once(503))["failed"] == 1
+    row = db.get(models.ImageMirror, MISSING)
+    assert row.attempts == 1 and row.next_attempt_at is not None and row.claimed_until is None
+    # tentativo successivo non ancora dovuto
+    assert asyncio.run(run_once(503))["pending"] == 0
+
+
+def test_private_addresses_are_never_fetched(db, make_product):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(_requested(request))
+        if request.headers["host"] == "cdn.example.com":
+            return httpx.Response(302, headers={"location": "http://169.254.169.254/latest/meta-data/"})
+        return httpx.Response(200, content=b"segreto", headers={"content-type": "image/png"})
+
+    async def run_once():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await image_mirror.run_once(http)
+
+    urls = ["http://127.0.0.1:8000/api/files/x.png", "http://db.internal/x.png", "https://cdn.example.com/redirect.png"]
+    for n, url in enumerate(urls):
+        make_product(f"SKU-SSRF-{n}", image_url=url)
+    assert asyncio.run(run_once())["failed"] == 3
+    # solo il CDN pubblico è stato contattato; il redirect verso il metadata service no
+    assert calls == ["https://cdn.example.com/redirect.png"]
+    for url in urls:
+        row = db.get(models.ImageMirror, url)
+        assert row.next_attempt_at is None and "non pubblico" in row.last_error
+
+
+def test_connection_goes_to_the_checked_address(client, db, monkeypatch, make_product):
+    # DNS rebinding: il controllo vede un indirizzo pubblico, una seconda risoluzione darebbe 127.0.0.1
+    answers = iter([["93.184.216.34"], ["127.0.0.1"]])
+
+    async def rebinding(host, port):
+        return next(answers)
+    monkeypatch.setattr(image_mirror, "resolve", rebinding)
+    seen = []
+
+    def network(request: httpx.Request) -> httpx.Response:
+        seen.append((request.url.host, request.headers["host"], request.extensions.get("sni_hostname")))
+        if request.url.host != "93.184.216.34":  # httpx avrebbe risolto di nuovo il nome: servizio interno
+            return httpx.Response(200, content=b"segreto", headers={"content-type": "image/png"})
+        return httpx.Response(200, content=_jpeg(), headers={"content-type": "image/jpeg"})
+
+    async def run_once():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(network)) as http:
+            return await image_mirror.run_once(http)
+
+    p = make_product("SKU-REBIND", image_url="https://rebind.example.com/a.jpg")
+    assert asyncio.run(run_once())["mirrored"] == 1
+    assert seen == [("93.184.216.34", "rebind.example.com", "rebind.example.com")]
+    url = client.get(f"/api/products/{p['id']}").json()["image_url"]
+    assert client.get(url).content != b"segreto"
@@ -0,0 +1,40 @@
+import io
+
+import pytest
+
+from app.services import images
+
+PIL = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(size=(2000, 1500)) -> bytes:
+    buf = io.BytesIO()
+    PIL.new("RGB", size, (200, 30, 30)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_upload_generates_webp_derivatives(client, make_product):
+    res = client.post("/api/uploads/", files={"file": ("scarpa.jpg", _jpeg(), "image/jpeg")})
+    url = res.json()["url"]
+    # il task in background è già terminato quando TestClient restituisce la risposta
+    thumb = images.DERIVED_DIR / images.derived_name(res.json()["filename"], "thumb")
+    with PIL.open(thumb) as im:
+        assert im.format == "WEBP" and max(im.size) == images.IMAGE_THUMB_PX
+
+    product = make_product("SKU-IMG", image_url=url)
+    assert product["image_thumb_url"].endswith(".thumb.webp")
+    assert client.get(product["image_thumb_url"]).status_code == 200
+    assert len(client.get(product["image_thumb_url"]).content) < len(client.get(url).content) / 20
+
+    # prodotto creato prima dei derivati: li riceve dal backfill
+    other = make_product("SKU-IMG-2", image_url="/api/files/legacy.jpg")
+    assert other["image_thumb_url"] is None
+    (images.UPLOAD_DIR / "legacy.jpg").write_bytes(_jpeg((800, 600)))
+    from app.database import SessionLocal
+    db = SessionLocal()
+    try:
+        stats = images.backfill(db, ["legacy.jpg", "scarpa-inesistente.jpg"])
+    finally:
+        db.close()
+    assert stats["generated"] == 1 and stats["failed"] == 1 and stats["products"] == 1
+    assert client.get(f"/api/products/{other['id']}").json()["image_medium_url"].endswith("legacy.medium.webp")
@@ -0,0 +1,53 @@
+from sqlalchemy import event
+
+from app import models
+from app.database import engine
+from app.services import location_registry
+
+
+def test_receive_and_movement_resolve_locations_without_queries(client, db, locations, make_product):
+    wh = locations["warehouse"]
+    product = make_product("SKU-REG", qty=1, location_id=wh)
+
+    statements = []
+    listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        res = client.post("/api/stock/movement", json={"product_id": product["id"], "type": "in", "qty_change": 1, "to_location_id": wh})
+        assert res.status_code == 200
+        res = client.post("/api/products/receive", json={"barcode": "8000000000001", "title": "Nuovo", "location": "warehouse"})
+        assert res.status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert not [sql for sql in statements if "FROM locations" in sql]
+
+    res = client.post("/api/stock/movement", json={"product_id": product["id"], "type": "in", "qty_change": 1, "to_location_id": 999})
+    assert res.status_code == 400 and res.json()["detail"] == "Location inesistente"
+
+    # location creata da un altro worker: il primo lookup mancato ricarica il registro
+    db.add(models.Location(name="magazzino milano"))
+    db.commit()
+    res = client.post("/api/products/receive", json={"barcode": "8000000000002", "title": "Altro", "location": "magazzino milano"})
+    assert res.status_code == 200
+    assert [loc["name"] for loc in client.get("/api/locations/").json()].count("magazzino milano") == 1
+
+
+def test_unknown_names_are_remembered_until_locations_change(client, db):
+    location_registry.get_id(db, "refuso")
+    statements = []
+    listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        for _ in range(3):
+            assert location_registry.get_id(db, "refuso") is None
+            assert not location_registry.exists(db, 999)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    # un solo confronto di versione per l'id mai visto, nessuno per il nome già mancato
+    assert len([sql for sql in statements if "table_versions" in sql]) == 1
+    assert not [sql for sql in statements if "FROM locations" in sql]
+
+    db.add(models.Location(name="refuso"))
+    db.commit()
+    location_registry._checked_at = 0.0
+    assert location_registry.get_id(db, "refuso") is not None
@@ -0,0 +1,29 @@
+def test_low_stock_includes_zero_stock_and_thresholds(client, locations, make_product):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    never = make_product("SKU-ZERO")
+    plenty = make_product("SKU-MANY", qty=20, location_id=wh)
+    custom = make_product("SKU-CUSTOM", qty=8, location_id=wh, reorder_threshold=10)
+    make_product("SKU-OK", qty=6, location_id=wh)
+
+    low = client.get("/api/stock/low").json()
+    assert [(p["sku"], p["total_qty"]) for p in low] == [("SKU-ZERO", 0), ("SKU-CUSTOM", 8)]
+    assert low[0]["id"] == never["id"] and low[0]["reorder_threshold"] == 5
+
+    # soglia per location: il negozio deve avere almeno 3 pezzi di SKU-MANY
+    res = client.put("/api/stock/thresholds", json={
+        "product_id": plenty["id"], "location_id": shop, "reorder_threshold": 3,
+    })
+    assert res.status_code == 200
+    low = client.get("/api/stock/low").json()
+    assert "SKU-MANY" in [p["sku"] for p in low]
+    by_shop = client.get("/api/stock/low", params={"location_id": shop}).json()
+    assert [(p["sku"], p["low_locations"]) for p in by_shop] == [
+        ("SKU-MANY", [{"location_id": shop, "qty": 0, "reorder_threshold": 3}])
+    ]
+
+    # i movimenti invalidano la cache
+    client.post("/api/stock/movement", json={
+        "product_id": plenty["id"], "type": "transfer", "qty_change": 5, "from_location_id": wh, "to_location_id": shop,
+    })
+    client.post("/api/stock/movement", json={"product_id": custom["id"], "type": "in", "qty_change": 5, "to_location_id": wh})
+    assert [p["sku"] for p in client.get("/api/stock/low").json()] == ["SKU-ZERO"]
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from app import migrations
+
+
+def test_migrate_upgrades_legacy_schema_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE locations (id INTEGER PRIMARY KEY, name VARCHAR(100) UNIQUE, created_at DATETIME)")
+        conn.exec_driver_sql(
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, sku VARCHAR(64) UNIQUE, barcode VARCHAR(64), title VARCHAR(255), "
+            "brand VARCHAR(100), description TEXT, size VARCHAR(50), color VARCHAR(50), weight_grams FLOAT, "
+            "package_required VARCHAR(50), cost FLOAT, price FLOAT, image_url VARCHAR(512), created_at DATETIME, is_active BOOLEAN)"
+        )
+        conn.exec_driver_sql("CREATE TABLE stock (id INTEGER PRIMARY KEY, product_id INTEGER, location_id INTEGER, qty INTEGER)")
+        conn.exec_driver_sql("INSERT INTO locations (id, name) VALUES (1, 'warehouse')")
+        conn.exec_driver_sql("INSERT INTO products (id, sku, title) VALUES (1, 'OLD', 'Vecchio')")
+        conn.exec_driver_sql("INSERT INTO stock (product_id, location_id, qty) VALUES (1, 1, 2), (1, 1, 3)")
+
+    with pytest.raises(RuntimeError, match="app.cli migrate"):
+        migrations.check(engine)
+
+    applied = migrations.migrate(engine)
+    assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.migrate(engine) == []
+    assert migrations.check(engine) == migrations.LATEST
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT qty FROM stock").scalars().all() == [5]
+        assert conn.exec_driver_sql("SELECT total_qty FROM products").scalar() == 5
+        assert set(conn.exec_driver_sql("SELECT name FROM locations").scalars()) == {"warehouse", "negozio treviso"}
+        assert "ux_stock_product_location" in {ix["name"] for ix in inspect(conn).get_indexes("stock")}
+    engine.dispose()
+
+
+def test_legacy_sells_get_their_location_when_unambiguous(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/sells.db")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE locations (id INTEGER PRIMARY KEY, name VARCHAR(100) UNIQUE, created_at DATETIME)")
+        conn.exec_driver_sql("CREATE TABLE products (id INTEGER PRIMARY KEY, sku VARCHAR(64) UNIQUE, title VARCHAR(255), cost FLOAT)")
+        conn.exec_driver_sql("CREATE TABLE stock (id INTEGER PRIMARY KEY, product_id INTEGER, location_id INTEGER, qty INTEGER)")
+        conn.exec_driver_sql(
+            "CREATE TABLE stock_movements (id INTEGER PRIMARY KEY, product_id INTEGER, from_location_id INTEGER, "
+            "to_location_id INTEGER, qty_change INTEGER, type VARCHAR(20), note VARCHAR(255), created_at DATETIME)"
+        )
+        conn.exec_driver_sql("INSERT INTO locations (id, name) VALUES (1, 'warehouse'), (2, 'negozio treviso')")
+        conn.exec_driver_sql("INSERT INTO products (id, sku, title, cost) VALUES (1, 'UNO', 'Uno', 7), (2, 'DUE', 'Due', 3)")
+        conn.exec_driver_sql("INSERT INTO stock (product_id, location_id, qty) VALUES (1, 2, 1), (2, 1, 1), (2, 2, 1)")
+        conn.exec_driver_sql(
+            "INSERT INTO stock_movements (product_id, from_location_id, to_location_id, qty_change, type) VALUES "
+            "(1, NULL, 2, 2, 'in'), (1, NULL, NULL, -1, 'sell'), (2, NULL, NULL, -1, 'sell')"
+        )
+
+    migrations.migrate(engine)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "SELECT product_id, from_location_id, unit_cost FROM stock_movements WHERE type = 'sell' ORDER BY product_id"
+        ).all()
+    # prodotto 2 presente in due location: resta senza location (segnalato nel log)
+    assert rows == [(1, 2, 7), (2, None, 3)]
+    engine.dispose()
@@ -0,0 +1,47 @@
+import io
+import json
+
+
+CSV = """sku,barcode,title,brand,price,qty,location
+NK-1,111,Nike Dunk,Nike,120,3,warehouse
+NK-2,222,Nike AF1,Nike,,2,negozio treviso
+,333,Senza SKU,,50,,
+NK-3,,,,,1,warehouse
+NK-4,444,Bad,,abc,1,warehouse
+NK-5,555,Bad location,,10,1,magazzino x
+"""
+
+
+def test_import_csv_upserts_products_and_stock(client, locations):
+    files = {"file": ("catalogue.csv", io.BytesIO(CSV.encode()), "text/csv")}
+    res = client.post("/api/products/import", files=files, params={"chunk_size": 2})
+    assert res.status_code == 200, res.text
+    report = res.json()
+    assert report["processed"] == 6
+    assert report["products_upserted"] == 3
+    assert report["stock_updated"] == 2
+    assert [e["line"] for e in report["errors"]] == [5, 6, 7]
+
+    products = {p["sku"]: p for p in client.get("/api/products/with-stock").json()}
+    assert set(products) == {"NK-1", "NK-2", "333"}
+    assert products["NK-1"]["total_qty"] == 3
+    assert products["NK-2"]["stock"] == [{"location_id": locations["negozio treviso"], "qty": 2}]
+
+
+def test_import_jsonl_updates_existing_without_clearing_fields(client, locations, make_product):
+    make_product("NK-9", barcode="999", brand="Nike", price=100, qty=5, location_id=locations["warehouse"])
+    lines = [
+        {"barcode": "999", "price": 90, "qty": 2, "location": "warehouse"},
+        {"sku": "AD-1", "title": "Adidas Samba", "qty": 1, "location_id": locations["warehouse"]},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n"
+    files = {"file": ("feed.jsonl", io.BytesIO(body.encode()), "application/x-ndjson")}
+    report = client.post("/api/products/import", files=files).json()
+    assert report["products_upserted"] == 2
+    assert report["errors"] == [{"line": 3, "error": "JSON non valido: Expecting value"}]
+
+    products = {p["sku"]: p for p in client.get("/api/products/with-stock").json()}
+    assert products["NK-9"]["price"] == 90
+    assert products["NK-9"]["brand"] == "Nike"
+    assert products["NK-9"]["total_qty"] == 2
+    assert products["AD-1"]["is_active"] is True
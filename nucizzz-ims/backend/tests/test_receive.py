@@ -0,0 +1,31 @@
+from sqlalchemy import event, func, select
+
+from app import models
+from app.database import engine
+
+
+def test_receive_is_one_transaction_with_sequential_skus(client, db, locations):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    payload = {"barcode": "8001234567890", "title": "Sneaker", "location": "warehouse", "price_eur": 120}
+
+    commits = []
+    listener = lambda conn: commits.append(1)  # noqa: E731
+    event.listen(engine, "commit", listener)
+    try:
+        first = client.post("/api/products/receive", json=payload).json()
+        again = client.post("/api/products/receive", json=payload).json()
+    finally:
+        event.remove(engine, "commit", listener)
+    assert len(commits) == 2
+    assert first["id"] == again["id"] and first["sku"] == "8001234567890_1000000"
+
+    client.post("/api/products/receive", json={**payload, "location": "negozio treviso"})
+    other = client.post("/api/products/receive", json={"barcode": "8009999999999", "title": "Felpa"}).json()
+    assert other["sku"] == "8009999999999_1000001"
+
+    rows = dict(db.execute(select(models.Stock.location_id, models.Stock.qty).where(models.Stock.product_id == first["id"])).all())
+    assert rows == {wh: 2, shop: 1}
+    assert db.get(models.Product, first["id"]).total_qty == 3
+    assert db.get(models.Product, other["id"]).total_qty == 0
+    moves = db.scalar(select(func.count()).select_from(models.StockMovement).where(models.StockMovement.note == "Ricezione merce"))
+    assert moves == 3
@@ -0,0 +1,34 @@
+from sqlalchemy import select
+
+from app import models
+
+
+def test_receive_batch_aggregates_scans(client, db, locations, make_product):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    known = make_product("SKU-KNOWN", qty=1, location_id=wh, barcode="800111")
+
+    lines = [{"barcode": "800111"} for _ in range(40)]
+    lines += [{"barcode": "800222", "title": "Sneaker nuova", "price_eur": 150}, {"barcode": "800222", "qty": 2}]
+    lines += [{"barcode": "800111", "qty": 3, "location": "negozio treviso"}]
+    res = client.post("/api/products/receive/batch", json={"location": "warehouse", "lines": lines})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["products_created"] == 1 and body["units"] == 46
+    by_key = {(line["barcode"], line["location_id"]): line for line in body["lines"]}
+    assert by_key[("800111", wh)]["qty"] == 40 and by_key[("800111", shop)]["qty"] == 3
+    new_id = by_key[("800222", wh)]["product_id"]
+    assert by_key[("800222", wh)]["created"] and by_key[("800222", wh)]["qty"] == 3
+
+    movements = db.execute(
+        select(models.StockMovement.product_id, models.StockMovement.to_location_id, models.StockMovement.qty_change)
+        .where(models.StockMovement.note == "Ricezione merce")
+    ).all()
+    assert sorted(movements) == sorted([(known["id"], wh, 40), (known["id"], shop, 3), (new_id, wh, 3)])
+    assert db.get(models.Product, known["id"]).total_qty == 44
+    assert db.get(models.Product, new_id).price == 150
+    assert client.get("/api/products/barcode/800222").json()["id"] == new_id
+
+    # barcode nuovo senza titolo: nulla viene applicato
+    res = client.post("/api/products/receive/batch", json={"location": "warehouse", "lines": [{"barcode": "800111"}, {"barcode": "800333"}]})
+    assert res.status_code == 400 and "800333" in res.json()["detail"]
+    assert db.get(models.Product, known["id"]).total_qty == 44
@@ -0,0 +1,17 @@
+from app import schemas
+
+
+def test_fast_list_endpoints_match_response_models(client, locations, make_product):
+    wh = locations["warehouse"]
+    p = make_product("SKU-R", qty=2, location_id=wh, brand="Nike", price=99.5)
+    client.post("/api/stock/movement", json={
+        "product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 90,
+    })
+
+    products = client.get("/api/products/").json()
+    assert [schemas.ProductOut.model_validate(x).model_dump(mode="json") for x in products] == products
+
+    movements = client.get("/api/stock/movements").json()
+    assert [schemas.MovementOut.model_validate(x).model_dump(mode="json") for x in movements] == movements
+    assert movements[0]["product"]["sku"] == "SKU-R"
+    assert {m["type"] for m in movements} == {"in", "sell"}
@@ -0,0 +1,92 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import models
+from app.services import shopify_sync
+from app.shopify import ShopifyClient, ShopifyError
+
+from tests.fake_shopify import SHOP, FakeShopify
+
+
+def _client(fake):
+    return ShopifyClient(SHOP, "tok", transport=httpx.MockTransport(fake), poll_interval=0)
+
+
+def _product(i, **extra):
+    return models.Product(id=i, sku=f"SKU-{i}", barcode=f"80{i:04d}", title=extra.pop("title", f"Prodotto {i}"),
+                          size="42", price=10.5, is_active=True, **extra)
+
+
+def test_batched_upsert_and_inventory_use_few_requests():
+    fake = FakeShopify(throttle_first=True)
+    products = [_product(i) for i in range(1, 24)] + [_product(99, title="RIFIUTATO")]
+
+    async def run():
+        async with _client(fake) as client:
+            return await client.sync_products(products, {p.id: p.id for p in products}, bulk_threshold=100)
+
+    result = asyncio.run(run())
+    assert result == {"products": 23, "failed": ["SKU-99"]}
+    # 1 throttled + 3 blocchi productSet + location + 1 inventorySetQuantities, invece di 2-3 chiamate per prodotto
+    assert len(fake.requests) == 6
+    assert products[0].shopify_variant_id == "gid://shopify/ProductVariant/1"
+    assert fake.inventory[("gid://shopify/InventoryItem/5", "gid://shopify/Location/7")] == 5
+    created = fake.products["gid://shopify/Product/1"]
+    assert created["variants"][0]["inventoryItem"]["sku"] == "800001" and created["variants"][0]["price"] == "10.50"
+
+    # seconda sync: aggiornamento dei prodotti collegati (id numerici del vecchio client convertiti in GID)
+    products[1].shopify_product_id = "2"
+
+    async def update():
+        async with _client(fake) as client:
+            return await client.upsert_products(products[1:2])
+
+    assert asyncio.run(update()) == []
+    assert "gid://shopify/Product/2" in fake.products and products[1].shopify_product_id == "gid://shopify/Product/2"
+
+
+def test_full_catalogue_sync_uses_bulk_operation(client, db, make_product, locations):
+    for i in range(3):
+        make_product(f"SKU-BULK-{i}", qty=i + 1, location_id=locations["warehouse"], barcode=f"90{i}")
+    fake = FakeShopify()
+
+    async def run():
+        async with _client(fake) as shop:
+            return await shopify_sync.sync_catalogue(db, shop, bulk_threshold=0)
+
+    result = asyncio.run(run())
+    assert result["products"] == 3 and not result["failed"]
+    assert not any("upsertProducts" in q for q in fake.requests)
+    linked = db.query(models.Product).filter(models.Product.shopify_inventory_item_id.is_not(None)).count()
+    assert linked == 3
+    assert sorted(fake.inventory.values()) == [1, 2, 3]
+
+
+def test_stuck_bulk_operation_gives_up():
+    fake = FakeShopify()
+    fake.bulk_status = "RUNNING"
+
+    async def run():
+        async with ShopifyClient(SHOP, "tok", transport=httpx.MockTransport(fake), poll_interval=0, bulk_timeout=0.05) as shop:
+            return await shop.bulk_upsert_products([_product(1)])
+
+    with pytest.raises(ShopifyError, match="RUNNING"):
+        asyncio.run(run())
+
+
+def test_compared_inventory_skips_only_changed_items():
+    fake = FakeShopify()
+    location = "gid://shopify/Location/7"
+    products = [_product(i, shopify_inventory_item_id=f"gid://shopify/InventoryItem/{i}") for i in range(1, 4)]
+    fake.inventory = {(f"gid://shopify/InventoryItem/{i}", location): 5 for i in range(1, 4)}
+    fake.inventory[("gid://shopify/InventoryItem/2", location)] = 4  # venduto su Shopify
+
+    async def run():
+        async with _client(fake) as client:
+            return await client.set_inventory([(p, 8) for p in products], compare={p.id: 5 for p in products})
+
+    assert asyncio.run(run()) == [products[1]]
+    assert [fake.inventory[(f"gid://shopify/InventoryItem/{i}", location)] for i in range(1, 4)] == [8, 4, 8]
+    assert (products[0].shopify_synced_qty, products[1].shopify_synced_qty) == (8, None)
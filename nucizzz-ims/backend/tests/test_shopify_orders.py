@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from app import models
+from app.services import shopify_orders
+
+SECRET = "segreto-webhook"
+
+
+@pytest.fixture()
+def webhooks(client, monkeypatch):
+    # dopo l'avvio dell'app: il worker resta spento, i blocchi si elaborano dal test
+    monkeypatch.setattr(shopify_orders, "SHOPIFY_WEBHOOK_SECRET", SECRET)
+
+    def _post(topic, payload, secret=SECRET):
+        body = json.dumps(payload).encode()
+        signature = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+        return client.post("/api/shopify/webhooks", content=body, headers={
+            "Content-Type": "application/json", "X-Shopify-Topic": topic,
+            "X-Shopify-Hmac-Sha256": signature, "X-Shopify-Webhook-Id": f"wh-{payload['id']}",
+        })
+    return _post
+
+
+def _qty(db, pid, location_id):
+    db.expire_all()
+    stock = db.query(models.Stock).filter_by(product_id=pid, location_id=location_id).one_or_none()
+    return stock.qty if stock else 0
+
+
+def test_signature_is_required(webhooks, client):
+    assert webhooks("orders/create", {"id": 1}, secret="altro").status_code == 401
+    res = client.post("/api/shopify/webhooks", content=b"{}", headers={"X-Shopify-Topic": "orders/create"})
+    assert res.status_code == 401
+    assert webhooks("products/update", {"id": 1}).json() == {"ok": True, "ignored": "products/update"}
+
+
+def test_orders_become_one_batch_of_sell_movements(webhooks, db, make_product, locations):
+    wh = locations["warehouse"]
+    by_variant = make_product("SKU-WEB-1", qty=5, location_id=wh)
+    by_barcode = make_product("SKU-WEB-2", qty=3, location_id=wh, barcode="8001234567890")
+    product = db.get(models.Product, by_variant["id"])
+    product.shopify_variant_id = "gid://shopify/ProductVariant/501"
+    db.commit()
+
+    order = {"id": 9001, "name": "#1001", "line_items": [
+        {"variant_id": 501, "sku": "ALTRO", "quantity": 2, "price": "49.90"},
+        {"variant_id": 777, "sku": "8001234567890", "quantity": 1, "price": "19.00"},
+        {"variant_id": 888, "sku": "SCONOSCIUTO", "quantity": 1, "price": "5.00", "title": "Gift card"},
+    ]}
+    assert webhooks("orders/create", order).json() == {"ok": True, "duplicate": False}
+    # consegna ripetuta da Shopify: salvata una volta sola
+    assert webhooks("orders/create", order).json() == {"ok": True, "duplicate": True}
+    assert webhooks("orders/create", {"id": 9002, "name": "#1002", "line_items": [
+        {"variant_id": 501, "quantity": 1, "price": "49.90"},
+    ]}).status_code == 200
+
+    assert shopify_orders.process_batch() == {"events": 2, "movements": 3, "skipped": 1}
+    assert _qty(db, by_variant["id"], wh) == 2 and _qty(db, by_barcode["id"], wh) == 2
+    sells = db.query(models.StockMovement).filter_by(type="sell", product_id=by_variant["id"]).all()
+    assert {m.note for m in sells} == {"Shopify ordine #1001", "Shopify ordine #1002"}
+    assert sells[0].sale_price == 49.90
+
+    first = db.query(models.ShopifyWebhookEvent).filter_by(event_key="orders/create:9001").one()
+    assert first.processed_at is not None and first.movements == 2 and "SCONOSCIUTO" in first.last_error
+    assert shopify_orders.process_batch()["events"] == 0
+    assert shopify_orders.status(db) == {"pending": 0, "dead": 0, "with_skipped_lines": 1}
+
+
+def test_refund_restocks_only_returned_items(webhooks, db, make_product, locations):
+    wh = locations["warehouse"]
+    p = make_product("SKU-WEB-3", qty=4, location_id=wh)
+    webhooks("refunds/create", {"id": 70, "order_id": 9003, "refund_line_items": [
+        {"quantity": 1, "restock_type": "return", "line_item": {"sku": "SKU-WEB-3"}},
+        {"quantity": 2, "restock_type": "no_restock", "line_item": {"sku": "SKU-WEB-3"}},
+    ]})
+    assert shopify_orders.process_batch()["movements"] == 1
+    assert _qty(db, p["id"], wh) == 5
+
+
+def test_failed_batch_is_retried_with_backoff(webhooks, monkeypatch, db):
+    monkeypatch.setattr(shopify_orders, "SHOPIFY_ORDERS_LOCATION", "inesistente")
+    webhooks("orders/create", {"id": 9004, "line_items": []})
+    assert shopify_orders.process_batch()["failed"] == 1
+    event = db.query(models.ShopifyWebhookEvent).one()
+    assert event.processed_at is None and event.attempts == 1 and "inesistente" in event.last_error
+    assert shopify_orders.process_batch()["events"] == 0
+
+
+def _due(db):
+    # salta il backoff: gli eventi in attesa tornano subito disponibili
+    db.query(models.ShopifyWebhookEvent).filter(models.ShopifyWebhookEvent.processed_at.is_(None)).update(
+        {"next_attempt_at": models.ShopifyWebhookEvent.received_at}
+    )
+    db.commit()
+
+
+def test_malformed_event_does_not_block_the_batch(webhooks, db, make_product, locations):
+    wh = locations["warehouse"]
+    p = make_product("SKU-WEB-4", qty=5, location_id=wh)
+    webhooks("orders/create", {"id": 9005, "line_items": [{"sku": "SKU-WEB-4", "quantity": 1, "price": "10"}]})
+    webhooks("orders/create", {"id": 9006, "line_items": [{"sku": "SKU-WEB-4", "quantity": "due", "price": "10"}]})
+    webhooks("orders/create", {"id": 9007, "line_items": [{"sku": "SKU-WEB-4", "quantity": 2, "price": "10"}]})
+
+    assert shopify_orders.process_batch() == {"events": 2, "movements": 2, "skipped": 0, "failed": 1}
+    assert _qty(db, p["id"], wh) == 2
+    events = {e.event_key: e for e in db.query(models.ShopifyWebhookEvent)}
+    bad = events["orders/create:9006"]
+    assert bad.processed_at is None and bad.attempts == 1 and "ValueError" in bad.last_error
+    assert all(events[k].processed_at is not None and events[k].attempts == 0 for k in ("orders/create:9005", "orders/create:9007"))
+
+
+def test_sale_without_local_stock_waits_instead_of_being_dropped(webhooks, client, db, make_product, locations):
+    wh = locations["warehouse"]
+    short = make_product("SKU-WEB-5", qty=1, location_id=wh)
+    other = make_product("SKU-WEB-6", qty=3, location_id=wh)
+    webhooks("orders/create", {"id": 9008, "line_items": [
+        {"sku": "SKU-WEB-6", "quantity": 1, "price": "10"},
+        {"sku": "SKU-WEB-5", "quantity": 2, "price": "10"},
+    ]})
+    webhooks("orders/create", {"id": 9009, "line_items": [{"sku": "SKU-WEB-6", "quantity": 1, "price": "10"}]})
+
+    # l'ordine 9008 non si applica a metà: resta in coda, il 9009 prosegue
+    assert shopify_orders.process_batch() == {"events": 1, "movements": 1, "skipped": 0, "failed": 1}
+    assert _qty(db, short["id"], wh) == 1 and _qty(db, other["id"], wh) == 2
+    waiting = db.query(models.ShopifyWebhookEvent).filter_by(event_key="orders/create:9008").one()
+    assert waiting.processed_at is None and "Stock insufficiente" in waiting.last_error
+    assert shopify_orders.status(db)["pending"] == 1
+
+    # merce registrata in negozio: al tentativo successivo la vendita online viene applicata per intero
+    res = client.post("/api/stock/movement", json={"product_id": short["id"], "type": "in", "qty_change": 1, "to_location_id": wh})
+    assert res.status_code == 200
+    _due(db)
+    assert shopify_orders.process_batch() == {"events": 1, "movements": 2, "skipped": 0}
+    assert _qty(db, short["id"], wh) == 0 and _qty(db, other["id"], wh) == 1
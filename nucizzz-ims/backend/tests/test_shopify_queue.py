@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app import models
+from app.services import shopify_orders, shopify_queue, shopify_sync
+from app.shopify import ShopifyClient
+from tests.fake_shopify import SHOP, FakeShopify
+
+
+@pytest.fixture()
+def shopify_enabled(client, monkeypatch):
+    # dopo l'avvio dell'app: il worker in background resta spento, i giri si lanciano dal test
+    monkeypatch.setattr(shopify_sync, "configured", lambda: True)
+
+
+def _run_once(handler):
+    async def run():
+        async with ShopifyClient(SHOP, "tok", transport=httpx.MockTransport(handler)) as client:
+            return await shopify_queue.run_once(client)
+    return asyncio.run(run())
+
+
+def _queue(db):
+    db.expire_all()
+    return {row.product_id: row for row in db.query(models.ShopifySyncItem)}
+
+
+def test_stock_changes_are_coalesced_and_pushed(shopify_enabled, client, db, make_product, locations):
+    wh = locations["warehouse"]
+    p = make_product("SKU-Q1", qty=5, location_id=wh, barcode="111")
+    for _ in range(2):
+        res = client.post("/api/stock/movement", json={"product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 20})
+        assert res.status_code == 200, res.text
+    queue = _queue(db)
+    assert list(queue) == [p["id"]] and queue[p["id"]].version == 3
+
+    fake = FakeShopify()
+    assert _run_once(fake) == {"claimed": 1, "synced": 1, "failed": 0}
+    # prodotto creato su Shopify e giacenza corrente (5 - 2) inviata con una sola mutation
+    assert list(fake.inventory.values()) == [3]
+    assert not _queue(db)
+    product = db.get(models.Product, p["id"])
+    assert product.shopify_inventory_item_id == "gid://shopify/InventoryItem/1"
+
+    # prodotto già collegato: solo inventorySetQuantities, nessun productSet
+    client.post("/api/stock/movement", json={"product_id": p["id"], "type": "in", "qty_change": 4, "to_location_id": wh})
+    fake.requests.clear()
+    assert _run_once(fake)["synced"] == 1
+    assert not any("upsertProducts" in q for q in fake.requests)
+    assert sum("inventorySetQuantities" in q for q in fake.requests) == 1
+    assert list(fake.inventory.values()) == [7]
+
+
+def test_changes_during_push_stay_queued(shopify_enabled, client, db, make_product, locations):
+    p = make_product("SKU-Q2", qty=1, location_id=locations["warehouse"])
+    claimed = shopify_queue.claim(db, "tok-a")
+    assert claimed == {p["id"]: 1}
+    # nuova modifica mentre il worker sta inviando la versione 1
+    shopify_queue.enqueue(db, [(p["id"], locations["warehouse"])])
+    db.commit()
+    shopify_queue.finish(db, "tok-a", claimed, [p["id"]], {})
+    row = _queue(db)[p["id"]]
+    assert row.version == 2 and row.claim_token is None
+
+
+def test_failures_back_off_then_dead_letter(shopify_enabled, monkeypatch, client, db, make_product, locations):
+    monkeypatch.setattr(shopify_queue, "SHOPIFY_SYNC_MAX_ATTEMPTS", 2)
+    p = make_product("SKU-Q3", qty=2, location_id=locations["warehouse"])
+    down = lambda request: httpx.Response(503, text="Service Unavailable")  # noqa: E731
+
+    assert _run_once(down) == {"claimed": 1, "synced": 0, "failed": 1}
+    row = _queue(db)[p["id"]]
+    assert row.attempts == 1 and row.dead_at is None and "503" in row.last_error
+    # in backoff: il giro successivo non la riprende
+    assert _run_once(down)["claimed"] == 0
+
+    row.next_attempt_at = row.updated_at
+    db.commit()
+    _run_once(down)
+    assert _queue(db)[p["id"]].dead_at is not None
+    assert shopify_queue.status(db) == {"pending": 0, "dead": 1}
+
+    assert shopify_queue.retry_dead(db) == 1
+    assert _run_once(FakeShopify())["synced"] == 1
+    assert shopify_queue.status(db) == {"pending": 0, "dead": 0}
+
+
+def test_online_sales_are_not_overwritten(shopify_enabled, client, db, make_product, locations):
+    wh = locations["warehouse"]
+    p = make_product("SKU-Q5", qty=5, location_id=wh)
+    fake = FakeShopify()
+    assert _run_once(fake)["synced"] == 1
+    level = ("gid://shopify/InventoryItem/1", "gid://shopify/Location/7")
+    assert fake.inventory[level] == 5 and db.get(models.Product, p["id"]).shopify_synced_qty == 5
+
+    # vendita online (Shopify scende a 3) e, prima che arrivi il webhook, un carico in negozio
+    fake.inventory[level] = 3
+    client.post("/api/stock/movement", json={"product_id": p["id"], "type": "in", "qty_change": 1, "to_location_id": wh})
+    assert _run_once(fake) == {"claimed": 1, "synced": 0, "failed": 1}
+    row = _queue(db)[p["id"]]
+    assert fake.inventory[level] == 3 and row.attempts == 1 and row.last_error == shopify_queue.STALE_ERROR
+
+    # webhook ricevuto ma non ancora applicato: il prodotto aspetta senza consumare tentativi
+    order = {"id": 9101, "name": "#1101", "line_items": [{"sku": "SKU-Q5", "quantity": 2, "price": "10"}]}
+    shopify_orders.store_event(db, "orders/create", "wh-9101", json.dumps(order).encode())
+    row.next_attempt_at = row.updated_at
+    db.commit()
+    assert _run_once(fake) == {"claimed": 1, "synced": 0, "failed": 0, "held": 1}
+    row = _queue(db)[p["id"]]
+    assert row.attempts == 1 and row.last_error == shopify_queue.HELD_ERROR and fake.inventory[level] == 3
+
+    # ordine applicato: stock locale 6 - 2, disponibilità attesa 5 - 2, l'invio passa
+    assert shopify_orders.process_batch()["movements"] == 1
+    assert db.get(models.Product, p["id"]).shopify_synced_qty == 3
+    row.next_attempt_at = row.updated_at
+    db.commit()
+    assert _run_once(fake)["synced"] == 1
+    assert fake.inventory[level] == 4 and not _queue(db)
+
+
+def test_malformed_responses_count_as_attempts(shopify_enabled, monkeypatch, client, db, make_product, locations):
+    monkeypatch.setattr(shopify_queue, "SHOPIFY_SYNC_MAX_ATTEMPTS", 2)
+    p = make_product("SKU-Q6", qty=2, location_id=locations["warehouse"])
+    garbled = lambda request: httpx.Response(200, text="<html>manutenzione</html>")  # noqa: E731
+
+    assert _run_once(garbled) == {"claimed": 1, "synced": 0, "failed": 1}
+    row = _queue(db)[p["id"]]
+    assert row.attempts == 1 and row.claim_token is None and "JSONDecodeError" in row.last_error
+
+    row.next_attempt_at = row.updated_at
+    db.commit()
+    _run_once(garbled)
+    assert _queue(db)[p["id"]].dead_at is not None
+
+
+def test_nothing_is_queued_without_shopify(client, db, make_product, locations):
+    make_product("SKU-Q4", qty=2, location_id=locations["warehouse"])
+    assert not _queue(db)
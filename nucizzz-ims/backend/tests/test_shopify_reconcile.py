@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import httpx
+
+from app import models
+from app.services import shopify_orders, shopify_reconcile
+from app.shopify import ShopifyClient
+from tests.fake_shopify import SHOP, FakeShopify
+
+LOCATION = "gid://shopify/Location/7"
+
+
+def _link(db, pid, n):
+    p = db.get(models.Product, pid)
+    p.shopify_product_id = f"gid://shopify/Product/{n}"
+    p.shopify_variant_id = f"gid://shopify/ProductVariant/{n}"
+    p.shopify_inventory_item_id = str(n)  # id numerico del vecchio client REST
+    db.commit()
+
+
+def _reconcile(db, fake, dry_run=False):
+    async def run():
+        async with ShopifyClient(SHOP, "tok", LOCATION, transport=httpx.MockTransport(fake)) as client:
+            return await shopify_reconcile.reconcile(db, client, dry_run=dry_run)
+    return asyncio.run(run())
+
+
+def test_reconcile_pushes_only_differences(client, db, make_product, locations):
+    wh = locations["warehouse"]
+    products = [make_product(f"SKU-REC-{i}", qty=i + 1, location_id=wh) for i in range(5)]
+    for n, p in enumerate(products, start=1):
+        _link(db, p["id"], n)
+    make_product("SKU-REC-NUOVO", qty=1, location_id=wh)
+
+    fake = FakeShopify()
+    fake.page_size = 2
+    item = lambda n: (f"gid://shopify/InventoryItem/{n}", LOCATION)  # noqa: E731
+    fake.inventory = {item(1): 1, item(2): 2, item(3): 0, item(4): 9, item(99): 4}  # 5 non attivo sulla location
+
+    report = _reconcile(db, fake, dry_run=True)
+    assert (report.checked, report.differences, report.pushed) == (5, 2, 0)
+    assert (report.missing_remote, report.not_linked, report.unknown_remote) == (1, 1, 1)
+    assert fake.inventory[item(3)] == 0
+
+    fake.requests.clear()
+    report = _reconcile(db, fake)
+    assert report.pushed == 2 and report.error is None
+    assert fake.inventory[item(3)] == 3 and fake.inventory[item(4)] == 4 and fake.inventory[item(1)] == 1
+    # 3 pagine di livelli + 1 sola mutation per le differenze
+    assert len(fake.requests) == 4
+
+    assert _reconcile(db, fake).differences == 0
+
+    res = client.get("/api/shopify/reconciliations?limit=2")
+    assert res.status_code == 200
+    latest, previous = res.json()
+    assert latest["differences"] == 0 and previous["pushed"] == 2
+    assert {d["sku"] for d in previous["details"]} == {"SKU-REC-2", "SKU-REC-3", "SKU-REC-4"}
+
+
+def test_reconcile_skips_pending_orders_and_online_sales(client, db, make_product, locations):
+    wh = locations["warehouse"]
+    ordered, sold, plain = (make_product(f"SKU-REC-O{i}", qty=5, location_id=wh) for i in range(3))
+    for n, p in enumerate((ordered, sold, plain), start=1):
+        _link(db, p["id"], n)
+    item = lambda n: (f"gid://shopify/InventoryItem/{n}", LOCATION)  # noqa: E731
+
+    # ordine ricevuto da Shopify ma non ancora applicato: la differenza è attesa, non va corretta
+    order = {"id": 9201, "line_items": [{"sku": "SKU-REC-O0", "quantity": 1, "price": "10"}]}
+    shopify_orders.store_event(db, "orders/create", "wh-9201", json.dumps(order).encode())
+
+    fake = FakeShopify()
+    fake.inventory = {item(1): 4, item(2): 3, item(3): 3}
+    set_quantities = fake.__call__
+
+    def sale_during_reconcile(request):
+        # vendita online fra la lettura dei livelli e l'invio delle correzioni
+        if b"inventorySetQuantities" in request.content:
+            fake.inventory[item(2)] = 2
+        return set_quantities(request)
+
+    async def run():
+        async with ShopifyClient(SHOP, "tok", LOCATION, transport=httpx.MockTransport(sale_during_reconcile)) as c:
+            return await shopify_reconcile.reconcile(db, c)
+
+    report = asyncio.run(run())
+    assert (report.skipped_pending, report.differences, report.pushed) == (1, 2, 1)
+    assert fake.inventory == {item(1): 4, item(2): 2, item(3): 5}
+    assert {d["sku"]: d["stale"] for d in json.loads(report.details)} == {"SKU-REC-O1": True, "SKU-REC-O2": False}
+    db.expire_all()
+    assert db.get(models.Product, plain["id"]).shopify_synced_qty == 5
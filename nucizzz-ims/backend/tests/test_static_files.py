@@ -0,0 +1,41 @@
+import gzip
+import os
+
+from app.core.config import UPLOAD_DIR
+from app.services.images import DERIVED_DIR
+
+
+def test_uploaded_files_are_cached_and_support_ranges(client):
+    photo = b"\xff\xd8" + os.urandom(5000)
+    url = client.post("/api/uploads/", files={"file": ("a.jpg", photo, "image/jpeg")}).json()["url"]
+
+    res = client.get(url)
+    assert res.headers["cache-control"] == "public, max-age=31536000, immutable"
+    etag = res.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    part = client.get(url, headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == photo[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(photo)}"
+    assert client.get(url, headers={"Range": "bytes=-10"}).content == photo[-10:]
+    assert client.get(url, headers={"Range": "bytes=100-199", "If-Range": '"altro"'}).status_code == 200
+    assert client.get(url, headers={"Range": f"bytes={len(photo)}-"}).status_code == 416
+
+    # derivato AVIF preferito al WebP se accettato dal browser
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    stem = "f" * 64
+    (DERIVED_DIR / f"{stem}.thumb.webp").write_bytes(b"webp")
+    (DERIVED_DIR / f"{stem}.thumb.avif").write_bytes(b"avif")
+    webp_url = f"/api/files/derived/{stem}.thumb.webp"
+    assert client.get(webp_url, headers={"Accept": "image/webp"}).content == b"webp"
+    avif = client.get(webp_url, headers={"Accept": "image/avif,image/webp"})
+    assert avif.content == b"avif" and avif.headers["content-type"] == "image/avif" and avif.headers["vary"] == "Accept"
+
+    # variante precompressa e file legacy senza hash
+    (UPLOAD_DIR / "logo.svg").write_bytes(b"<svg/>")
+    (UPLOAD_DIR / "logo.svg.gz").write_bytes(gzip.compress(b"<svg/>"))
+    res = client.get("/api/files/logo.svg", headers={"Accept-Encoding": "gzip"})
+    assert res.content == b"<svg/>" and res.headers["content-encoding"] == "gzip"
+    assert res.headers["content-type"].startswith("image/svg+xml") and res.headers["cache-control"] == "public, max-age=86400"
+    assert client.get("/api/files/.incoming/x.part").status_code == 404
@@ -0,0 +1,51 @@
+def _qty(client, pid, loc):
+    rows = client.get(f"/api/stock/by_product/{pid}").json()
+    return next((r["qty"] for r in rows if r["location_id"] == loc), 0)
+
+
+def test_batch_applies_all_lines_in_one_request(client, locations, make_product):
+    wh, shop = locations["warehouse"], locations["negozio treviso"]
+    p = make_product("SKU-A", qty=5, location_id=wh)
+    lines = [
+        {"product_id": p["id"], "type": "sell", "qty_change": 2, "from_location_id": wh, "sale_price": 10},
+        {"product_id": p["id"], "type": "transfer", "qty_change": 1, "from_location_id": wh, "to_location_id": shop},
+        {"product_id": p["id"], "type": "in", "qty_change": 4, "to_location_id": shop},
+    ]
+    res = client.post("/api/stock/movements/batch", json={"lines": lines})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["applied"] == 3 and body["failed"] == 0
+    assert body["results"][0]["movement"]["qty_change"] == -2
+    assert body["results"][0]["movement"]["from_location_id"] == wh
+    assert _qty(client, p["id"], wh) == 2
+    assert _qty(client, p["id"], shop) == 5
+
+
+def test_batch_atomic_rolls_back_on_error(client, locations, make_product):
+    wh = locations["warehouse"]
+    p = make_product("SKU-B", qty=1, location_id=wh)
+    lines = [
+        {"product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 5},
+        {"product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 5},
+    ]
+    res = client.post("/api/stock/movements/batch", json={"lines": lines})
+    assert res.status_code == 400
+    assert res.json()["detail"]["errors"] == [{"index": 1, "error": "Stock insufficiente"}]
+    assert _qty(client, p["id"], wh) == 1
+
+
+def test_batch_per_line_skips_invalid_lines(client, locations, make_product):
+    wh = locations["warehouse"]
+    p = make_product("SKU-C", qty=1, location_id=wh)
+    lines = [
+        {"product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh, "sale_price": 5},
+        {"product_id": p["id"], "type": "sell", "qty_change": 1, "from_location_id": wh},
+        {"product_id": 9999, "type": "in", "qty_change": 1, "to_location_id": wh},
+    ]
+    res = client.post("/api/stock/movements/batch", json={"lines": lines, "atomic": False})
+    assert res.status_code == 200
+    body = res.json()
+    assert body["applied"] == 1 and body["failed"] == 2
+    assert body["results"][1]["error"] == "Prezzo di vendita mancante"
+    assert body["results"][2]["error"] == "Prodotto non trovato"
+    assert _qty(client, p["id"], wh) == 0
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import UPLOAD_DIR
+from app.services import uploads
+
+
+def test_upload_is_streamed_to_disk_with_size_limit(client, monkeypatch):
+    payload = b"\xff\xd8" + b"x" * 300_000
+    res = client.post("/api/uploads/", files={"file": ("foto.JPG", payload, "image/jpeg")})
+    assert res.status_code == 200
+    name = res.json()["filename"]
+    assert name.endswith(".jpg") and (UPLOAD_DIR / name).read_bytes() == payload
+    assert client.get(res.json()["url"]).content == payload
+
+    assert client.post("/api/uploads/", files={"file": ("a.txt", b"ciao", "text/plain")}).status_code == 400
+    # estensione non valida: si usa quella di default
+    res = client.post("/api/uploads/", files={"file": ("x./../evil", b"img", "image/x-sconosciuto")})
+    assert res.json()["filename"].endswith(".jpg")
+
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_BYTES", 100_000)
+    before = set(UPLOAD_DIR.iterdir())
+    res = client.post("/api/uploads/", files={"file": ("big.jpg", payload, "image/jpeg")})
+    assert res.status_code == 413
+    assert set(UPLOAD_DIR.iterdir()) == before
+    assert not list(uploads.INCOMING_DIR.iterdir())
+
+
+def test_uploads_are_content_addressed_and_collected(client, db, make_product):
+    photo = b"\x89PNG" + os.urandom(2048)
+    first = client.post("/api/uploads/", files={"file": ("IMG_1.PNG", photo, "image/png")}).json()
+    again = client.post("/api/uploads/", files={"file": ("copia.png", photo, "image/png")}).json()
+    assert first["filename"] == again["filename"] == f"{hashlib.sha256(photo).hexdigest()}.png"
+    assert not first["existing"] and again["existing"]
+
+    orphan = client.post("/api/uploads/", files={"file": ("x.png", b"\x89PNG" + os.urandom(64), "image/png")}).json()
+    make_product("SKU-FOTO-1", image_url=first["url"])
+    make_product("SKU-FOTO-2", image_url=first["url"])
+    assert uploads.references(db)[first["filename"]] == 2
+
+    # appena caricato: protetto dal periodo di grazia
+    assert uploads.collect_garbage(db)["removed"] == 0
+    old = time.time() - 48 * 3600
+    for name in (first["filename"], orphan["filename"]):
+        os.utime(UPLOAD_DIR / name, (old, old))
+    stats = uploads.collect_garbage(db, dry_run=True)
+    assert stats["removed"] == 1 and (UPLOAD_DIR / orphan["filename"]).exists()
+    uploads.collect_garbage(db)
+    assert not (UPLOAD_DIR / orphan["filename"]).exists()
+    assert (UPLOAD_DIR / first["filename"]).exists()
+
+
+def test_chunked_upload_without_length_stops_at_the_limit(client, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_BYTES", 100_000)
+
+    def body():  # generatore: httpx lo invia chunked, senza Content-Length
+        yield b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'
+        for _ in range(50):
+            yield b"x" * 65536
+        yield b"\r\n--xyz--\r\n"
+
+    res = client.post("/api/uploads/", content=body(), headers={"Content-Type": "multipart/form-data; boundary=xyz"})
+    assert res.status_code == 413
+    assert not list(uploads.INCOMING_DIR.iterdir())
+
+
+def test_multipart_stream_is_not_read_past_the_limit():
+    consumed = []
+
+    async def body():
+        yield b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'
+        for _ in range(1000):  # 64 MB se letto tutto
+            consumed.append(1)
+            yield b"x" * 65536
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(uploads.store_multipart(body(), "multipart/form-data; boundary=xyz", max_bytes=100_000))
+    assert exc.value.status_code == 413 and len(consumed) < 5
+
+
+def test_reupload_survives_a_concurrent_garbage_collection(client, monkeypatch):
+    photo = b"\x89PNG" + os.urandom(512)
+    name = client.post("/api/uploads/", files={"file": ("a.png", photo, "image/png")}).json()["filename"]
+    real_utime = os.utime
+
+    def collected_meanwhile(path, *args, **kwargs):
+        os.unlink(path)  # collect_garbage elimina il file tra exists() e utime()
+        return real_utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(uploads.os, "utime", collected_meanwhile)
+    res = client.post("/api/uploads/", files={"file": ("a.png", photo, "image/png")})
+    assert res.status_code == 200 and not res.json()["existing"]
+    assert (UPLOAD_DIR / name).read_bytes() == photo
+
+
+def test_garbage_collection_keeps_a_file_reused_after_its_check(client, db, monkeypatch):
+    photo = b"\x89PNG" + os.urandom(512)
+    name = client.post("/api/uploads/", files={"file": ("a.png", photo, "image/png")}).json()["filename"]
+    old = time.time() - 48 * 3600
+    os.utime(UPLOAD_DIR / name, (old, old))
+    real_replace = os.replace
+
+    def reuploaded_meanwhile(src, dst):
+        if str(dst).startswith(str(uploads.TRASH_DIR)):
+            os.utime(src)  # _finish riusa il file dopo che il GC ne ha letto l'mtime vecchio
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(uploads.os, "replace", reuploaded_meanwhile)
+    assert uploads.collect_garbage(db)["removed"] == 0
+    assert (UPLOAD_DIR / name).read_bytes() == photo
+    assert not list(uploads.TRASH_DIR.iterdir())
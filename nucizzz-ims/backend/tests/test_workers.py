@@ -0,0 +1,34 @@
+import asyncio
+from datetime import timedelta
+
+from app.services import workers
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    assert [workers.backoff(n, 5, 30) for n in (1, 2, 3, 4, 10)] == [
+        timedelta(seconds=s) for s in (5, 10, 20, 30, 30)
+    ]
+
+
+def test_worker_survives_errors_and_wakes_on_notify():
+    rounds = []
+
+    async def run_round():
+        rounds.append(len(rounds))
+        if len(rounds) == 1:
+            raise RuntimeError("DB non raggiungibile")
+        return len(rounds) < 3  # il secondo giro lascia lavoro arretrato: il terzo parte subito
+
+    async def scenario():
+        worker = workers.Worker("test", run_round, interval=60)
+        worker.start()
+        await asyncio.sleep(0.05)
+        assert rounds == [0]  # errore registrato, il worker aspetta la sveglia
+        worker.notify()
+        await asyncio.sleep(0.05)
+        assert rounds == [0, 1, 2]
+        await worker.stop()
+        assert not worker.running
+        worker.notify()  # dopo lo stop non fa niente
+
+    asyncio.run(scenario())
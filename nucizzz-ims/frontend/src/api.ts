@@ -10,3 +10,40 @@ try {
 } catch {}
 
 export const api = axios.create({ baseURL: base });
+
+function newIdempotencyKey(): string {
+  if (typeof crypto !== "undefined" && "randomUUID" in crypto) return crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Allineato a IDEMPOTENCY_PENDING_SECONDS del backend: oltre questo tempo una prenotazione
+// rimasta senza risposta viene ripresa dal retry, quindi il 409 si risolve sempre prima.
+const IDEMPOTENCY_PENDING_MS = 300_000;
+// Chiave per (url, corpo) finché l'esito della scrittura non è noto: un nuovo invio dello
+// stesso form dopo un errore di rete riusa la chiave e il server risponde con l'esito originale.
+const pendingKeys = new Map<string, string>();
+
+// Scritture di stock (movimenti, ricezioni): ogni tentativo usa la stessa Idempotency-Key,
+// quindi un retry dopo un errore di rete non registra due volte lo stesso movimento.
+// Nessun timeout lato client: una ricezione lunga non deve sembrare fallita mentre il server la salva.
+export async function postIdempotent<T = any>(url: string, data: unknown) {
+  const form = `${url}\n${JSON.stringify(data)}`;
+  const key = pendingKeys.get(form) ?? newIdempotencyKey();
+  pendingKeys.set(form, key);
+  const headers = { "Idempotency-Key": key };
+  const deadline = Date.now() + IDEMPOTENCY_PENDING_MS;
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const res = await api.post<T>(url, data, { headers });
+      pendingKeys.delete(form);
+      return res;
+    } catch (e: any) {
+      const status = e?.response?.status;
+      // con una risposta diversa da 409 l'esito è noto: un nuovo invio è una nuova richiesta
+      if (status && status !== 409) pendingKeys.delete(form);
+      if ((status && status !== 409) || Date.now() >= deadline) throw e;
+      // 409 = richiesta originale ancora in corso: si aspetta che la prenotazione si risolva
+      await new Promise((resolve) => setTimeout(resolve, Math.min(500 * 2 ** attempt, 10_000)));
+    }
+  }
+}
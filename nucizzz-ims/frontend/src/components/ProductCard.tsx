@@ -12,6 +12,7 @@ export type Product = {
   cost_eur?: number;
   location?: string;
   image_url?: string;
+  image_thumb_url?: string | null;
   stock?: number;
   created_at?: string;
   brand?: string;
@@ -33,7 +34,8 @@ export default function ProductCard({ product, onEdit, onDelete, onSell }: Props
       <div className="flex gap-3">
         {product.image_url ? (
           <img
-            src={product.image_url}
+            src={product.image_thumb_url || product.image_url}
+            loading="lazy"
             alt={product.title}
             className="w-24 h-24 object-cover rounded-xl"
           />
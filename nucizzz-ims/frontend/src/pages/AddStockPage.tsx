@@ -1,6 +1,6 @@
 import React, { useRef, useState } from "react";
 import { Link } from "react-router-dom";
-import { api } from "../api";
+import { api, postIdempotent } from "../api";
 import { useLocationSelection } from "../contexts/LocationContext";
 import ScanInput from "../components/ScanInput";
 import BarcodeModal from "../components/BarcodeModal";
@@ -52,7 +52,7 @@ export default function AddStockPage() {
       return;
     }
     try {
-      await api.post("/stock/movement", {
+      await postIdempotent("/stock/movement", {
         product_id: product.id,
         type: "in",
         qty_change: 1,
@@ -1,5 +1,5 @@
 import React, { useEffect, useMemo, useRef, useState } from "react";
-import { api } from "../api"; // usa il tuo helper esistente
+import { api, postIdempotent } from "../api"; // usa il tuo helper esistente
 import { useLocationSelection } from "../contexts/LocationContext";
 import ScanInput from "../components/ScanInput";
 import BarcodeModal from "../components/BarcodeModal";
@@ -12,6 +12,7 @@ type Product = {
   brand?: string;
   price?: number;
   image_url?: string;
+  image_thumb_url?: string | null;
   is_active?: boolean;
   stock?: { location_id: number; qty: number }[];
   total_qty?: number;
@@ -211,7 +212,8 @@ export default function ProductsPage() {
           <div key={p.id} className="card flex gap-3 items-center">
             {p.image_url ? (
               <img
-                src={p.image_url}
+                src={p.image_thumb_url || p.image_url}
+                loading="lazy"
                 alt=""
                 style={{
                   width: 90,
@@ -289,7 +291,7 @@ export default function ProductsPage() {
                     return;
                   }
                   try {
-                    await api.post("/stock/movement", {
+                    await postIdempotent("/stock/movement", {
                       product_id: p.id,
                       type: "sell",
                       qty_change: 1,
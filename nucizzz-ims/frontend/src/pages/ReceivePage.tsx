@@ -1,6 +1,6 @@
 // frontend/src/pages/ReceivePage.tsx
 import React, { useRef, useState } from "react";
-import { api } from "../api";
+import { api, postIdempotent } from "../api";
 import { lookupBarcode } from "../lib/barcode-lookup";
 import { useLocationSelection } from "../contexts/LocationContext";
 import ScanInput from "../components/ScanInput";
@@ -51,7 +51,7 @@ export default function ReceivePage() {
     setMsg(null);
     setErr(null);
     try {
-      await api.post("/stock/movement", {
+      await postIdempotent("/stock/movement", {
         product_id: existingProduct.id,
         type: "in",
         qty_change: addStockQty,
@@ -77,7 +77,7 @@ export default function ReceivePage() {
     setMsg(null);
     setErr(null);
     try {
-      const res = await api.post("/products/receive", {
+      const res = await postIdempotent("/products/receive", {
         ...form,
         price_eur: form.price_eur ? Number(form.price_eur) : null,
         cost_eur: form.cost_eur ? Number(form.cost_eur) : null,
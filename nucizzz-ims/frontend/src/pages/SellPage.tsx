@@ -1,5 +1,5 @@
 import React, { useCallback, useEffect, useRef, useState } from "react";
-import { api } from "../api";
+import { api, postIdempotent } from "../api";
 import { useLocationSelection } from "../contexts/LocationContext";
 import ScanInput from "../components/ScanInput";
 import BarcodeModal from "../components/BarcodeModal";
@@ -121,7 +121,7 @@ export default function SellPage() {
     }
     setIsSelling(true);
     try {
-      await api.post("/stock/movement", {
+      await postIdempotent("/stock/movement", {
         product_id: product.id,
         type: "sell",
         qty_change: qty,
@@ -1,5 +1,5 @@
 import React, { useState } from "react";
-import { api } from "../api";
+import { postIdempotent } from "../api";
 
 export default function TransfersPage() {
   const [form, setForm] = useState({
@@ -16,7 +16,7 @@ export default function TransfersPage() {
 
   async function submit() {
     try {
-      await api.post("/stock/movement", {
+      await postIdempotent("/stock/movement", {
         product_id: Number(form.product_id),
         type: "transfer",
         qty_change: Number(form.qty),